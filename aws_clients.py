@@ -0,0 +1,141 @@
+"""
+Client factory used by every module instead of calling boto3.client/resource directly.
+
+AWS_BACKEND selects where the clients go:
+  aws    (default) ordinary boto3 clients for REGION
+  local  the in-process backend in local_aws.py: no network and no credentials,
+         S3 events and Lambda invocations run the handlers in this process
+
+Clients, resources and Table handles are created once and kept for the life of the
+container, so warm invocations reuse their connections instead of opening new ones.
+Every client gets the same botocore configuration: keep-alive, adaptive retries and
+a connection pool. Handlers whose worker threads share a client pass their concurrency
+as max_pool_connections, since botocore's pool of 10 otherwise makes threads wait for
+(or discard) connections.
+
+The region comes from AWS_REGION (set by Lambda) or AWS_DEFAULT_REGION. Endpoints are
+the regional endpoints botocore derives from it; AWS_ENDPOINT_URL or
+AWS_ENDPOINT_URL_<SERVICE> override them, e.g. for a VPC endpoint.
+"""
+import os
+import threading
+import boto3
+from botocore.config import Config
+import metrics
+
+BACKEND = os.environ.get('AWS_BACKEND', 'aws')
+REGION = os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or 'us-east-2'
+# Connections kept per client unless the caller asks for more
+MAX_POOL_CONNECTIONS = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '10'))
+# 'adaptive' adds client-side rate limiting on throttling errors to the 'standard' retries
+RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'adaptive')
+MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '5'))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get('AWS_CONNECT_TIMEOUT_SECONDS', '5'))
+READ_TIMEOUT_SECONDS = float(os.environ.get('AWS_READ_TIMEOUT_SECONDS', '30'))
+
+_default_session = None
+_session_lock = threading.Lock()
+# Clients are thread-safe and shared by every thread: (service, pool size) -> client
+_clients = {}
+# Resources are not, so the main thread's are kept here and each other thread keeps its own
+_main_handles = {}
+_thread_state = threading.local()
+
+
+def client_config(max_pool_connections=None):
+    return Config(
+        region_name=REGION,
+        max_pool_connections=max(max_pool_connections or 0, MAX_POOL_CONNECTIONS),
+        tcp_keepalive=True,
+        retries={'mode': RETRY_MODE, 'max_attempts': MAX_ATTEMPTS},
+        connect_timeout=CONNECT_TIMEOUT_SECONDS,
+        read_timeout=READ_TIMEOUT_SECONDS
+    )
+
+
+def new_session():
+    """
+    A fresh boto3 session for the selected backend.
+    boto3 resources are not thread-safe, so worker threads each create their own.
+    """
+    session = boto3.session.Session(region_name=REGION)
+    metrics.install(session)
+    if BACKEND == 'local':
+        import local_aws
+        local_aws.install(session)
+    elif BACKEND != 'aws':
+        raise ValueError(f"Unknown AWS_BACKEND '{BACKEND}', expected 'aws' or 'local'")
+    return session
+
+
+def default_session():
+    global _default_session
+    with _session_lock:
+        if _default_session is None:
+            _default_session = new_session()
+        return _default_session
+
+
+def thread_handles():
+    """
+    (session, handle cache) of the calling thread: the default session on the main thread,
+    elsewhere a session of the thread's own, kept as long as the thread lives.
+    """
+    if threading.current_thread() is threading.main_thread():
+        return default_session(), _main_handles
+    if not hasattr(_thread_state, 'session'):
+        _thread_state.session = new_session()
+        _thread_state.handles = {}
+    return _thread_state.session, _thread_state.handles
+
+
+def client(service_name, session=None, max_pool_connections=None):
+    """
+    A configured client. Without a session, the shared client of the default session
+    is returned, created on first use; max_pool_connections sizes its pool for callers
+    that use it from that many threads at once.
+    """
+    if session is not None:
+        return session.client(service_name, config=client_config(max_pool_connections))
+    key = (service_name, max(max_pool_connections or 0, MAX_POOL_CONNECTIONS))
+    with _session_lock:
+        cached = _clients.get(key)
+    if cached is None:
+        cached = default_session().client(service_name, config=client_config(max_pool_connections))
+        with _session_lock:
+            cached = _clients.setdefault(key, cached)
+    return cached
+
+
+def resource(service_name, session=None):
+    """A configured resource; without a session, the calling thread's cached one."""
+    if session is not None:
+        return session.resource(service_name, config=client_config())
+    session, handles = thread_handles()
+    if service_name not in handles:
+        handles[service_name] = session.resource(service_name, config=client_config())
+    return handles[service_name]
+
+
+def table(table_name):
+    """The calling thread's cached DynamoDB Table handle."""
+    _, handles = thread_handles()
+    key = ('table', table_name)
+    if key not in handles:
+        handles[key] = resource('dynamodb').Table(table_name)
+    return handles[key]
+
+
+def query_items(table_handle, before_page=None, **query_kwargs):
+    """
+    Yield the items of a query page by page, following LastEvaluatedKey.
+    before_page, if given, is called before each page is requested, e.g. to rate limit.
+    """
+    while True:
+        if before_page is not None:
+            before_page()
+        response = table_handle.query(**query_kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
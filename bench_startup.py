@@ -0,0 +1,61 @@
+"""
+Startup benchmark for the plotting Lambda.
+
+Each run starts a fresh interpreter (a cold start) and reports how long importing
+plotting_lambda takes, how long the first render takes (which pays for the lazy
+matplotlib import), and how long a warm render on the reused figure takes.
+No AWS calls are made.
+
+    python bench_startup.py --runs 5 --points 1000 --renderer fast
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+CHILD = r'''
+import json, sys, time
+started = time.perf_counter()
+import plotting_lambda
+imported = time.perf_counter()
+matplotlib_at_import = 'matplotlib' in sys.modules
+
+points = int(sys.argv[1])
+renderer = sys.argv[2]
+times = [-10 + 10 * i / points for i in range(points)]
+sizes = [1000 + (i % 50) * 10 for i in range(points)]
+charts = [plotting_lambda.build_chart(times, sizes, 1500, 10)]
+plotting_lambda.render_chart(charts, renderer, 'png')
+first = time.perf_counter()
+plotting_lambda.render_chart(charts, renderer, 'png')
+warm = time.perf_counter()
+
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_render_ms': (first - imported) * 1000,
+    'warm_render_ms': (warm - first) * 1000,
+    'matplotlib_loaded_at_import': matplotlib_at_import
+}))
+'''
+
+
+def run_once(points, renderer):
+    output = subprocess.run([sys.executable, '-c', CHILD, str(points), renderer], check=True,
+                            capture_output=True, text=True).stdout
+    # The JSON summary is the last line of the child's output
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--renderer', choices=('matplotlib', 'fast'), default='matplotlib')
+    args = parser.parse_args()
+
+    results = [run_once(args.points, args.renderer) for _ in range(args.runs)]
+    for name in ('import_ms', 'first_render_ms', 'warm_render_ms'):
+        values = [result[name] for result in results]
+        print(f"{name:>16}: median {statistics.median(values):8.1f}  min {min(values):8.1f}  max {max(values):8.1f}")
+    print(f"matplotlib imported at module load: {results[0]['matplotlib_loaded_at_import']}")
@@ -0,0 +1,307 @@
+"""
+End-to-end benchmarks of the size-tracking and plotting handlers on the local backend.
+
+Every case runs against a fresh in-process backend (AWS_BACKEND=local, see local_aws.py),
+so results are repeatable on a laptop or CI box and need no AWS account. Scenarios:
+
+  tracker   size_track.lambda_handler applying one event of `burst` records to a bucket
+            of `objects` objects that has already been counted (incremental mode)
+  recount   size_track.lambda_handler doing a full recount of a bucket of `objects` objects
+  plotting  plotting_lambda.lambda_handler over a `history`-sample history for a `window`-second
+            window of raw samples; the rendered plot is deleted between runs so none is cached
+  render    plotting_lambda.render_chart of a single series of `points` points
+  clients   one GetItem on the summary table, per-call cost of obtaining the Table with
+            `handles`: 'session' (new session and resource per call, as worker threads did),
+            'table' (new Table from a module-level resource per call, as the handlers did)
+            or 'cached' (aws_clients.table); run it with many repetitions, e.g. 200
+
+Each case reports p50/p95/p99 latency over the repetitions and, per invocation, the API
+calls by operation, DynamoDB items read/written and capacity units. Peak Python memory
+is measured with tracemalloc in one extra run, since tracing slows the measured runs.
+Absolute times include the emulation, so compare results across versions, not with AWS.
+
+    python benchmark.py --scenarios tracker,plotting --objects 1000,100000 --burst 1,100 \\
+        --history 10000,100000 --window 10,3600 --output results.json --baseline previous.json
+"""
+import os
+os.environ['AWS_BACKEND'] = 'local'
+
+import argparse
+import contextlib
+import gc
+import io
+import itertools
+import json
+import platform
+import random
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import aws_clients
+import local_aws
+import create_bucket_and_table
+import plotting_lambda
+import size_track
+import test
+
+BUCKET_NAME = 'testbucket-cs6620-lef'
+SCENARIOS = ('tracker', 'recount', 'plotting', 'render', 'clients')
+HANDLES = ('session', 'table', 'cached')
+# Keys are spread over this many top-level prefixes, the unit a recount is parallelised on
+OBJECT_PREFIXES = 100
+
+
+def percentile_summary(latencies):
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'count': len(ordered), 'p50': pick(0.5), 'p95': pick(0.95), 'p99': pick(0.99),
+            'max': ordered[-1], 'mean': round(sum(ordered) / len(ordered), 3)}
+
+
+def fresh_environment():
+    """A new backend with the buckets and the three tables, as main.py provisions them."""
+    local_aws.reset()
+    with contextlib.redirect_stdout(io.StringIO()):
+        create_bucket_and_table.create_s3_bucket(BUCKET_NAME)
+        create_bucket_and_table.create_s3_bucket(plotting_lambda.PLOT_BUCKET_NAME)
+        create_bucket_and_table.create_dynamodb_table(create_bucket_and_table.dynamodb_table_name)
+        create_bucket_and_table.create_ledger_table(create_bucket_and_table.ledger_table_name)
+        create_bucket_and_table.create_summary_table(create_bucket_and_table.summary_table_name)
+    return local_aws.backend()
+
+
+def object_key(n):
+    return f'objects/p{n % OBJECT_PREFIXES:03d}/obj{n:09d}'
+
+
+def fill_bucket(backend, objects, rng):
+    backend.put_objects_bulk(BUCKET_NAME, ((object_key(n), rng.randint(1, 1 << 20)) for n in range(objects)))
+
+
+def measure(run, repetitions, backend, before=None):
+    """
+    Time `repetitions` calls of run() and count the backend work they cause, then
+    repeat once under tracemalloc for peak memory. before() prepares each call untimed.
+    """
+    def one_call():
+        if before:
+            before()
+        gc.collect()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()
+        latency = (time.perf_counter() - started) * 1000
+        backend.wait_idle()
+        return latency
+
+    one_call()  # warm-up: imports, figure creation, thread pools
+    backend.reset_stats()
+    latencies = [one_call() for _ in range(repetitions)]
+    stats = backend.stats()
+
+    tracemalloc.start()
+    try:
+        one_call()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    per_call = lambda value: round(value / repetitions, 2)
+    return {
+        'latency_ms': {name: round(value, 3) if isinstance(value, float) else value
+                       for name, value in percentile_summary(latencies).items()},
+        'api_calls': {operation: per_call(count) for operation, count in sorted(stats['calls'].items())},
+        'items_read': per_call(stats['items_read']),
+        'items_written': per_call(stats['items_written']),
+        'read_units': per_call(stats['read_units']),
+        'write_units': per_call(stats['write_units']),
+        'peak_memory_bytes': peak_memory
+    }
+
+
+def bench_tracker(objects, burst, repetitions, seed):
+    backend = fresh_environment()
+    rng = random.Random(seed)
+    fill_bucket(backend, objects, rng)
+    with contextlib.redirect_stdout(io.StringIO()):
+        size_track.full_recount(BUCKET_NAME)
+
+    event = {}
+
+    def before():
+        # A burst of overwrites of existing keys, applied to the bucket and described by one event
+        changed = [(object_key(rng.randrange(objects)), rng.randint(1, 1 << 20)) for _ in range(burst)]
+        backend.put_objects_bulk(BUCKET_NAME, changed)
+        event['Records'] = [backend.event_record(BUCKET_NAME, 'ObjectCreated:Put', key, size, f'{size:032x}')
+                            for key, size in changed]
+
+    return measure(lambda: size_track.lambda_handler(event, None), repetitions, backend, before)
+
+
+def bench_recount(objects, repetitions, seed):
+    backend = fresh_environment()
+    fill_bucket(backend, objects, random.Random(seed))
+    event = {'Records': [backend.event_record(BUCKET_NAME, 'ObjectCreated:Put', object_key(0), 1, '0' * 32)]}
+    tracking_mode = size_track.TRACKING_MODE
+    size_track.TRACKING_MODE = 'full'
+    try:
+        return measure(lambda: size_track.lambda_handler(event, None), repetitions, backend)
+    finally:
+        size_track.TRACKING_MODE = tracking_mode
+
+
+def bench_plotting(history, window, interval_ms, renderer, repetitions, seed):
+    backend = fresh_environment()
+    end_timestamp = int(datetime.now().timestamp() * 1000)
+    test.seed_range(BUCKET_NAME, history, end_timestamp, interval_ms, seed)
+    # The summary item the tracker maintains, so the historical max is a single GetItem
+    aws_clients.table(size_track.SUMMARY_TABLE_NAME).put_item(Item={
+        'bucket_name': BUCKET_NAME, 'total_size': 0, 'object_count': 0,
+        'max_size': 1 << 40, 'max_size_at': end_timestamp
+    })
+    event = {'queryStringParameters': {'buckets': BUCKET_NAME, 'window': str(window),
+                                       'resolution': 'raw', 'renderer': renderer}}
+
+    def run():
+        response = plotting_lambda.lambda_handler(event, None)
+        if response['statusCode'] != 200:
+            raise RuntimeError(f"Plotting failed: {response['body']}")
+        # Content-addressed plots would be cache hits from the second run on
+        plotting_lambda.s3_client.delete_object(Bucket=plotting_lambda.PLOT_BUCKET_NAME, Key=json.loads(response['body'])['key'])
+
+    return measure(run, repetitions, backend)
+
+
+def bench_render(points, renderer, repetitions, seed):
+    backend = fresh_environment()
+    rng = np.random.default_rng(seed)
+    window = 3600
+    relative_times = np.linspace(-window, 0, points)
+    sizes = np.cumsum(rng.integers(-50000, 50000, points)) + (1 << 30)
+    charts = [plotting_lambda.build_chart(relative_times, sizes, int(sizes.max()), window)]
+    return measure(lambda: plotting_lambda.render_chart(charts, renderer, 'png'), repetitions, backend)
+
+
+def bench_clients(handles, repetitions, seed):
+    backend = fresh_environment()
+    aws_clients.table(size_track.SUMMARY_TABLE_NAME).put_item(Item={
+        'bucket_name': BUCKET_NAME, 'total_size': seed, 'object_count': 1
+    })
+    dynamodb = aws_clients.resource('dynamodb')
+    tables = {
+        'session': lambda: aws_clients.resource('dynamodb', aws_clients.new_session()).Table(size_track.SUMMARY_TABLE_NAME),
+        'table': lambda: dynamodb.Table(size_track.SUMMARY_TABLE_NAME),
+        'cached': lambda: aws_clients.table(size_track.SUMMARY_TABLE_NAME)
+    }
+    table = tables[handles]
+    return measure(lambda: table().get_item(Key={'bucket_name': BUCKET_NAME}), repetitions, backend)
+
+
+def cases(args):
+    """(scenario, parameters) for every combination of the requested parameter values."""
+    for scenario in args.scenarios:
+        if scenario == 'tracker':
+            for objects, burst in itertools.product(args.objects, args.burst):
+                yield scenario, {'objects': objects, 'burst': burst}
+        elif scenario == 'recount':
+            for objects in args.objects:
+                yield scenario, {'objects': objects}
+        elif scenario == 'plotting':
+            for history, window in itertools.product(args.history, args.window):
+                yield scenario, {'history': history, 'window': window, 'interval_ms': args.interval_ms,
+                                 'renderer': args.renderer}
+        elif scenario == 'render':
+            for points in args.points:
+                yield scenario, {'points': points, 'renderer': args.renderer}
+        elif scenario == 'clients':
+            for handles in args.handles:
+                yield scenario, {'handles': handles}
+
+
+def run_case(scenario, parameters, repetitions, seed):
+    runners = {'tracker': bench_tracker, 'recount': bench_recount, 'plotting': bench_plotting, 'render': bench_render,
+               'clients': bench_clients}
+    return runners[scenario](**parameters, repetitions=repetitions, seed=seed)
+
+
+def case_name(scenario, parameters):
+    return scenario + ''.join(f' {name}={value}' for name, value in parameters.items())
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print the latency change of every case that is also in the baseline."""
+    previous = {case_name(r['scenario'], r['parameters']): r for r in baseline['results']}
+    print(f"\nCompared with {baseline.get('revision') or 'baseline'}:")
+    for result in results:
+        name = case_name(result['scenario'], result['parameters'])
+        if name not in previous:
+            continue
+        old, new = previous[name]['latency_ms'], result['latency_ms']
+        changes = ', '.join(f"{q} {old[q]:.1f} -> {new[q]:.1f} ms ({(new[q] - old[q]) / max(old[q], 1e-9):+.0%})"
+                            for q in ('p50', 'p95', 'p99'))
+        print(f"  {name}: {changes}")
+
+
+def parse_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', type=lambda value: value.split(','), default=list(SCENARIOS))
+    parser.add_argument('--objects', type=parse_list, default=[1000, 100000], help='bucket sizes (tracker, recount)')
+    parser.add_argument('--burst', type=parse_list, default=[1, 100], help='records per event (tracker)')
+    parser.add_argument('--history', type=parse_list, default=[10000, 100000], help='history samples (plotting)')
+    parser.add_argument('--window', type=parse_list, default=[10, 3600], help='window seconds (plotting)')
+    parser.add_argument('--points', type=parse_list, default=[1000, 10000, 100000], help='series points (render)')
+    parser.add_argument('--handles', type=lambda value: value.split(','), default=list(HANDLES),
+                        help=f'how the Table is obtained (clients): {",".join(HANDLES)}')
+    parser.add_argument('--interval-ms', type=int, default=1000, help='spacing of the seeded history samples')
+    parser.add_argument('--renderer', default=plotting_lambda.DEFAULT_RENDERER, choices=plotting_lambda.RENDERERS)
+    parser.add_argument('--repetitions', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='results file of an earlier run to compare with')
+    args = parser.parse_args()
+    unknown = [scenario for scenario in args.scenarios if scenario not in SCENARIOS]
+    if unknown:
+        parser.error(f'unknown scenarios {unknown}; choose from {list(SCENARIOS)}')
+    unknown = [handles for handles in args.handles if handles not in HANDLES]
+    if unknown:
+        parser.error(f'unknown handles {unknown}; choose from {list(HANDLES)}')
+
+    results = []
+    for scenario, parameters in cases(args):
+        started = time.perf_counter()
+        measurement = run_case(scenario, parameters, args.repetitions, args.seed)
+        results.append({'scenario': scenario, 'parameters': parameters, **measurement})
+        latency = measurement['latency_ms']
+        print(f"{case_name(scenario, parameters)}: p50 {latency['p50']:.1f} ms, p95 {latency['p95']:.1f} ms, "
+              f"p99 {latency['p99']:.1f} ms, {sum(measurement['api_calls'].values()):.0f} calls, "
+              f"{measurement['read_units']} RCU, {measurement['peak_memory_bytes'] / 2**20:.1f} MiB peak "
+              f"({time.perf_counter() - started:.0f}s)")
+
+    report = {
+        'revision': git_revision(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'repetitions': args.repetitions,
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,19 @@
+"""
+Build the matplotlib font cache that is shipped in mplconfig/ with the plotting Lambda.
+
+The cache stores absolute font paths, so run this inside the Lambda runtime image
+with the matplotlib layer mounted at /opt (the same paths the function sees), e.g.
+    docker run --rm -v "$PWD":/var/task -v <layer>:/opt --entrypoint python3 \
+        public.ecr.aws/lambda/python:3.11 /var/task/build_font_cache.py
+"""
+import os
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mplconfig')
+
+os.makedirs(CONFIG_DIR, exist_ok=True)
+os.environ['MPLCONFIGDIR'] = CONFIG_DIR
+
+# Importing font_manager builds the font list and writes it to MPLCONFIGDIR
+from matplotlib import font_manager
+
+print(f"✅ Font cache with {len(font_manager.fontManager.ttflist)} fonts written to {CONFIG_DIR}: {os.listdir(CONFIG_DIR)}")
@@ -0,0 +1,219 @@
+"""
+Compaction of size history rows before their TTL removes them.
+
+Raw samples and rollup slots carry an expires_at TTL from HISTORY_RETENTION, so the
+history table only holds a bounded window of each level. Rollups are normally kept up
+to date as samples are written. Samples written with rollups turned off, or history
+seeded directly, would otherwise disappear without leaving coarser rows behind. So
+each level that expires is folded into the next coarser rollup resolution that is
+kept longer, once its rows are half way to expiry:
+
+    raw (7d) -> 1m (30d) -> 1h (400d) -> 1d (kept)
+    1s  (1d) -> 1m
+
+A slot is only written when it is missing or counts fewer samples than the rows
+folded into it, so slots the tracker already maintains are left alone. How far each
+level has been compacted is kept on the bucket's summary item (compacted_<level>_through).
+Each run therefore reads only the rows that aged past the threshold since the last
+run, whatever the age of the deployment.
+
+main.py deploys lambda_handler as the 'compaction' function, with its own role, and
+schedules it more often than half the shortest retention (rate(1 hour)); the event may
+name {"buckets": [...]}.
+It can also be run by hand:
+
+    python compaction.py --bucket my-bucket
+"""
+import argparse
+import heapq
+import json
+import os
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Key, Attr
+import aws_clients
+import metrics
+import size_track
+from rollups import (RAW_RESOLUTION, RESOLUTIONS, SLOT_ATTRIBUTES, TTL_ATTRIBUTE, combine_slots, expires_at, level_partitions,
+                     rollup_partition)
+
+# Buckets compacted when the event does not name any
+COMPACTION_BUCKETS = [b for b in os.environ.get('COMPACTION_BUCKETS', size_track.BUCKET_NAME).split(',') if b]
+# Rows are folded once this fraction of their retention has passed
+COMPACTION_AGE_FRACTION = 0.5
+
+
+def compaction_targets(resolutions, retention):
+    """
+    (level, target resolution) for every level that expires: the next coarser
+    rollup resolution that is kept longer, or None if there is none to fold into.
+    """
+    levels = [RAW_RESOLUTION] + sorted(resolutions, key=RESOLUTIONS.get)
+    targets = []
+    for i, level in enumerate(levels):
+        if level not in retention:
+            continue
+        target = next((coarser for coarser in levels[i + 1:]
+                       if coarser not in retention or retention[coarser] > retention[level]), None)
+        targets.append((level, target))
+    return targets
+
+
+def query_rows(table, partition, start_timestamp, end_timestamp):
+    """Rows of one partition with start <= timestamp < end, in timestamp order."""
+    return aws_clients.query_items(
+        table, KeyConditionExpression=Key('bucket_name').eq(partition) & Key('timestamp').between(start_timestamp, end_timestamp - 1)
+    )
+
+
+def oldest_timestamp(table, bucket_name, level):
+    oldest = None
+    for partition in level_partitions(bucket_name, level, size_track.HISTORY_SHARDS):
+        response = table.query(KeyConditionExpression=Key('bucket_name').eq(partition), Limit=1)
+        for item in response.get('Items', []):
+            oldest = int(item['timestamp']) if oldest is None else min(oldest, int(item['timestamp']))
+    return oldest
+
+
+def as_slot(row, level):
+    """A raw sample or a rollup slot, in rollup slot form."""
+    if level != RAW_RESOLUTION:
+        return {name: int(row[name]) for name in SLOT_ATTRIBUTES}
+    size, count = int(row['size']), int(row.get('object_count', 0))
+    return {'sample_count': 1, 'size_sum': size, 'size_min': size, 'size_max': size, 'size_last': size,
+            'object_count_sum': count, 'object_count_min': count, 'object_count_max': count,
+            'object_count_last': count, 'last_at': int(row['timestamp'])}
+
+
+def folded_slots(rows, level, width):
+    """Group rows (in timestamp order) into slots of the given width: yields (slot timestamp, slot)."""
+    current, slot = None, None
+    for row in rows:
+        timestamp = int(row['timestamp'])
+        start = timestamp - timestamp % width
+        if start != current:
+            if slot is not None:
+                yield current, slot
+            current, slot = start, as_slot(row, level)
+        else:
+            slot = combine_slots(slot, as_slot(row, level))
+    if slot is not None:
+        yield current, slot
+
+
+def merged_rows(table, partitions, start_timestamp, end_timestamp):
+    """Rows of several partitions with start <= timestamp < end, merged into timestamp order."""
+    return heapq.merge(*(query_rows(table, partition, start_timestamp, end_timestamp) for partition in partitions),
+                       key=lambda row: row['timestamp'])
+
+
+def compact_level(table, bucket_name, level, target, start_timestamp, end_timestamp, retention):
+    """
+    Fold the rows of level in [start, end) into target slots. Writes the slots that are
+    missing or count fewer samples, each conditional on the slot not having changed
+    since it was read. Returns the number of slots written.
+    A sharded bucket's slot is counted across its shards; a rewritten slot goes to the
+    unsharded partition and replaces the shards' partial copies.
+    """
+    width = RESOLUTIONS[target]
+    partition = rollup_partition(bucket_name, target)
+    rows = merged_rows(table, level_partitions(bucket_name, level, size_track.HISTORY_SHARDS), start_timestamp, end_timestamp)
+    existing = merged_rows(table, level_partitions(bucket_name, target, size_track.HISTORY_SHARDS),
+                           start_timestamp, end_timestamp)
+    current = next(existing, None)
+
+    written = 0
+    for timestamp, slot in folded_slots(rows, level, width):
+        stored = []
+        while current is not None and int(current['timestamp']) <= timestamp:
+            if int(current['timestamp']) == timestamp:
+                stored.append(current)
+            current = next(existing, None)
+        if sum(int(copy['sample_count']) for copy in stored) >= slot['sample_count']:
+            continue
+        unsharded = next((copy for copy in stored if copy['bucket_name'] == partition), None)
+        item = {'bucket_name': partition, 'timestamp': timestamp, **slot}
+        expiry = expires_at(retention, target, timestamp)
+        if expiry is not None:
+            item[TTL_ATTRIBUTE] = expiry
+        try:
+            # Shard copies go first: if anything fails part way, the slot counts too few samples
+            # and is rewritten on the next run, rather than counting some samples twice
+            for copy in stored:
+                if copy is not unsharded:
+                    table.delete_item(Key={'bucket_name': copy['bucket_name'], 'timestamp': timestamp},
+                                      ConditionExpression=Attr('sample_count').eq(copy['sample_count']))
+            table.put_item(
+                Item=item,
+                ConditionExpression=Attr('sample_count').eq(unsharded['sample_count']) if unsharded is not None
+                else Attr('bucket_name').not_exists()
+            )
+            written += 1
+        except ClientError as e:
+            # The tracker updated the slot meanwhile; it is covered again on the next run
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    return written
+
+
+def compact(bucket_name, now=None, resolutions=None, retention=None):
+    """Compact every expiring level of one bucket up to its age threshold; returns {level: slots written}."""
+    now = now if now is not None else size_track.current_timestamp()
+    resolutions = resolutions if resolutions is not None else size_track.ROLLUP_RESOLUTIONS
+    retention = retention if retention is not None else size_track.HISTORY_RETENTION
+    table = aws_clients.table(size_track.DYNAMODB_TABLE_NAME)
+    summary_table = aws_clients.table(size_track.SUMMARY_TABLE_NAME)
+    summary = summary_table.get_item(Key={'bucket_name': bucket_name}, ConsistentRead=True).get('Item', {})
+
+    report = {}
+    for level, target in compaction_targets(resolutions, retention):
+        if target is None:
+            print(f"⚠️ {bucket_name} {level} rows expire without a longer-kept resolution to fold into")
+            continue
+        width = RESOLUTIONS[target]
+        threshold = now - int(retention[level] * COMPACTION_AGE_FRACTION)
+        end_timestamp = threshold - threshold % width
+        progress = f'compacted_{level}_through'
+        start_timestamp = int(summary[progress]) if progress in summary else oldest_timestamp(table, bucket_name, level)
+        if start_timestamp is None or start_timestamp >= end_timestamp:
+            continue
+        start_timestamp -= start_timestamp % width
+
+        report[level] = compact_level(table, bucket_name, level, target, start_timestamp, end_timestamp, retention)
+        summary_table.update_item(
+            Key={'bucket_name': bucket_name},
+            UpdateExpression=f'SET {progress} = :through',
+            ExpressionAttributeValues={':through': end_timestamp}
+        )
+        metrics.debug(f"Compacted {bucket_name} {level} rows up to {end_timestamp} into {target}: "
+                      f"{report[level]} slots written")
+    return report
+
+
+@metrics.instrumented('compaction')
+def lambda_handler(event, context):
+    buckets = (event or {}).get('buckets') or COMPACTION_BUCKETS
+    metrics.annotate(buckets=len(buckets))
+    try:
+        with metrics.phase('compact'):
+            reports = {bucket_name: compact(bucket_name) for bucket_name in buckets}
+        metrics.annotate(slots_written=sum(sum(report.values()) for report in reports.values()))
+        return {
+            'statusCode': 200,
+            'body': json.dumps(reports)
+        }
+
+    except ClientError as e:
+        print(f"Error occurred: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Error: {e}")
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bucket', action='append', help='bucket to compact (repeatable)')
+    args = parser.parse_args()
+
+    for bucket_name in args.bucket or COMPACTION_BUCKETS:
+        print(f"✅ {bucket_name}: {compact(bucket_name)}")
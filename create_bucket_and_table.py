@@ -1,13 +1,13 @@
-import boto3
 from botocore.exceptions import ClientError
 import json
-import time
+import aws_clients
+from rollups import TTL_ATTRIBUTE
 
-# Initialize clients for IAM, Lambda, S3, and DynamoDB
-iam_client = boto3.client('iam')
-lambda_client = boto3.client('lambda', region_name='us-east-2')
-s3_client = boto3.client('s3', region_name='us-east-2')
-dynamodb_resource = boto3.resource('dynamodb', region_name='us-east-2')
+# Initialize clients for IAM, Lambda and S3. The table steps run concurrently, and boto3
+# resources are not thread safe, so each one gets the calling thread's DynamoDB resource.
+iam_client = aws_clients.client('iam')
+lambda_client = aws_clients.client('lambda')
+s3_client = aws_clients.client('s3')
 
 # Role and Lambda details
 ROLE_ARNS = {
@@ -25,15 +25,56 @@ LAMBDA_NAMES = {
 # Create an S3 bucket
 def create_s3_bucket(bucket_name):
     try:
-        s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
+        # us-east-1 is the default location and must not be named as a constraint
+        location = {} if aws_clients.REGION == 'us-east-1' else {'CreateBucketConfiguration': {'LocationConstraint': aws_clients.REGION}}
+        s3_client.create_bucket(Bucket=bucket_name, **location)
         print(f"✅ Bucket '{bucket_name}' created successfully.")
     except ClientError as e:
+        if e.response['Error']['Code'] == 'BucketAlreadyOwnedByYou':
+            print(f"✅ Bucket '{bucket_name}' already exists.")
+            return
         print(f"❌ Error creating bucket: {e}")
+        raise
+
+# Expire plots under prefix after days. Plots are content-addressed, so a superseded one is never
+# read again; without a rule every distinct render would be kept forever.
+def expire_plots(bucket_name, prefix, days):
+    s3_client.put_bucket_lifecycle_configuration(
+        Bucket=bucket_name,
+        LifecycleConfiguration={'Rules': [{
+            'ID': 'expire-plots',
+            'Filter': {'Prefix': prefix},
+            'Status': 'Enabled',
+            'Expiration': {'Days': days}
+        }]}
+    )
+    print(f"✅ Objects under '{prefix}' in bucket '{bucket_name}' expire after {days} days.")
+
+# Wait for a table to become ACTIVE.
+# Table.wait_until_exists() polls only every 20 seconds, which dominates a bring-up.
+def wait_for_table(table_name):
+    aws_clients.resource('dynamodb').meta.client.get_waiter('table_exists').wait(
+        TableName=table_name,
+        WaiterConfig={'Delay': 2, 'MaxAttempts': 150}
+    )
+
+# Turn on DynamoDB TTL for a table; rows whose attribute (epoch seconds) has passed are deleted
+def enable_ttl(table_name, attribute):
+    client = aws_clients.resource('dynamodb').meta.client
+    description = client.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+    if description.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING') and description.get('AttributeName') == attribute:
+        print(f"✅ TTL on '{attribute}' already enabled for table '{table_name}'.")
+        return
+    client.update_time_to_live(
+        TableName=table_name,
+        TimeToLiveSpecification={'Enabled': True, 'AttributeName': attribute}
+    )
+    print(f"✅ TTL on '{attribute}' enabled for table '{table_name}'.")
 
 # Create a DynamoDB table named 'S3-object-size-history'
 def create_dynamodb_table(table_name):
     try:
-        table = dynamodb_resource.create_table(
+        table = aws_clients.resource('dynamodb').create_table(
             TableName=table_name,
             KeySchema=[
                 {
@@ -87,20 +128,113 @@ def create_dynamodb_table(table_name):
             ]
         )
         print(f"✅ Table '{table_name}' is creating...")
-        table.wait_until_exists()
+        wait_for_table(table_name)
+        print(f"✅ Table '{table_name}' created successfully.")
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceInUseException':
+            print(f"❌ Error creating table: {e}")
+            raise
+        print(f"✅ Table '{table_name}' already exists.")
+        wait_for_table(table_name)
+    # Raw samples and rollup slots expire according to size_track's HISTORY_RETENTION
+    enable_ttl(table_name, TTL_ATTRIBUTE)
+
+# Create the per-key size ledger used by the incremental size tracker
+def create_ledger_table(table_name):
+    try:
+        table = aws_clients.resource('dynamodb').create_table(
+            TableName=table_name,
+            KeySchema=[
+                {
+                    'AttributeName': 'bucket_name',
+                    'KeyType': 'HASH'  # Partition key
+                },
+                {
+                    'AttributeName': 'object_key',
+                    'KeyType': 'RANGE'  # Sort key
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'bucket_name',
+                    'AttributeType': 'S'
+                },
+                {
+                    'AttributeName': 'object_key',
+                    'AttributeType': 'S'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 5,
+                'WriteCapacityUnits': 5
+            }
+        )
+        print(f"✅ Table '{table_name}' is creating...")
+        wait_for_table(table_name)
         print(f"✅ Table '{table_name}' created successfully.")
     except ClientError as e:
+        if e.response['Error']['Code'] != 'ResourceInUseException':
+            print(f"❌ Error creating table: {e}")
+            raise
+        print(f"✅ Table '{table_name}' already exists.")
+        wait_for_table(table_name)
+    # Tombstones of deleted keys expire after size_track's LEDGER_TOMBSTONE_RETENTION
+    enable_ttl(table_name, TTL_ATTRIBUTE)
+
+# Create the table holding one running-totals item per bucket
+def create_summary_table(table_name):
+    try:
+        table = aws_clients.resource('dynamodb').create_table(
+            TableName=table_name,
+            KeySchema=[
+                {
+                    'AttributeName': 'bucket_name',
+                    'KeyType': 'HASH'  # Partition key
+                }
+            ],
+            AttributeDefinitions=[
+                {
+                    'AttributeName': 'bucket_name',
+                    'AttributeType': 'S'
+                }
+            ],
+            ProvisionedThroughput={
+                'ReadCapacityUnits': 5,
+                'WriteCapacityUnits': 5
+            }
+        )
+        print(f"✅ Table '{table_name}' is creating...")
+        wait_for_table(table_name)
+        print(f"✅ Table '{table_name}' created successfully.")
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceInUseException':
+            print(f"✅ Table '{table_name}' already exists.")
+            wait_for_table(table_name)
+            return
         print(f"❌ Error creating table: {e}")
+        raise
 
 s3_bucket_name = 'testbucket-cs6620-lef'
+plot_bucket_name = 'testbucket-cs6620-lef-plots'
+PLOT_PREFIX = 'plots/'
+PLOT_EXPIRATION_DAYS = 1
 dynamodb_table_name = 'S3-object-size-history'
+ledger_table_name = 'S3-object-size-ledger'
+summary_table_name = 'S3-bucket-size-summary'
+
 
+if __name__ == '__main__':
+    # Create S3 buckets
+    create_s3_bucket(s3_bucket_name)
+    create_s3_bucket(plot_bucket_name)
+    expire_plots(plot_bucket_name, PLOT_PREFIX, PLOT_EXPIRATION_DAYS)
 
-# Create S3 bucket
-create_s3_bucket(s3_bucket_name)
+    # Create DynamoDB table
+    create_dynamodb_table(dynamodb_table_name)
 
-# Create DynamoDB table
-create_dynamodb_table(dynamodb_table_name)
+    # Create ledger and summary tables for incremental tracking
+    create_ledger_table(ledger_table_name)
+    create_summary_table(summary_table_name)
 
 
 # import boto3
@@ -138,7 +272,7 @@ create_dynamodb_table(dynamodb_table_name)
 # # Create a DynamoDB table named 'S3-object-size-history'
 # def create_dynamodb_table(table_name):
 #     try:
-#         table = dynamodb_resource.create_table(
+#         table = aws_clients.resource('dynamodb').create_table(
 #             TableName=table_name,
 #             KeySchema=[
 #                 {
@@ -0,0 +1,86 @@
+import numpy as np
+
+# Supported ?downsample= methods
+METHODS = ('lttb', 'minmax', 'none')
+
+
+def target_points(figsize, dpi):
+    """One point per horizontal pixel of the rendered figure."""
+    return int(figsize[0] * dpi)
+
+
+def lttb_indices(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets: keep the first and last points and, from each of
+    the n_out - 2 buckets in between, the point forming the largest triangle with the
+    previously kept point and the average of the next bucket.
+    The bucket averages are computed for all buckets at once from cumulative sums;
+    each bucket's triangle areas are a single vectorized expression.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    lengths = ends - starts
+    avg_x = (cum_x[ends] - cum_x[starts]) / lengths
+    avg_y = (cum_y[ends] - cum_y[starts]) / lengths
+    # The bucket after the last one is the final point itself
+    next_x = np.append(avg_x[1:], x[-1])
+    next_y = np.append(avg_y[1:], y[-1])
+
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for b in range(n_out - 2):
+        bx = x[starts[b]:ends[b]]
+        by = y[starts[b]:ends[b]]
+        area = np.abs((x[a] - next_x[b]) * (by - y[a]) - (x[a] - bx) * (next_y[b] - y[a]))
+        a = starts[b] + int(np.argmax(area))
+        selected[b + 1] = a
+    return selected
+
+
+def minmax_indices(y, n_buckets):
+    """
+    Min/max decimation: split the series into n_buckets equal runs and keep the
+    lowest and highest point of each, so every peak and trough survives.
+    """
+    n = len(y)
+    if 2 * n_buckets >= n or n_buckets < 1:
+        return np.arange(n)
+
+    starts = (np.arange(n_buckets) * n + n_buckets - 1) // n_buckets
+    counts = np.diff(np.append(starts, n))
+    keep = []
+    for reduce in (np.minimum, np.maximum):
+        extreme = np.repeat(reduce.reduceat(y, starts), counts)
+        # First position in each bucket that holds the bucket's extreme value
+        hits = np.flatnonzero(y == extreme)
+        keep.append(hits[np.searchsorted(hits, starts)])
+    return np.unique(np.concatenate(keep))
+
+
+def downsample(x, y, n_out, method='lttb'):
+    """
+    Reduce (x, y) to about n_out points with the given method.
+    The global maximum and minimum are always kept so the plotted series stays
+    consistent with the historical high drawn next to it.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+    if method == 'none' or len(x) <= n_out:
+        return x, y
+
+    if method == 'lttb':
+        indices = lttb_indices(x, y, n_out - 2)
+    else:
+        indices = minmax_indices(y, max(1, (n_out - 2) // 2))
+    indices = np.union1d(indices, [np.argmax(y), np.argmin(y)])
+    return x[indices], y[indices]
@@ -1,69 +1,112 @@
 #driver
 
 import json
-import boto3
+import os
 import time
 import requests
 from botocore.exceptions import ClientError
+import aws_clients
+import metrics
+from workload import run_scenario
 
 
-# Initialize S3 client
-s3_client = boto3.client('s3', region_name='us-east-2')
+# Initialize S3 and Lambda clients; with the HTTP session they are reused by warm invocations
+s3_client = aws_clients.client('s3')
+lambda_client = aws_clients.client('lambda')
+http_session = requests.Session()
 
 # Environment variables
 BUCKET_NAME = 'testbucket-cs6620-lef'
-PLOTTING_API_URL = 'https://ftyoin29f1.execute-api.us-east-2.amazonaws.com/dev'
-def lambda_handler(event, context):
-    try:
-        # Step 1: Create object 'assignment1.txt' with initial content
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key='assignment1.txt',
-            Body='Empty Assignment 1'
-        )
-        print("Created 'assignment1.txt' with content: 'Empty Assignment 1'")
-
-        # Wait
-        time.sleep(1.5)
-
-        # Step 2: Update 'assignment1.txt' with new content
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key='assignment1.txt',
-            Body='Empty Assignment 2222222222'
-        )
-        print("Updated 'assignment1.txt' with content: 'Empty Assignment 2222222222'")
-
-        # Wait
-        time.sleep(1.5)
-
-        # Step 3: Delete 'assignment1.txt'
-        s3_client.delete_object(
-            Bucket=BUCKET_NAME,
-            Key='assignment1.txt'
-        )
-        print("Deleted 'assignment1.txt'")
-
-        # Wait
-        time.sleep(1.5)
-
-        # Step 4: Create object 'assignment2.txt' with content "33"
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key='assignment2.txt',
-            Body='33'
-        )
-        print("Created 'assignment2.txt' with content: '33'")
-
-        # Step 5: Wait and then call the plotting API
-        time.sleep(1.5)
-        response = requests.get(PLOTTING_API_URL)
-
-        # Check if the plotting API call was successful
+PLOTTING_API_URL = os.environ.get('PLOTTING_API_URL', f'https://ftyoin29f1.execute-api.{aws_clients.REGION}.amazonaws.com/dev')
+PLOTTING_FUNCTION_NAME = os.environ.get('PLOTTING_FUNCTION_NAME', 'plotting')
+# 'invoke' queues an asynchronous invocation of the plotting Lambda and returns at once;
+# 'api' calls PLOTTING_API_URL and waits for the render (the original behaviour); 'none' skips plotting
+PLOT_TRIGGER = os.environ.get('PLOT_TRIGGER', 'invoke')
+# Time a load-testing scenario leaves before the invocation times out, for measuring lag and reporting
+SCENARIO_RESERVE_SECONDS = float(os.environ.get('SCENARIO_RESERVE_SECONDS', '5'))
+
+
+def current_timestamp():
+    return int(time.time() * 1000)
+
+
+def trigger_plot(after_timestamp):
+    """
+    Ask for a plot that includes every change made before after_timestamp.
+    The asynchronous invocation carries that timestamp as a readiness marker: the
+    plotting Lambda waits until the tracker has written a sample at or after it,
+    so the driver neither sleeps nor pays for the render.
+    """
+    if PLOT_TRIGGER == 'none':
+        return
+    if PLOT_TRIGGER == 'api':
+        response = http_session.get(PLOTTING_API_URL)
         if response.status_code == 200:
-            print("Plotting API called successfully.")
+            metrics.debug("Plotting API called successfully.")
         else:
             print(f"Plotting API call failed. Status Code: {response.status_code}, Response: {response.text}")
+        return
+
+    lambda_client.invoke(
+        FunctionName=PLOTTING_FUNCTION_NAME,
+        InvocationType='Event',
+        Payload=json.dumps({
+            'queryStringParameters': {'buckets': BUCKET_NAME},
+            'wait_for': {'bucket': BUCKET_NAME, 'after': after_timestamp}
+        })
+    )
+    metrics.debug(f"Queued plotting of '{BUCKET_NAME}' once a sample at or after {after_timestamp} is recorded.")
+
+
+@metrics.instrumented('driver')
+def lambda_handler(event, context):
+    # {"scenario": {...}} replays a load-testing scenario instead of the fixed sequence below
+    if (event or {}).get('scenario') is not None:
+        time_limit_seconds = None
+        if context is not None:
+            time_limit_seconds = context.get_remaining_time_in_millis() / 1000 - SCENARIO_RESERVE_SECONDS
+        report = run_scenario(event['scenario'], time_limit_seconds)
+        return {
+            'statusCode': 200,
+            'body': json.dumps(report)
+        }
+
+    try:
+        with metrics.phase('s3'):
+            # Step 1: Create object 'assignment1.txt' with initial content
+            s3_client.put_object(
+                Bucket=BUCKET_NAME,
+                Key='assignment1.txt',
+                Body='Empty Assignment 1'
+            )
+            metrics.debug("Created 'assignment1.txt' with content: 'Empty Assignment 1'")
+
+            # Step 2: Update 'assignment1.txt' with new content
+            s3_client.put_object(
+                Bucket=BUCKET_NAME,
+                Key='assignment1.txt',
+                Body='Empty Assignment 2222222222'
+            )
+            metrics.debug("Updated 'assignment1.txt' with content: 'Empty Assignment 2222222222'")
+
+            # Step 3: Delete 'assignment1.txt'
+            s3_client.delete_object(
+                Bucket=BUCKET_NAME,
+                Key='assignment1.txt'
+            )
+            metrics.debug("Deleted 'assignment1.txt'")
+
+            # Step 4: Create object 'assignment2.txt' with content "33"
+            s3_client.put_object(
+                Bucket=BUCKET_NAME,
+                Key='assignment2.txt',
+                Body='33'
+            )
+            metrics.debug("Created 'assignment2.txt' with content: '33'")
+
+        # Step 5: Plot once the tracker has caught up with the last change
+        with metrics.phase('trigger'):
+            trigger_plot(current_timestamp())
 
         return {
             'statusCode': 200,
@@ -0,0 +1,330 @@
+"""
+Dependency-light chart renderer for the plotting Lambda.
+
+Draws the same line chart as the matplotlib path (series lines, dashed horizontal
+reference lines, axes, ticks, labels, title and legend) straight into a NumPy
+buffer of palette indices and encodes it as an indexed-color PNG with zlib, or
+emits the chart as an SVG string.
+
+A chart is a dict; several charts can be rendered as stacked small multiples:
+    {
+        'title': str, 'xlabel': str, 'ylabel': str, 'xlim': (xmin, xmax),
+        'series': [{'label': str, 'x': [...], 'y': [...], 'color': '#rrggbb'}],
+        'hlines': [{'label': str, 'y': float, 'color': '#rrggbb'}]
+    }
+"""
+import math
+import struct
+import zlib
+from xml.sax.saxutils import escape
+import numpy as np
+
+# Classic 5x7 bitmap font for ASCII 32..126: five column bytes per glyph, bit 0 is the top row
+FONT_5X7 = bytes.fromhex(
+    '0000000000' '00005f0000' '0007000700' '147f147f14' '242a7f2a12' '2313086462' '3649552250' '0005030000'
+    '001c224100' '0041221c00' '142a1c2a14' '08083e0808' '0050300000' '0808080808' '0060600000' '2010080402'
+    '3e5149453e' '00427f4000' '4261514946' '2141454b31' '1814127f10' '2745454539' '3c4a494930' '0171090503'
+    '3649494936' '064949291e' '0036360000' '0056360000' '0814224100' '1414141414' '0041221408' '0201510906'
+    '324979413e' '7e1111117e' '7f49494936' '3e41414122' '7f4141221c' '7f49494941' '7f09090101' '3e41415132'
+    '7f0808087f' '00417f4100' '2040413f01' '7f08142241' '7f40404040' '7f0204027f' '7f0408107f' '3e4141413e'
+    '7f09090906' '3e4151215e' '7f09192946' '4649494931' '01017f0101' '3f4040403f' '1f2040201f' '7f2018207f'
+    '6314081463' '0304780403' '6151494543' '007f414100' '0204081020' '0041417f00' '0402010204' '4040404040'
+    '0001020400' '2054545478' '7f48444438' '3844444420' '384444487f' '3854545418' '087e090102' '0c5252523e'
+    '7f08040478' '00447d4000' '2040443d00' '007f102844' '00417f4000' '7c04180478' '7c08040478' '3844444438'
+    '7c14141408' '081414187c' '7c08040408' '4854545420' '043f444020' '3c4040207c' '1c2040201c' '3c4030403c'
+    '4428102844' '0c5050503c' '4464544c44' '0008364100' '00007f0000' '0041360800' '0201020402'
+)
+GLYPH_WIDTH = 5
+GLYPH_HEIGHT = 7
+GLYPH_ADVANCE = 6
+
+BACKGROUND = '#ffffff'
+FOREGROUND = '#000000'
+GRID = '#e1e1e1'
+# Space reserved around the plotting area: left, top, bottom (pixels); the right
+# margin is sized to fit the legend
+MARGINS = (100, 50, 70)
+DASH_LENGTH = 8
+# Speed matters more than size here: level 1 is several times faster than the default
+PNG_COMPRESSION_LEVEL = 1
+
+
+def hex_color(color):
+    color = color.lstrip('#')
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def nice_ticks(low, high, target=6):
+    """Ticks at multiples of 1, 2 or 5 x 10^k covering [low, high]."""
+    if high <= low:
+        return [low]
+    raw_step = (high - low) / target
+    magnitude = 10 ** math.floor(math.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw_step)
+    first = math.ceil(low / step) * step
+    count = int(math.floor((high - first) / step + 1e-9)) + 1
+    return [first + i * step for i in range(count)]
+
+
+def format_tick(value):
+    if value == int(value) and abs(value) < 1e7:
+        return str(int(value))
+    return f'{value:.4g}'
+
+
+def y_limits(chart):
+    values = [v for series in chart['series'] for v in series['y']] + [line['y'] for line in chart['hlines']]
+    low, high = (min(values), max(values)) if values else (0.0, 1.0)
+    if high == low:
+        low, high = low - 1, high + 1
+    pad = (high - low) * 0.05
+    return low - pad, high + pad
+
+
+def text_bitmap(text, scale=1):
+    """Boolean bitmap of a line of text in the 5x7 font."""
+    bitmap = np.zeros((GLYPH_HEIGHT, max(1, len(text) * GLYPH_ADVANCE - 1)), dtype=bool)
+    rows = np.arange(GLYPH_HEIGHT)[:, None]
+    for i, char in enumerate(text):
+        code = ord(char) if 32 <= ord(char) <= 126 else ord('?')
+        columns = np.frombuffer(FONT_5X7, dtype=np.uint8, count=GLYPH_WIDTH, offset=(code - 32) * GLYPH_WIDTH)
+        bitmap[:, i * GLYPH_ADVANCE:i * GLYPH_ADVANCE + GLYPH_WIDTH] = (columns[None, :] >> rows) & 1
+    if scale > 1:
+        bitmap = bitmap.repeat(scale, axis=0).repeat(scale, axis=1)
+    return bitmap
+
+
+def legend_entries(chart):
+    """(label, color, dashed) for every series and reference line."""
+    return [(s['label'], s['color'], False) for s in chart['series']] + \
+           [(h['label'], h['color'], True) for h in chart['hlines']]
+
+
+def right_margin(chart):
+    longest = max((len(label) for label, _, _ in legend_entries(chart)), default=0)
+    return 75 + longest * GLYPH_ADVANCE
+
+
+class Canvas:
+    """
+    A buffer of palette indices with the handful of primitives the chart needs.
+    Colors are '#rrggbb' strings; each new color gets the next palette slot.
+    """
+
+    def __init__(self, width, height, background=BACKGROUND):
+        self.width = width
+        self.height = height
+        self.palette = [background]
+        self.pixels = np.zeros((height, width), dtype=np.uint8)
+
+    def index(self, color):
+        if color not in self.palette:
+            self.palette.append(color)
+        return self.palette.index(color)
+
+    def fill_rect(self, x0, y0, x1, y1, color):
+        x0, x1 = max(0, int(x0)), min(self.width, int(x1))
+        y0, y1 = max(0, int(y0)), min(self.height, int(y1))
+        if x0 < x1 and y0 < y1:
+            self.pixels[y0:y1, x0:x1] = self.index(color)
+
+    def polyline(self, xs, ys, color, thickness=2):
+        """Rasterize all segments at once: each segment is sampled once per pixel of its longer side."""
+        xs = np.asarray(xs, dtype=float)
+        ys = np.asarray(ys, dtype=float)
+        if len(xs) == 1:
+            xs, ys = np.repeat(xs, 2), np.repeat(ys, 2)
+        dx, dy = np.diff(xs), np.diff(ys)
+        steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+        segment = np.repeat(np.arange(len(steps)), steps)
+        offsets = np.concatenate(([0], np.cumsum(steps)[:-1]))
+        t = (np.arange(steps.sum()) - offsets[segment]) / np.maximum(steps[segment] - 1, 1)
+        px = np.rint(xs[segment] + t * dx[segment]).astype(np.int64)
+        py = np.rint(ys[segment] + t * dy[segment]).astype(np.int64)
+        for ox in range(thickness):
+            for oy in range(thickness):
+                self._plot(px + ox, py + oy, color)
+
+    def hline(self, x0, x1, y, color, dashed=False, thickness=2):
+        px = np.arange(int(x0), int(x1))
+        if dashed:
+            px = px[((px - int(x0)) // DASH_LENGTH) % 2 == 0]
+        for oy in range(thickness):
+            self._plot(px, np.full(len(px), int(round(y)) + oy), color)
+
+    def text(self, x, y, text, color=FOREGROUND, scale=1, anchor='left', rotate=False):
+        """Draw text with its top-left (or top-center / top-right per anchor) at (x, y)."""
+        bitmap = text_bitmap(text, scale)
+        if rotate:
+            bitmap = np.rot90(bitmap)
+        height, width = bitmap.shape
+        if anchor == 'center':
+            x -= width // 2
+        elif anchor == 'right':
+            x -= width
+        ys, xs = np.nonzero(bitmap)
+        self._plot(xs + int(x), ys + int(y), color)
+        return width, height
+
+    def _plot(self, px, py, color):
+        inside = (px >= 0) & (px < self.width) & (py >= 0) & (py < self.height)
+        self.pixels[py[inside], px[inside]] = self.index(color)
+
+    def to_png(self, level=PNG_COMPRESSION_LEVEL):
+        height, width = self.pixels.shape
+        # Every scanline starts with filter type 0 (None)
+        raw = np.zeros((height, width + 1), dtype=np.uint8)
+        raw[:, 1:] = self.pixels
+        palette = b''.join(bytes(hex_color(color)) for color in self.palette)
+
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+        return (b'\x89PNG\r\n\x1a\n'
+                + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0))
+                + chunk(b'PLTE', palette)
+                + chunk(b'IDAT', zlib.compress(raw.tobytes(), level))
+                + chunk(b'IEND', b''))
+
+
+def draw_panel(canvas, chart, top_offset, width, height):
+    """Draw one chart into the canvas rows [top_offset, top_offset + height)."""
+    left, top, bottom = MARGINS
+    plot_x0, plot_x1 = left, width - right_margin(chart)
+    plot_y0, plot_y1 = top_offset + top, top_offset + height - bottom
+    panel_end = top_offset + height
+    xmin, xmax = chart['xlim']
+    ymin, ymax = y_limits(chart)
+
+    def to_x(values):
+        return plot_x0 + (np.asarray(values, dtype=float) - xmin) / (xmax - xmin) * (plot_x1 - plot_x0)
+
+    def to_y(values):
+        return plot_y1 - (np.asarray(values, dtype=float) - ymin) / (ymax - ymin) * (plot_y1 - plot_y0)
+
+    x_ticks = nice_ticks(xmin, xmax)
+    y_ticks = nice_ticks(ymin, ymax)
+    for tick in x_ticks:
+        x = float(to_x(tick))
+        canvas.fill_rect(x, plot_y0, x + 1, plot_y1, GRID)
+    for tick in y_ticks:
+        y = float(to_y(tick))
+        canvas.fill_rect(plot_x0, y, plot_x1, y + 1, GRID)
+
+    # Data, then clear everything in the panel outside the plotting area to clip it
+    for line in chart['hlines']:
+        canvas.hline(plot_x0, plot_x1, to_y(line['y']), line['color'], dashed=True)
+    for series in chart['series']:
+        if len(series['x']):
+            canvas.polyline(to_x(series['x']), to_y(series['y']), series['color'])
+    canvas.fill_rect(0, top_offset, width, plot_y0, BACKGROUND)
+    canvas.fill_rect(0, plot_y1 + 1, width, panel_end, BACKGROUND)
+    canvas.fill_rect(0, top_offset, plot_x0, panel_end, BACKGROUND)
+    canvas.fill_rect(plot_x1 + 1, top_offset, width, panel_end, BACKGROUND)
+
+    # Frame, ticks and tick labels
+    canvas.fill_rect(plot_x0, plot_y0, plot_x1 + 1, plot_y0 + 1, FOREGROUND)
+    canvas.fill_rect(plot_x0, plot_y1, plot_x1 + 1, plot_y1 + 1, FOREGROUND)
+    canvas.fill_rect(plot_x0, plot_y0, plot_x0 + 1, plot_y1 + 1, FOREGROUND)
+    canvas.fill_rect(plot_x1, plot_y0, plot_x1 + 1, plot_y1 + 1, FOREGROUND)
+    for tick in x_ticks:
+        x = float(to_x(tick))
+        canvas.fill_rect(x, plot_y1, x + 1, plot_y1 + 6, FOREGROUND)
+        canvas.text(x, plot_y1 + 10, format_tick(tick), anchor='center')
+    for tick in y_ticks:
+        y = float(to_y(tick))
+        canvas.fill_rect(plot_x0 - 6, y, plot_x0, y + 1, FOREGROUND)
+        canvas.text(plot_x0 - 10, y - GLYPH_HEIGHT // 2, format_tick(tick), anchor='right')
+
+    # Title, axis labels and legend
+    canvas.text((plot_x0 + plot_x1) // 2, top_offset + 15, chart['title'], scale=2, anchor='center')
+    canvas.text((plot_x0 + plot_x1) // 2, panel_end - 30, chart['xlabel'], scale=2, anchor='center')
+    ylabel_length = text_bitmap(chart['ylabel'], 2).shape[1]
+    canvas.text(15, (plot_y0 + plot_y1 - ylabel_length) // 2, chart['ylabel'], scale=2, rotate=True)
+
+    entries = legend_entries(chart)
+    legend_x, legend_y = plot_x1 + 15, plot_y0
+    canvas.fill_rect(legend_x, legend_y, width - 5, legend_y + 1, FOREGROUND)
+    for i, (label, color, dashed) in enumerate(entries):
+        y = legend_y + 12 + i * 20
+        canvas.hline(legend_x + 8, legend_x + 38, y + 3, color, dashed=dashed)
+        canvas.text(legend_x + 45, y, label)
+    canvas.fill_rect(legend_x, legend_y + 12 + len(entries) * 20, width - 5, legend_y + 13 + len(entries) * 20, FOREGROUND)
+
+
+def render_png(charts, width, height):
+    """Render the charts, stacked vertically, into a width x height PNG and return its bytes."""
+    canvas = Canvas(width, height)
+    panel_height = height // len(charts)
+    for i, chart in enumerate(charts):
+        draw_panel(canvas, chart, i * panel_height, width, panel_height)
+    return canvas.to_png()
+
+
+def svg_panel(chart, index, width, height):
+    """SVG elements for one chart, drawn in a group shifted down to its panel."""
+    left, top, bottom = MARGINS
+    plot_x0, plot_x1 = left, width - right_margin(chart)
+    plot_y0, plot_y1 = top, height - bottom
+    xmin, xmax = chart['xlim']
+    ymin, ymax = y_limits(chart)
+    clip_id = f'plot{index}'
+
+    def to_x(value):
+        return plot_x0 + (value - xmin) / (xmax - xmin) * (plot_x1 - plot_x0)
+
+    def to_y(value):
+        return plot_y1 - (value - ymin) / (ymax - ymin) * (plot_y1 - plot_y0)
+
+    parts = [
+        f'<g transform="translate(0 {index * height})">',
+        f'<clipPath id="{clip_id}"><rect x="{plot_x0}" y="{plot_y0}" width="{plot_x1 - plot_x0}" height="{plot_y1 - plot_y0}"/></clipPath>'
+    ]
+    for tick in nice_ticks(xmin, xmax):
+        x = to_x(tick)
+        parts.append(f'<line x1="{x:.1f}" y1="{plot_y0}" x2="{x:.1f}" y2="{plot_y1 + 6}" stroke="#e1e1e1"/>')
+        parts.append(f'<text x="{x:.1f}" y="{plot_y1 + 20}" text-anchor="middle">{format_tick(tick)}</text>')
+    for tick in nice_ticks(ymin, ymax):
+        y = to_y(tick)
+        parts.append(f'<line x1="{plot_x0 - 6}" y1="{y:.1f}" x2="{plot_x1}" y2="{y:.1f}" stroke="#e1e1e1"/>')
+        parts.append(f'<text x="{plot_x0 - 10}" y="{y + 4:.1f}" text-anchor="end">{format_tick(tick)}</text>')
+
+    for line in chart['hlines']:
+        y = to_y(line['y'])
+        parts.append(f'<line x1="{plot_x0}" y1="{y:.1f}" x2="{plot_x1}" y2="{y:.1f}" stroke="{line["color"]}" '
+                     f'stroke-width="2" stroke-dasharray="{DASH_LENGTH}" clip-path="url(#{clip_id})"/>')
+    for series in chart['series']:
+        points = ' '.join(f'{to_x(x):.1f},{to_y(y):.1f}' for x, y in zip(series['x'], series['y']))
+        parts.append(f'<polyline points="{points}" fill="none" stroke="{series["color"]}" stroke-width="2" '
+                     f'clip-path="url(#{clip_id})"/>')
+
+    parts.append(f'<rect x="{plot_x0}" y="{plot_y0}" width="{plot_x1 - plot_x0}" height="{plot_y1 - plot_y0}" '
+                 f'fill="none" stroke="black"/>')
+    parts.append(f'<text x="{(plot_x0 + plot_x1) / 2}" y="30" text-anchor="middle" font-size="16">{escape(chart["title"])}</text>')
+    parts.append(f'<text x="{(plot_x0 + plot_x1) / 2}" y="{height - 20}" text-anchor="middle" font-size="14">'
+                 f'{escape(chart["xlabel"])}</text>')
+    parts.append(f'<text x="25" y="{(plot_y0 + plot_y1) / 2}" text-anchor="middle" font-size="14" '
+                 f'transform="rotate(-90 25 {(plot_y0 + plot_y1) / 2})">{escape(chart["ylabel"])}</text>')
+
+    legend_x = plot_x1 + 15
+    for i, (label, color, dashed) in enumerate(legend_entries(chart)):
+        y = plot_y0 + 15 + i * 20
+        dash = f' stroke-dasharray="{DASH_LENGTH}"' if dashed else ''
+        parts.append(f'<line x1="{legend_x + 8}" y1="{y}" x2="{legend_x + 38}" y2="{y}" stroke="{color}" stroke-width="2"{dash}/>')
+        parts.append(f'<text x="{legend_x + 45}" y="{y + 4}">{escape(label)}</text>')
+    parts.append('</g>')
+    return parts
+
+
+def render_svg(charts, width, height):
+    """Render the charts, stacked vertically, as an SVG document and return it as UTF-8 bytes."""
+    panel_height = height // len(charts)
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" '
+        f'font-family="sans-serif" font-size="12">',
+        f'<rect width="{width}" height="{height}" fill="white"/>'
+    ]
+    for i, chart in enumerate(charts):
+        parts.extend(svg_panel(chart, i, width, panel_height))
+    parts.append('</svg>')
+    return '\n'.join(parts).encode('utf-8')
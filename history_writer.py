@@ -0,0 +1,92 @@
+import random
+import time
+from boto3.dynamodb.types import TypeSerializer
+import aws_clients
+
+# BatchWriteItem accepts at most 25 put/delete requests per call
+BATCH_WRITE_LIMIT = 25
+
+
+class HistoryWriter:
+    """
+    Buffers items for one DynamoDB table and writes them with BatchWriteItem.
+
+    The buffer is flushed when it holds max_items items (flush-on-size) or when the
+    oldest buffered item is older than max_age_seconds (flush-on-age, checked on
+    every add and by flush_if_due). UnprocessedItems are retried with exponential
+    backoff and full jitter. Items a failed flush did not write stay buffered for the
+    next one.
+    """
+
+    def __init__(self, table_name, client=None, max_items=BATCH_WRITE_LIMIT, max_age_seconds=None,
+                 key_names=('bucket_name', 'timestamp'), max_retries=8, base_delay=0.05, max_delay=5.0):
+        self.table_name = table_name
+        self.client = client or aws_clients.client('dynamodb')
+        self.max_items = max_items
+        self.max_age_seconds = max_age_seconds
+        self.key_names = key_names
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.items_written = 0
+        self._serializer = TypeSerializer()
+        self._buffer = []
+        self._oldest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def add(self, item):
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append(item)
+        if len(self._buffer) >= self.max_items:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        if (self._buffer and self.max_age_seconds is not None
+                and time.monotonic() - self._oldest >= self.max_age_seconds):
+            self.flush()
+
+    def flush(self):
+        # A batch may not contain the same key twice; the last sample for a key wins
+        latest = {}
+        for item in self._buffer:
+            latest[tuple(item[name] for name in self.key_names)] = item
+        items = list(latest.values())
+
+        for start in range(0, len(items), BATCH_WRITE_LIMIT):
+            try:
+                self._write_batch(items[start:start + BATCH_WRITE_LIMIT])
+            except Exception:
+                # Keep the failed batch and the ones after it; rewriting the part of the
+                # failed batch that did land is harmless, since the writes are plain puts
+                self._buffer = items[start:]
+                raise
+        self._buffer = []
+        self._oldest = None
+
+    def _write_batch(self, items):
+        requests = [
+            {'PutRequest': {'Item': {k: self._serializer.serialize(v) for k, v in item.items()}}}
+            for item in items
+        ]
+        for attempt in range(self.max_retries + 1):
+            response = self.client.batch_write_item(RequestItems={self.table_name: requests})
+            unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+            self.items_written += len(requests) - len(unprocessed)
+            if not unprocessed:
+                return
+            requests = unprocessed
+            time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+
+        raise RuntimeError(f"{len(requests)} items for '{self.table_name}' still unprocessed "
+                           f"after {self.max_retries} retries")
@@ -0,0 +1,268 @@
+"""
+Seed a bucket's per-key ledger and running totals from an S3 Inventory report.
+
+For buckets with tens of millions of objects, even a parallel list_objects_v2 recount
+is slow and costs one LIST per 1000 keys. S3 Inventory already delivers the listing as
+data files. This reads the report's manifest.json, streams every data file (gzipped CSV,
+or Parquet when pyarrow is installed) row by row, and writes the ledger entries with
+BatchWriteItem, one data file per worker thread. Memory stays bounded by the number of
+workers, whatever the size of the report. It then stores the totals the way a full
+recount does and records a history sample, after which size_track keeps the bucket up
+to date from S3 events.
+
+Ledger entries of keys that are missing from the inventory, and that were not written
+since the inventory was taken, are removed. The totals are those of the inventory: objects
+changed between the inventory and the bootstrap are off until the next recount, so run
+the bootstrap on a fresh report with the tracker's events flowing. For very large buckets, set FULL_RECOUNT_INTERVAL_SECONDS=0
+on the tracker and bootstrap again from each new report instead.
+
+    python inventory_bootstrap.py --bucket my-bucket --manifest s3://inventory-bucket/prefix/my-bucket/config/2025-02-11T00-00Z/manifest.json
+    python inventory_bootstrap.py --bucket my-bucket --manifest ./inventory/my-bucket/config/2025-02-11T00-00Z/manifest.json
+
+Local reports can be generated with --generate for testing at any size:
+
+    python inventory_bootstrap.py --generate ./inventory --bucket my-bucket --objects 10000000 --files 20
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import quote_plus, unquote_plus
+import aws_clients
+import size_track
+
+# Parallel data files being ingested; each worker holds one open file and one write batch
+BOOTSTRAP_WORKERS = int(os.environ.get('BOOTSTRAP_WORKERS', '8'))
+SUPPORTED_FORMATS = ('CSV', 'Parquet')
+# Rows read from a Parquet file at a time
+PARQUET_BATCH_ROWS = 10000
+
+s3_client = aws_clients.client('s3', max_pool_connections=BOOTSTRAP_WORKERS)
+
+
+def parse_s3_url(url):
+    bucket, _, key = url[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def read_manifest(location):
+    """Load manifest.json from s3://bucket/key or a local path."""
+    if location.startswith('s3://'):
+        bucket, key = parse_s3_url(location)
+        manifest = json.load(s3_client.get_object(Bucket=bucket, Key=key)['Body'])
+    else:
+        with open(location) as f:
+            manifest = json.load(f)
+    if manifest.get('fileFormat') not in SUPPORTED_FORMATS:
+        raise ValueError(f"Unsupported inventory format '{manifest.get('fileFormat')}', expected one of {SUPPORTED_FORMATS}")
+    return manifest
+
+
+def local_root(manifest_path, manifest):
+    """
+    The local directory standing in for the destination bucket. Data file keys are
+    relative to the bucket root, so walk up from the manifest until the first one resolves.
+    """
+    first_key = manifest['files'][0]['key'] if manifest['files'] else ''
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    while True:
+        if os.path.exists(os.path.join(directory, first_key)):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            raise FileNotFoundError(f"Cannot find inventory data file '{first_key}' above {manifest_path}")
+        directory = parent
+
+
+def open_data_file(manifest, file_key, root):
+    """A binary stream of one data file, read from S3 without downloading it first."""
+    if root is not None:
+        return open(os.path.join(root, file_key), 'rb')
+    destination = manifest['destinationBucket'].split(':::')[-1]
+    return s3_client.get_object(Bucket=destination, Key=file_key)['Body']
+
+
+def csv_rows(manifest, stream):
+    """
+    (key, size) of every current object in a gzipped CSV data file. CSV inventories
+    have no header; the columns are listed in the manifest's fileSchema and keys are URL-encoded.
+    """
+    columns = [column.strip() for column in manifest['fileSchema'].split(',')]
+    key_column, size_column = columns.index('Key'), columns.index('Size')
+    latest_column = columns.index('IsLatest') if 'IsLatest' in columns else None
+    marker_column = columns.index('IsDeleteMarker') if 'IsDeleteMarker' in columns else None
+    with io.TextIOWrapper(gzip.GzipFile(fileobj=stream), encoding='utf-8', newline='') as text:
+        for row in csv.reader(text):
+            # Versioned inventories list every version; only the current, non-deleted one counts
+            if latest_column is not None and row[latest_column] != 'true':
+                continue
+            if marker_column is not None and row[marker_column] == 'true':
+                continue
+            yield unquote_plus(row[key_column]), int(row[size_column] or 0)
+
+
+def parquet_rows(stream):
+    """(key, size) of every current object in a Parquet data file, read in row batches."""
+    import pyarrow.parquet as pq
+
+    # Parquet needs random access; S3 bodies are spooled to a temporary file first
+    if not (hasattr(stream, 'seekable') and stream.seekable()):
+        spooled = tempfile.TemporaryFile()
+        shutil.copyfileobj(stream, spooled)
+        spooled.seek(0)
+        stream = spooled
+    parquet = pq.ParquetFile(stream)
+    names = set(parquet.schema_arrow.names)
+    columns = ['key', 'size'] + [name for name in ('is_latest', 'is_delete_marker') if name in names]
+    for batch in parquet.iter_batches(batch_size=PARQUET_BATCH_ROWS, columns=columns):
+        rows = batch.to_pydict()
+        for i, key in enumerate(rows['key']):
+            if 'is_latest' in rows and not rows['is_latest'][i]:
+                continue
+            if 'is_delete_marker' in rows and rows['is_delete_marker'][i]:
+                continue
+            yield key, int(rows['size'][i] or 0)
+
+
+def ingest_file(bucket_name, manifest, file_key, root, timestamp, preserve):
+    """
+    Stream one data file into the ledger. Runs on a worker thread with its own
+    DynamoDB resource. Existing entries are updated in place when preserve is set
+    (see size_track.write_ledger_entries), otherwise written in batches.
+    Returns {prefix: [size, count]} for the file's objects.
+    """
+    ledger_table = aws_clients.table(size_track.LEDGER_TABLE_NAME)
+    totals = {}
+
+    def objects(rows):
+        for key, size in rows:
+            prefix_totals = totals.setdefault(size_track.top_level_prefix(key), [0, 0])
+            prefix_totals[0] += size
+            prefix_totals[1] += 1
+            yield {'Key': key, 'Size': size}
+
+    started = time.perf_counter()
+    with open_data_file(manifest, file_key, root) as stream:
+        rows = csv_rows(manifest, stream) if manifest['fileFormat'] == 'CSV' else parquet_rows(stream)
+        size_track.write_ledger_entries(ledger_table, bucket_name, objects(rows), timestamp, preserve)
+    count = sum(count for _, count in totals.values())
+    print(f"✅ Ingested {file_key}: {count} objects in {time.perf_counter() - started:.1f}s")
+    return totals
+
+
+def ledger_is_empty(bucket_name):
+    response = aws_clients.table(size_track.LEDGER_TABLE_NAME).query(
+        KeyConditionExpression=size_track.Key('bucket_name').eq(bucket_name),
+        ProjectionExpression='object_key',
+        Limit=1
+    )
+    return not response.get('Items')
+
+
+def bootstrap(bucket_name, manifest_location, workers=BOOTSTRAP_WORKERS):
+    """Seed the ledger and totals of bucket_name from an inventory report and return the summary item."""
+    manifest = read_manifest(manifest_location)
+    if manifest.get('sourceBucket', bucket_name) != bucket_name:
+        raise ValueError(f"Inventory is for bucket '{manifest['sourceBucket']}', not '{bucket_name}'")
+    root = None if manifest_location.startswith('s3://') else local_root(manifest_location, manifest)
+    inventory_taken_at = int(manifest['creationTimestamp'])
+    started = size_track.current_timestamp()
+    prune = not ledger_is_empty(bucket_name)
+
+    file_keys = [entry['key'] for entry in manifest['files']]
+    prefix_totals = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # The inventory is a listing taken at inventory_taken_at: entries events changed since then are newer and kept.
+        # An empty ledger has no sequencers or tombstones to keep, so a first bootstrap writes in batches
+        ingest = lambda file_key: ingest_file(bucket_name, manifest, file_key, root, inventory_taken_at, prune)
+        for totals in executor.map(ingest, file_keys):
+            for prefix, (size, count) in totals.items():
+                combined = prefix_totals.setdefault(prefix, [0, 0])
+                combined[0] += size
+                combined[1] += count
+
+    if prune:
+        # Entries written since the inventory was taken belong to objects it could not see
+        size_track.remove_stale_ledger_entries(aws_clients.table(size_track.LEDGER_TABLE_NAME),
+                                               bucket_name, inventory_taken_at, [])
+
+    summary = size_track.store_totals(
+        bucket_name, {prefix: tuple(totals) for prefix, totals in prefix_totals.items()}, started,
+        {'baseline_source': 'inventory', 'inventory_taken_at': inventory_taken_at}
+    )
+    timestamp = size_track.current_timestamp()
+    size_track.record_sample(bucket_name, summary, timestamp)
+    size_track.flush_samples()
+    size_track.update_extremes(bucket_name, summary, timestamp)
+    size_track.record_rollups(bucket_name, summary, timestamp)
+    print(f"✅ Bootstrapped '{bucket_name}' from {len(file_keys)} inventory files: "
+          f"{summary['object_count']} objects, {summary['total_size']} bytes in "
+          f"{(size_track.current_timestamp() - started) / 1000:.1f}s")
+    return summary
+
+
+def generate_inventory(directory, bucket_name, objects, files=1, prefixes=100, seed=None):
+    """
+    Write a CSV inventory report of `objects` synthetic objects under directory, laid out
+    like an inventory destination bucket, and return the manifest path. Rows are written
+    as they are generated, so any size fits in memory.
+    """
+    rng = random.Random(seed)
+    config_prefix = f'{bucket_name}/bootstrap-test'
+    created = datetime.now(timezone.utc)
+    os.makedirs(os.path.join(directory, config_prefix, 'data'), exist_ok=True)
+
+    entries = []
+    per_file = -(-objects // files)
+    for file_number in range(files):
+        key = f'{config_prefix}/data/{file_number:05d}.csv.gz'
+        with gzip.open(os.path.join(directory, key), 'wt', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            for n in range(file_number * per_file, min(objects, (file_number + 1) * per_file)):
+                object_key = f'p{n % prefixes:04d}/object {n:010d}.bin' if prefixes else f'object {n:010d}.bin'
+                writer.writerow([bucket_name, quote_plus(object_key), str(int(rng.lognormvariate(0, 1.0) * 4096))])
+        entries.append({'key': key, 'size': os.path.getsize(os.path.join(directory, key)), 'MD5checksum': ''})
+
+    manifest_directory = os.path.join(directory, config_prefix, created.strftime('%Y-%m-%dT%H-%MZ'))
+    os.makedirs(manifest_directory, exist_ok=True)
+    manifest_path = os.path.join(manifest_directory, 'manifest.json')
+    with open(manifest_path, 'w') as f:
+        json.dump({
+            'sourceBucket': bucket_name,
+            'destinationBucket': 'arn:aws:s3:::local-inventory',
+            'version': '2016-11-30',
+            'creationTimestamp': str(int(created.timestamp() * 1000)),
+            'fileFormat': 'CSV',
+            'fileSchema': 'Bucket, Key, Size',
+            'files': entries
+        }, f, indent=2)
+    print(f"✅ Wrote an inventory of {objects} objects in {files} files, manifest {manifest_path}")
+    return manifest_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bucket', default=size_track.BUCKET_NAME)
+    parser.add_argument('--manifest', help='s3:// URL or local path of the inventory manifest.json')
+    parser.add_argument('--workers', type=int, default=BOOTSTRAP_WORKERS)
+    parser.add_argument('--generate', metavar='DIRECTORY', help='write a synthetic CSV inventory instead')
+    parser.add_argument('--objects', type=int, default=100000)
+    parser.add_argument('--files', type=int, default=4)
+    parser.add_argument('--prefixes', type=int, default=100)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_inventory(args.generate, args.bucket, args.objects, args.files, args.prefixes, args.seed)
+    elif args.manifest:
+        bootstrap(args.bucket, args.manifest, args.workers)
+    else:
+        parser.error('either --manifest or --generate is required')
@@ -0,0 +1,530 @@
+"""
+In-process stand-in for the S3, DynamoDB, Lambda, IAM and EventBridge operations this project uses.
+
+install(session) hooks a boto3 session so that its clients never reach the network:
+every API call is answered from memory by one process-wide LocalBackend, after the
+normal parameter validation and serialization, and before request signing. Code above
+the client (resources, Key/Attr conditions, batch_writer, paginators, waiters and
+ClientError handling) runs unchanged. aws_clients.py calls install() when AWS_BACKEND=local.
+
+S3 object writes and deletes raise the notifications configured on the bucket, and
+Lambda invocations run the handlers in this process: synchronously for RequestResponse
+and on a worker pool for Event, the way S3 invokes the size-tracking function.
+"""
+import bisect
+import fnmatch
+import hashlib
+import importlib
+import io
+import itertools
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from urllib.parse import quote, quote_plus
+from botocore.awsrequest import AWSResponse
+from botocore.response import StreamingBody
+from local_dynamodb import DynamoDBError, LocalDynamoDB
+
+# Lambda functions known to the local backend: function name -> 'module:handler'
+LOCAL_FUNCTIONS = {
+    'size_tracking': 'size_track:lambda_handler',
+    'size-tracking': 'size_track:lambda_handler',
+    'plotting': 'plotting_lambda:lambda_handler',
+    'driver': 'driver_lambda:lambda_handler',
+    'reconcile': 'reconcile:lambda_handler',
+    'compaction': 'compaction:lambda_handler'
+}
+# Functions main.py creates itself, so the backend does not start out with them
+PROVISIONED_FUNCTIONS = {'reconcile', 'compaction'}
+# Worker threads running asynchronous (Event) invocations, like Lambda's concurrency limit
+LOCAL_LAMBDA_CONCURRENCY = int(os.environ.get('LOCAL_LAMBDA_CONCURRENCY', '4'))
+# S3 returns at most this many keys per ListObjectsV2 page
+MAX_LIST_KEYS = 1000
+
+
+class LocalError(Exception):
+    """An API error answered with the given code and HTTP status."""
+
+    def __init__(self, code, message, status=400):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+class LocalContext:
+    """The subset of the Lambda context object the handlers may read."""
+
+    def __init__(self, function_name):
+        self.function_name = function_name
+        self.aws_request_id = hashlib.md5(f'{function_name}{time.time_ns()}'.encode()).hexdigest()
+        self.memory_limit_in_mb = 512
+        self._deadline = time.monotonic() + 900
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.monotonic()) * 1000)
+
+
+class LocalBackend:
+    """
+    State of every emulated service. One lock serializes all operations, so the
+    backend can be shared by any number of client threads; Lambda handlers run
+    outside the lock and call back into it through their own clients.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.dynamodb = LocalDynamoDB()
+        self.buckets = {}          # bucket name -> {'keys': sorted keys, 'objects': {key: object}, 'notification': {...}}
+        self.roles = {}            # role name -> {'Role': {...}, 'AttachedPolicies': [policy ARN, ...]}
+        self.role_policies = {}    # (role, policy name) -> policy document string
+        self.rules = {}            # EventBridge rule name -> {'rule': {...}, 'targets': {target id: target}}
+        self.functions = {}        # function name -> configuration
+        self.permissions = {}      # function name -> {statement id: statement}
+        self.sequencer = itertools.count(1)
+        self.executor = None
+        self.pending = []
+        self.invocation_errors = []
+        # Calls per 'service.Operation', for benchmarks
+        self.calls = {}
+        for name in LOCAL_FUNCTIONS.keys() - PROVISIONED_FUNCTIONS:
+            self.functions[name] = {'FunctionName': name, 'Timeout': 3, 'MemorySize': 128, 'Layers': [],
+                                    'LastUpdateStatus': 'Successful', 'State': 'Active'}
+
+    def handle(self, service, operation, params):
+        with self.lock:
+            self.calls[f'{service}.{operation}'] = self.calls.get(f'{service}.{operation}', 0) + 1
+        if service == 'lambda' and operation == 'Invoke':
+            return self.invoke(params)
+        with self.lock:
+            if service == 'dynamodb':
+                method = getattr(self.dynamodb, operation, None)
+            else:
+                method = getattr(self, f'{service}_{operation}', None)
+            if method is None:
+                raise NotImplementedError(f'The local backend does not implement {service}.{operation}')
+            result = method(params)
+        if service == 's3' and isinstance(result, tuple):
+            # Object writes return (response, event records); notify outside the lock
+            result, records = result
+            self.notify(params['Bucket'], records)
+        return result
+
+    def stats(self):
+        with self.lock:
+            return {'calls': dict(self.calls), **self.dynamodb.stats}
+
+    def reset_stats(self):
+        with self.lock:
+            self.calls.clear()
+            for name in self.dynamodb.stats:
+                self.dynamodb.stats[name] = 0
+
+    # S3
+    def bucket(self, name):
+        if name not in self.buckets:
+            raise LocalError('NoSuchBucket', 'The specified bucket does not exist', 404)
+        return self.buckets[name]
+
+    def s3_CreateBucket(self, params):
+        if params['Bucket'] in self.buckets:
+            raise LocalError('BucketAlreadyOwnedByYou', 'Your previous request to create the named bucket succeeded', 409)
+        self.buckets[params['Bucket']] = {'keys': [], 'objects': {}, 'notification': {}}
+        return {'Location': f"/{params['Bucket']}"}
+
+    def s3_HeadBucket(self, params):
+        if params['Bucket'] not in self.buckets:
+            raise LocalError('404', 'Not Found', 404)
+        return {}
+
+    def s3_PutObject(self, params):
+        body = params.get('Body', b'')
+        if hasattr(body, 'read'):
+            body = body.read()
+        if isinstance(body, str):
+            body = body.encode()
+        return self.store_object(params['Bucket'], params['Key'], len(body), body,
+                                 params.get('ContentType', 'binary/octet-stream'), params.get('Metadata', {}))
+
+    def store_object(self, bucket_name, key, size, body=None, content_type='binary/octet-stream', metadata=None):
+        bucket = self.bucket(bucket_name)
+        etag = hashlib.md5(body if body is not None else f'{key}:{size}'.encode()).hexdigest()
+        if key not in bucket['objects']:
+            bisect.insort(bucket['keys'], key)
+        bucket['objects'][key] = {
+            'Size': size, 'Body': body, 'ETag': f'"{etag}"', 'ContentType': content_type,
+            'Metadata': dict(metadata or {}), 'LastModified': datetime.now(timezone.utc)
+        }
+        record = self.event_record(bucket_name, 'ObjectCreated:Put', key, size, etag)
+        return {'ETag': f'"{etag}"'}, [record]
+
+    def put_objects_bulk(self, bucket_name, objects, notify=False):
+        """
+        Store [(key, size)] without bodies, e.g. to give a benchmark bucket millions of
+        objects cheaply. Notifications are only sent when notify is set.
+        """
+        records = []
+        modified = datetime.now(timezone.utc)
+        with self.lock:
+            bucket = self.bucket(bucket_name)
+            for key, size in objects:
+                etag = f'"{size:032x}"'
+                bucket['objects'][key] = {'Size': size, 'Body': None, 'ETag': etag, 'ContentType': 'binary/octet-stream',
+                                          'Metadata': {}, 'LastModified': modified}
+                if notify:
+                    records.append(self.event_record(bucket_name, 'ObjectCreated:Put', key, size, etag.strip('"')))
+            # One sort instead of inserting every key into the sorted list
+            bucket['keys'] = sorted(bucket['objects'])
+        if notify:
+            self.notify(bucket_name, records)
+
+    def object(self, params, missing_code):
+        bucket = self.bucket(params['Bucket'])
+        if params['Key'] not in bucket['objects']:
+            raise LocalError(missing_code, 'The specified key does not exist.', 404)
+        return bucket['objects'][params['Key']]
+
+    def object_headers(self, obj):
+        return {'ContentLength': obj['Size'], 'ETag': obj['ETag'], 'ContentType': obj['ContentType'],
+                'Metadata': obj['Metadata'], 'LastModified': obj['LastModified']}
+
+    def s3_HeadObject(self, params):
+        # HEAD responses have no body, so S3 reports a bare status code
+        return self.object_headers(self.object(params, '404'))
+
+    def s3_GetObject(self, params):
+        obj = self.object(params, 'NoSuchKey')
+        body = obj['Body'] if obj['Body'] is not None else b'\0' * obj['Size']
+        return {**self.object_headers(obj), 'Body': StreamingBody(io.BytesIO(body), len(body))}
+
+    def s3_DeleteObject(self, params):
+        bucket = self.bucket(params['Bucket'])
+        key = params['Key']
+        if key in bucket['objects']:
+            del bucket['objects'][key]
+            del bucket['keys'][bisect.bisect_left(bucket['keys'], key)]
+        # S3 reports deletes of missing keys too, without a size
+        return {}, [self.event_record(params['Bucket'], 'ObjectRemoved:Delete', key)]
+
+    def s3_ListObjectsV2(self, params):
+        bucket = self.bucket(params['Bucket'])
+        prefix = params.get('Prefix', '')
+        delimiter = params.get('Delimiter')
+        max_keys = min(params.get('MaxKeys', MAX_LIST_KEYS), MAX_LIST_KEYS)
+        start_after = params.get('ContinuationToken') or params.get('StartAfter') or ''
+
+        keys = bucket['keys']
+        index = bisect.bisect_right(keys, start_after) if start_after else bisect.bisect_left(keys, prefix)
+        contents, common_prefixes = [], []
+        last = None
+        truncated = False
+        while index < len(keys) and keys[index].startswith(prefix):
+            if len(contents) + len(common_prefixes) >= max_keys:
+                truncated = True
+                break
+            key = keys[index]
+            position = key.find(delimiter, len(prefix)) if delimiter else -1
+            if position >= 0:
+                common_prefix = key[:position + len(delimiter)]
+                common_prefixes.append({'Prefix': common_prefix})
+                # Skip every key under this common prefix
+                last = common_prefix + '\U0010ffff'
+                index = bisect.bisect_left(keys, last)
+                continue
+            obj = bucket['objects'][key]
+            contents.append({'Key': key, 'Size': obj['Size'], 'ETag': obj['ETag'],
+                             'LastModified': obj['LastModified'], 'StorageClass': 'STANDARD'})
+            last = key
+            index += 1
+
+        response = {'Name': params['Bucket'], 'Prefix': prefix, 'MaxKeys': max_keys,
+                    'KeyCount': len(contents) + len(common_prefixes), 'IsTruncated': truncated}
+        if contents:
+            response['Contents'] = contents
+        if common_prefixes:
+            response['CommonPrefixes'] = common_prefixes
+        if delimiter:
+            response['Delimiter'] = delimiter
+        if truncated:
+            response['NextContinuationToken'] = last
+        return response
+
+    def s3_PutBucketNotificationConfiguration(self, params):
+        configuration = params['NotificationConfiguration']
+        for target in configuration.get('LambdaFunctionConfigurations', []):
+            if self.function_name(target['LambdaFunctionArn']) not in self.functions:
+                raise LocalError('InvalidArgument', 'Unable to validate the following destination configurations')
+        self.bucket(params['Bucket'])['notification'] = configuration
+        return {}
+
+    def s3_GetBucketNotificationConfiguration(self, params):
+        return dict(self.bucket(params['Bucket'])['notification'])
+
+    def s3_PutBucketLifecycleConfiguration(self, params):
+        # Stored for the provisioning plan; objects are not expired locally
+        self.bucket(params['Bucket'])['lifecycle'] = params['LifecycleConfiguration']
+        return {}
+
+    def s3_GetBucketLifecycleConfiguration(self, params):
+        lifecycle = self.bucket(params['Bucket']).get('lifecycle')
+        if lifecycle is None:
+            raise LocalError('NoSuchLifecycleConfiguration', 'The lifecycle configuration does not exist', 404)
+        return dict(lifecycle)
+
+    def event_record(self, bucket_name, event_name, key, size=None, etag=None):
+        """An S3 event notification record in the shape S3 sends to Lambda."""
+        obj = {'key': quote_plus(key), 'sequencer': f'{next(self.sequencer):016X}'}
+        if size is not None:
+            obj.update({'size': size, 'eTag': etag})
+        return {
+            'eventVersion': '2.1',
+            'eventSource': 'aws:s3',
+            'awsRegion': 'local',
+            'eventTime': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z',
+            'eventName': event_name,
+            's3': {'s3SchemaVersion': '1.0', 'bucket': {'name': bucket_name, 'arn': f'arn:aws:s3:::{bucket_name}'},
+                   'object': obj}
+        }
+
+    def notify(self, bucket_name, records):
+        """Send each record to every Lambda whose notification configuration matches it, one event per record."""
+        with self.lock:
+            targets = self.buckets.get(bucket_name, {}).get('notification', {}).get('LambdaFunctionConfigurations', [])
+        for record in records:
+            for target in targets:
+                if any(fnmatch.fnmatchcase('s3:' + record['eventName'], pattern) for pattern in target['Events']) \
+                        and self.filter_matches(target, record):
+                    self.invoke_async(target['LambdaFunctionArn'], {'Records': [record]})
+
+    def filter_matches(self, target, record):
+        rules = target.get('Filter', {}).get('Key', {}).get('FilterRules', [])
+        key = record['s3']['object']['key']
+        for rule in rules:
+            name = rule['Name'].lower()
+            if (name == 'prefix' and not key.startswith(rule['Value'])) or \
+                    (name == 'suffix' and not key.endswith(rule['Value'])):
+                return False
+        return True
+
+    # Lambda
+    def function_name(self, name_or_arn):
+        return name_or_arn.split(':function:')[-1].split(':')[0]
+
+    def function(self, params):
+        name = self.function_name(params['FunctionName'])
+        if name not in self.functions:
+            raise LocalError('ResourceNotFoundException', f'Function not found: {name}', 404)
+        return name
+
+    def lambda_CreateFunction(self, params):
+        name = params['FunctionName']
+        if name in self.functions:
+            raise LocalError('ResourceConflictException', f'Function already exist: {name}', 409)
+        if name not in LOCAL_FUNCTIONS:
+            raise LocalError('InvalidParameterValueException', f'The local backend has no handler for {name}')
+        self.functions[name] = {'FunctionName': name, 'Handler': params['Handler'], 'Role': params['Role'],
+                                'Runtime': params.get('Runtime'), 'Timeout': params.get('Timeout', 3),
+                                'MemorySize': params.get('MemorySize', 128), 'Environment': params.get('Environment', {}),
+                                'Layers': [{'Arn': arn} for arn in params.get('Layers', [])],
+                                'LastUpdateStatus': 'Successful', 'State': 'Active'}
+        return dict(self.functions[name])
+
+    def lambda_GetFunctionConfiguration(self, params):
+        return dict(self.functions[self.function(params)])
+
+    def lambda_UpdateFunctionConfiguration(self, params):
+        configuration = self.functions[self.function(params)]
+        for name in ('Timeout', 'MemorySize', 'Environment'):
+            if name in params:
+                configuration[name] = params[name]
+        if 'Layers' in params:
+            configuration['Layers'] = [{'Arn': arn} for arn in params['Layers']]
+        return dict(configuration)
+
+    def lambda_AddPermission(self, params):
+        statements = self.permissions.setdefault(self.function(params), {})
+        if params['StatementId'] in statements:
+            raise LocalError('ResourceConflictException', f"The statement id ({params['StatementId']}) provided already exists", 409)
+        statement = {'Sid': params['StatementId'], 'Effect': 'Allow', 'Principal': {'Service': params['Principal']},
+                     'Action': params['Action'], 'Resource': params['FunctionName']}
+        if 'SourceArn' in params:
+            statement['Condition'] = {'ArnLike': {'AWS:SourceArn': params['SourceArn']}}
+        statements[params['StatementId']] = statement
+        return {'Statement': json.dumps(statement)}
+
+    def lambda_GetPolicy(self, params):
+        statements = self.permissions.get(self.function(params))
+        if not statements:
+            raise LocalError('ResourceNotFoundException', 'The resource you requested does not exist.', 404)
+        return {'Policy': json.dumps({'Version': '2012-10-17', 'Statement': list(statements.values())})}
+
+    def load_handler(self, name):
+        module_name, _, handler_name = LOCAL_FUNCTIONS[name].partition(':')
+        return getattr(importlib.import_module(module_name), handler_name)
+
+    def run_function(self, name, event):
+        return self.load_handler(name)(event, LocalContext(name))
+
+    def invoke(self, params):
+        with self.lock:
+            name = self.function(params)
+        payload = params.get('Payload', b'{}')
+        if hasattr(payload, 'read'):
+            payload = payload.read()
+        event = json.loads(payload or b'{}')
+
+        invocation_type = params.get('InvocationType', 'RequestResponse')
+        if invocation_type == 'Event':
+            self.invoke_async(name, event)
+            return {'StatusCode': 202, 'Payload': StreamingBody(io.BytesIO(b''), 0)}
+        if invocation_type == 'DryRun':
+            return {'StatusCode': 204}
+
+        response = {'StatusCode': 200, 'ExecutedVersion': '$LATEST'}
+        try:
+            result = json.dumps(self.run_function(name, event), default=str).encode()
+        except Exception as e:
+            response['FunctionError'] = 'Unhandled'
+            result = json.dumps({'errorMessage': str(e), 'errorType': type(e).__name__}).encode()
+        response['Payload'] = StreamingBody(io.BytesIO(result), len(result))
+        return response
+
+    def invoke_async(self, name_or_arn, event):
+        name = self.function_name(name_or_arn)
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=LOCAL_LAMBDA_CONCURRENCY,
+                                                   thread_name_prefix='local-lambda')
+            self.pending.append(self.executor.submit(self.run_async, name, event))
+
+    def run_async(self, name, event):
+        try:
+            self.run_function(name, event)
+        except Exception as e:
+            # Lambda would retry and then drop the event; keep it for inspection instead
+            print(f"❌ Local invocation of '{name}' failed: {e}")
+            with self.lock:
+                self.invocation_errors.append((name, event, e))
+
+    def wait_idle(self, timeout=None):
+        """Block until every asynchronous invocation, including ones queued meanwhile, has finished."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                pending = [future for future in self.pending if not future.done()]
+                self.pending = pending
+            if not pending:
+                return True
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            wait(pending, timeout=remaining)
+
+    # IAM
+    def iam_CreateRole(self, params):
+        name = params['RoleName']
+        if name in self.roles:
+            raise LocalError('EntityAlreadyExists', f'Role with name {name} already exists.', 409)
+        self.roles[name] = {'Role': {'RoleName': name, 'RoleId': hashlib.md5(name.encode()).hexdigest()[:21].upper(),
+                                     'Arn': f'arn:aws:iam::000000000000:role/{name}', 'Path': '/',
+                                     'CreateDate': datetime.now(timezone.utc),
+                                     'AssumeRolePolicyDocument': quote(params['AssumeRolePolicyDocument'])},
+                            'AttachedPolicies': []}
+        return {'Role': dict(self.roles[name]['Role'])}
+
+    def role(self, name):
+        if name not in self.roles:
+            raise LocalError('NoSuchEntity', f'The role with name {name} cannot be found.', 404)
+        return self.roles[name]
+
+    def iam_GetRole(self, params):
+        return {'Role': dict(self.role(params['RoleName'])['Role'])}
+
+    def iam_AttachRolePolicy(self, params):
+        attached = self.role(params['RoleName'])['AttachedPolicies']
+        if params['PolicyArn'] not in attached:
+            attached.append(params['PolicyArn'])
+        return {}
+
+    def iam_PutRolePolicy(self, params):
+        self.role_policies[(params['RoleName'], params['PolicyName'])] = params['PolicyDocument']
+        return {}
+
+    def iam_GetRolePolicy(self, params):
+        key = (params['RoleName'], params['PolicyName'])
+        if key not in self.role_policies:
+            raise LocalError('NoSuchEntity', f"The role policy with name {params['PolicyName']} cannot be found.", 404)
+        # IAM returns the document URL-encoded; botocore decodes it again
+        return {'RoleName': key[0], 'PolicyName': key[1], 'PolicyDocument': quote(self.role_policies[key])}
+
+    # EventBridge; rules are recorded but never fire, run the targets by hand to simulate a schedule
+    def events_PutRule(self, params):
+        arn = f"arn:aws:events:local:000000000000:rule/{params['Name']}"
+        entry = self.rules.setdefault(params['Name'], {'rule': {}, 'targets': {}})
+        entry['rule'] = {'Name': params['Name'], 'Arn': arn, 'State': params.get('State', 'ENABLED'),
+                         'ScheduleExpression': params.get('ScheduleExpression'), 'EventBusName': 'default'}
+        return {'RuleArn': arn}
+
+    def events_rule(self, name):
+        if name not in self.rules:
+            raise LocalError('ResourceNotFoundException', f'Rule {name} does not exist.')
+        return self.rules[name]
+
+    def events_DescribeRule(self, params):
+        return dict(self.events_rule(params['Name'])['rule'])
+
+    def events_PutTargets(self, params):
+        targets = self.events_rule(params['Rule'])['targets']
+        for target in params['Targets']:
+            targets[target['Id']] = dict(target)
+        return {'FailedEntryCount': 0, 'FailedEntries': []}
+
+    def events_ListTargetsByRule(self, params):
+        return {'Targets': list(self.events_rule(params['Rule'])['targets'].values())}
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    """The process-wide backend shared by every hooked session."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = LocalBackend()
+        return _backend
+
+
+def reset():
+    """Drop all local state, e.g. between benchmark runs."""
+    global _backend
+    with _backend_lock:
+        _backend = None
+
+
+def remember_params(params, context, **kwargs):
+    # Runs after boto3's own parameter transformations, so params are in wire shape
+    context['local_api_params'] = params
+
+
+def answer_locally(model, context, **kwargs):
+    service = model.service_model.endpoint_prefix
+    try:
+        status, parsed = 200, backend().handle(service, model.name, context['local_api_params'])
+    except (LocalError, DynamoDBError) as e:
+        status = getattr(e, 'status', 400)
+        parsed = {'Error': {'Code': e.code, 'Message': e.message}}
+    parsed['ResponseMetadata'] = {'RequestId': 'local', 'HTTPStatusCode': status, 'HTTPHeaders': {}, 'RetryAttempts': 0}
+    return AWSResponse('local://', status, {}, None), parsed
+
+
+def install(session):
+    """Route every client later created from this boto3 session to the local backend."""
+    events = session._session.get_component('event_emitter')
+    events.register_last('before-parameter-build', remember_params, unique_id='local-aws-params')
+    events.register('before-call', answer_locally, unique_id='local-aws-call')
+    return session
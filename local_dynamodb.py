@@ -0,0 +1,875 @@
+"""
+In-memory DynamoDB used by the local backend (see local_aws.py).
+
+Operations take and return the low-level client shapes, so the boto3 resource
+layer, Key/Attr conditions, batch_writer and paginators above it work unchanged.
+Supported: CreateTable, DescribeTable, DeleteTable, ListTables, UpdateTimeToLive,
+DescribeTimeToLive, GetItem, PutItem, UpdateItem, DeleteItem, BatchWriteItem,
+BatchGetItem, Query (tables and GSIs) and Scan, with condition, filter, update and
+projection expressions, ReturnValues, Limit/ExclusiveStartKey pagination with the
+1 MB page size, and ConsumedCapacity.
+"""
+import bisect
+import math
+import re
+from decimal import Decimal
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+
+# DynamoDB returns at most this much data per Query/Scan page
+PAGE_SIZE_BYTES = 1024 * 1024
+# Capacity unit sizes: a read unit covers 4 KB (strongly consistent), a write unit 1 KB
+READ_UNIT_BYTES = 4096
+WRITE_UNIT_BYTES = 1024
+MAX_BATCH_WRITE_ITEMS = 25
+
+_deserializer = TypeDeserializer()
+_serializer = TypeSerializer()
+
+
+class DynamoDBError(Exception):
+    """Raised with a DynamoDB error code; local_aws turns it into a ClientError."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def deserialize_item(item):
+    return {name: _deserializer.deserialize(value) for name, value in item.items()}
+
+
+def serialize_item(item):
+    return {name: _serializer.serialize(value) for name, value in item.items()}
+
+
+def value_size(value):
+    """Approximate stored size of an attribute value in bytes, following DynamoDB's sizing rules."""
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, Decimal):
+        return 1 + (len(value.as_tuple().digits) + 1) // 2
+    if isinstance(value, dict):
+        return 3 + sum(len(name) + value_size(member) for name, member in value.items())
+    if isinstance(value, (list, set)):
+        return 3 + sum(value_size(member) for member in value)
+    return len(str(value))
+
+
+def item_size(item):
+    return sum(len(name) + value_size(value) for name, value in item.items())
+
+
+# Expressions -------------------------------------------------------------------
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(<=|>=|<>|[=<>(),.\[\]+-])|(#[A-Za-z0-9_]+)|(:[A-Za-z0-9_]+)|([A-Za-z_][A-Za-z0-9_]*)|(\d+))')
+KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'SET', 'REMOVE', 'ADD', 'DELETE'}
+COMPARATORS = {'=', '<>', '<', '<=', '>', '>='}
+
+
+def tokenize(expression):
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise DynamoDBError('ValidationException', f"Invalid expression near '{expression[position:]}'")
+        symbol, name, value, word, number = match.groups()
+        if symbol:
+            tokens.append(('symbol', symbol))
+        elif name:
+            tokens.append(('name', name))
+        elif value:
+            tokens.append(('value', value))
+        elif word:
+            tokens.append(('keyword', word.upper()) if word.upper() in KEYWORDS else ('word', word))
+        else:
+            tokens.append(('number', int(number)))
+        position = match.end()
+    return tokens
+
+
+class ExpressionParser:
+    """
+    Recursive-descent parser for condition, key condition, filter, update and
+    projection expressions. Placeholders are resolved while parsing.
+    """
+
+    def __init__(self, expression, names=None, values=None):
+        self.tokens = tokenize(expression)
+        self.position = 0
+        self.names = names or {}
+        self.values = values or {}
+        self.used_values = set()
+
+    def peek(self, offset=0):
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if (kind and token[0] != kind) or (text is not None and token[1] != text):
+            raise DynamoDBError('ValidationException', f"Invalid expression: expected {text or kind}, got {token[1]}")
+        self.position += 1
+        return token
+
+    def accept(self, kind, text):
+        if self.peek() == (kind, text):
+            self.position += 1
+            return True
+        return False
+
+    def done(self):
+        if self.position != len(self.tokens):
+            raise DynamoDBError('ValidationException', f"Invalid expression: unexpected '{self.peek()[1]}'")
+
+    # Paths and operands
+    def path(self):
+        parts = [self.path_name()]
+        while True:
+            if self.accept('symbol', '.'):
+                parts.append(self.path_name())
+            elif self.accept('symbol', '['):
+                parts.append(self.take('number')[1])
+                self.take('symbol', ']')
+            else:
+                return ('path', parts)
+
+    def path_name(self):
+        kind, text = self.take()
+        if kind == 'name':
+            if text not in self.names:
+                raise DynamoDBError('ValidationException', f"Undefined attribute name placeholder {text}")
+            return self.names[text]
+        if kind in ('word', 'keyword'):
+            return text
+        raise DynamoDBError('ValidationException', f"Invalid attribute name '{text}'")
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.position += 1
+            if text not in self.values:
+                raise DynamoDBError('ValidationException', f"Undefined attribute value placeholder {text}")
+            self.used_values.add(text)
+            return ('value', _deserializer.deserialize(self.values[text]))
+        if kind == 'word' and self.peek(1) == ('symbol', '('):
+            function = text
+            self.position += 2
+            arguments = [self.operand()]
+            while self.accept('symbol', ','):
+                arguments.append(self.operand())
+            self.take('symbol', ')')
+            return ('call', function, arguments)
+        return self.path()
+
+    # Conditions
+    def condition(self):
+        node = self.conjunction()
+        while self.accept('keyword', 'OR'):
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.accept('keyword', 'AND'):
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.accept('keyword', 'NOT'):
+            return ('not', self.negation())
+        return self.comparison()
+
+    def comparison(self):
+        if self.peek() == ('symbol', '('):
+            # A parenthesised condition, not an operand
+            self.position += 1
+            node = self.condition()
+            self.take('symbol', ')')
+            return node
+        left = self.operand()
+        kind, text = self.peek()
+        if kind == 'symbol' and text in COMPARATORS:
+            self.position += 1
+            return ('compare', text, left, self.operand())
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.operand()
+            self.take('keyword', 'AND')
+            return ('between', left, low, self.operand())
+        if self.accept('keyword', 'IN'):
+            self.take('symbol', '(')
+            options = [self.operand()]
+            while self.accept('symbol', ','):
+                options.append(self.operand())
+            self.take('symbol', ')')
+            return ('in', left, options)
+        if left[0] == 'call':
+            return left
+        raise DynamoDBError('ValidationException', f"Invalid condition near '{text}'")
+
+    def parse_condition(self):
+        node = self.condition()
+        self.done()
+        return node
+
+    # Updates
+    def update_value(self):
+        left = self.operand()
+        if self.accept('symbol', '+'):
+            return ('plus', left, self.operand())
+        if self.accept('symbol', '-'):
+            return ('minus', left, self.operand())
+        return left
+
+    def parse_update(self):
+        actions = []
+        while self.peek()[0] is not None:
+            clause = self.take('keyword')[1]
+            while True:
+                target = self.path()
+                if clause == 'SET':
+                    self.take('symbol', '=')
+                    actions.append(('SET', target, self.update_value()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', target, None))
+                elif clause in ('ADD', 'DELETE'):
+                    actions.append((clause, target, self.operand()))
+                else:
+                    raise DynamoDBError('ValidationException', f"Invalid update clause {clause}")
+                if not self.accept('symbol', ','):
+                    break
+        self.done()
+        return actions
+
+    def parse_projection(self):
+        paths = [self.path()]
+        while self.accept('symbol', ','):
+            paths.append(self.path())
+        self.done()
+        return paths
+
+
+MISSING = object()
+
+
+def resolve(item, path):
+    value = item
+    for part in path[1]:
+        if isinstance(part, int):
+            if not isinstance(value, list) or part >= len(value):
+                return MISSING
+            value = value[part]
+        else:
+            if not isinstance(value, dict) or part not in value:
+                return MISSING
+            value = value[part]
+    return value
+
+
+def evaluate_operand(item, node):
+    if node[0] == 'value':
+        return node[1]
+    if node[0] == 'path':
+        return resolve(item, node)
+    if node[0] == 'call':
+        function, arguments = node[1], node[2]
+        if function == 'size':
+            value = evaluate_operand(item, arguments[0])
+            if value is MISSING:
+                return MISSING
+            return Decimal(len(value) if not isinstance(value, str) else len(value.encode()))
+        if function == 'if_not_exists':
+            value = evaluate_operand(item, arguments[0])
+            return evaluate_operand(item, arguments[1]) if value is MISSING else value
+        if function == 'list_append':
+            return list(evaluate_operand(item, arguments[0])) + list(evaluate_operand(item, arguments[1]))
+        return evaluate_function(item, node)
+    if node[0] in ('plus', 'minus'):
+        left, right = evaluate_operand(item, node[1]), evaluate_operand(item, node[2])
+        if not isinstance(left, Decimal) or not isinstance(right, Decimal):
+            raise DynamoDBError('ValidationException', 'An operand in the update expression has an incorrect data type')
+        return left + right if node[0] == 'plus' else left - right
+    raise DynamoDBError('ValidationException', f"Invalid operand {node}")
+
+
+def comparable(left, right):
+    if left is MISSING or right is MISSING:
+        return False
+    if isinstance(left, bool) or isinstance(right, bool):
+        return type(left) is type(right)
+    return isinstance(left, type(right)) or isinstance(right, type(left))
+
+
+def compare(operator, left, right):
+    if operator == '=':
+        return comparable(left, right) and left == right
+    if operator == '<>':
+        return not (comparable(left, right) and left == right)
+    if not comparable(left, right) or isinstance(left, (dict, list, set, bool)):
+        return False
+    return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+
+
+TYPE_CHECKS = {
+    'S': lambda v: isinstance(v, str), 'N': lambda v: isinstance(v, Decimal), 'B': lambda v: isinstance(v, bytes),
+    'BOOL': lambda v: isinstance(v, bool), 'NULL': lambda v: v is None, 'L': lambda v: isinstance(v, list),
+    'M': lambda v: isinstance(v, dict), 'SS': lambda v: isinstance(v, set) and all(isinstance(m, str) for m in v),
+    'NS': lambda v: isinstance(v, set) and all(isinstance(m, Decimal) for m in v)
+}
+
+
+def evaluate_function(item, node):
+    function, arguments = node[1], node[2]
+    if function == 'attribute_exists':
+        return resolve(item, arguments[0]) is not MISSING
+    if function == 'attribute_not_exists':
+        return resolve(item, arguments[0]) is MISSING
+    value = evaluate_operand(item, arguments[0])
+    if function == 'attribute_type':
+        return value is not MISSING and TYPE_CHECKS[evaluate_operand(item, arguments[1])](value)
+    if function == 'begins_with':
+        prefix = evaluate_operand(item, arguments[1])
+        return isinstance(value, (str, bytes)) and isinstance(prefix, type(value)) and value.startswith(prefix)
+    if function == 'contains':
+        member = evaluate_operand(item, arguments[1])
+        if isinstance(value, str):
+            return isinstance(member, str) and member in value
+        return isinstance(value, (list, set)) and member in value
+    raise DynamoDBError('ValidationException', f"Invalid function name; function: {function}")
+
+
+def evaluate(item, node):
+    kind = node[0]
+    if kind == 'and':
+        return evaluate(item, node[1]) and evaluate(item, node[2])
+    if kind == 'or':
+        return evaluate(item, node[1]) or evaluate(item, node[2])
+    if kind == 'not':
+        return not evaluate(item, node[1])
+    if kind == 'compare':
+        return compare(node[1], evaluate_operand(item, node[2]), evaluate_operand(item, node[3]))
+    if kind == 'between':
+        value = evaluate_operand(item, node[1])
+        return compare('>=', value, evaluate_operand(item, node[2])) and compare('<=', value, evaluate_operand(item, node[3]))
+    if kind == 'in':
+        value = evaluate_operand(item, node[1])
+        return any(compare('=', value, evaluate_operand(item, option)) for option in node[2])
+    if kind == 'call':
+        return evaluate_function(item, node)
+    raise DynamoDBError('ValidationException', f"Invalid condition {node}")
+
+
+def set_path(item, path, value):
+    target = item
+    parts = path[1]
+    for part in parts[:-1]:
+        target = target[part]
+    if isinstance(parts[-1], int) and parts[-1] >= len(target):
+        target.append(value)
+    else:
+        target[parts[-1]] = value
+
+
+def remove_path(item, path):
+    target = item
+    parts = path[1]
+    for part in parts[:-1]:
+        target = target.get(part) if isinstance(target, dict) else target[part]
+        if target is None:
+            return
+    if isinstance(target, dict):
+        target.pop(parts[-1], None)
+    elif isinstance(target, list) and parts[-1] < len(target):
+        del target[parts[-1]]
+
+
+def apply_update(item, actions):
+    """Apply parsed update actions to a copy of item; all operands are evaluated against the old item."""
+    original = item
+    item = copy_item(item)
+    for action, path, operand in actions:
+        if action == 'SET':
+            set_path(item, path, evaluate_operand(original, operand))
+        elif action == 'REMOVE':
+            remove_path(item, path)
+        elif action == 'ADD':
+            current = resolve(item, path)
+            value = evaluate_operand(original, operand)
+            if current is MISSING:
+                set_path(item, path, value)
+            elif isinstance(current, Decimal) and isinstance(value, Decimal):
+                set_path(item, path, current + value)
+            elif isinstance(current, set) and isinstance(value, set):
+                set_path(item, path, current | value)
+            else:
+                raise DynamoDBError('ValidationException', 'An operand in the update expression has an incorrect data type')
+        elif action == 'DELETE':
+            current = resolve(item, path)
+            if isinstance(current, set):
+                remaining = current - evaluate_operand(original, operand)
+                if remaining:
+                    set_path(item, path, remaining)
+                else:
+                    remove_path(item, path)
+    return item
+
+
+def copy_item(value):
+    if isinstance(value, dict):
+        return {name: copy_item(member) for name, member in value.items()}
+    if isinstance(value, list):
+        return [copy_item(member) for member in value]
+    if isinstance(value, set):
+        return set(value)
+    return value
+
+
+def project(item, paths):
+    if paths is None:
+        return item
+    projected = {}
+    for path in paths:
+        value = resolve(item, path)
+        if value is not MISSING:
+            projected[path[1][0]] = item[path[1][0]] if len(path[1]) == 1 else copy_item(item[path[1][0]])
+    return projected
+
+
+# Tables ------------------------------------------------------------------------
+
+class Partition:
+    """Items of one partition key, kept ordered by sort key."""
+
+    def __init__(self):
+        self.sort_keys = []
+        self.items = {}
+
+    def put(self, sort_key, item):
+        if sort_key not in self.items:
+            if not self.sort_keys or sort_key > self.sort_keys[-1]:
+                self.sort_keys.append(sort_key)
+            else:
+                bisect.insort(self.sort_keys, sort_key)
+        self.items[sort_key] = item
+
+    def delete(self, sort_key):
+        if self.items.pop(sort_key, None) is not None:
+            del self.sort_keys[bisect.bisect_left(self.sort_keys, sort_key)]
+
+
+class LocalTable:
+    def __init__(self, definition):
+        self.name = definition['TableName']
+        self.definition = definition
+        self.hash_key, self.range_key = key_names(definition['KeySchema'])
+        self.indexes = {
+            index['IndexName']: (key_names(index['KeySchema']), index.get('Projection', {'ProjectionType': 'ALL'}))
+            for index in definition.get('GlobalSecondaryIndexes', []) + definition.get('LocalSecondaryIndexes', [])
+        }
+        self.partitions = {}
+        self.item_count = 0
+        self.ttl = None
+
+    def key_of(self, item, hash_key=None, range_key=None):
+        hash_key = hash_key or self.hash_key
+        range_key = self.range_key if hash_key == self.hash_key and range_key is None else range_key
+        if hash_key not in item or (range_key and range_key not in item):
+            raise DynamoDBError('ValidationException', 'The provided key element does not match the schema')
+        return item[hash_key], (item[range_key] if range_key else None)
+
+    def get(self, key):
+        hash_value, range_value = self.key_of(key)
+        partition = self.partitions.get(hash_value)
+        return partition.items.get(range_value) if partition else None
+
+    def put(self, item):
+        hash_value, range_value = self.key_of(item)
+        partition = self.partitions.setdefault(hash_value, Partition())
+        if range_value not in partition.items:
+            self.item_count += 1
+        partition.put(range_value, item)
+
+    def delete(self, key):
+        hash_value, range_value = self.key_of(key)
+        partition = self.partitions.get(hash_value)
+        if partition and range_value in partition.items:
+            partition.delete(range_value)
+            self.item_count -= 1
+            if not partition.items:
+                del self.partitions[hash_value]
+
+    def primary_key(self, item):
+        key = {self.hash_key: item[self.hash_key]}
+        if self.range_key:
+            key[self.range_key] = item[self.range_key]
+        return key
+
+    def describe(self):
+        description = {
+            'TableName': self.name,
+            'TableStatus': 'ACTIVE',
+            'KeySchema': self.definition['KeySchema'],
+            'AttributeDefinitions': self.definition.get('AttributeDefinitions', []),
+            'ItemCount': self.item_count,
+            'TableArn': f'arn:aws:dynamodb:local:000000000000:table/{self.name}',
+            'BillingModeSummary': {'BillingMode': self.definition.get('BillingMode', 'PROVISIONED')}
+        }
+        if self.definition.get('GlobalSecondaryIndexes'):
+            description['GlobalSecondaryIndexes'] = [
+                {**index, 'IndexStatus': 'ACTIVE'} for index in self.definition['GlobalSecondaryIndexes']
+            ]
+        return description
+
+
+def key_names(key_schema):
+    hash_key = next(key['AttributeName'] for key in key_schema if key['KeyType'] == 'HASH')
+    range_key = next((key['AttributeName'] for key in key_schema if key['KeyType'] == 'RANGE'), None)
+    return hash_key, range_key
+
+
+def split_key_condition(node, hash_key, range_key):
+    """Return (partition value, [range conditions]) from an AND of key conditions."""
+    terms = []
+
+    def flatten(term):
+        if term[0] == 'and':
+            flatten(term[1])
+            flatten(term[2])
+        else:
+            terms.append(term)
+
+    flatten(node)
+    hash_value = MISSING
+    range_terms = []
+    for term in terms:
+        if term[0] == 'compare' and term[1] == '=' and term[2] == ('path', [hash_key]):
+            hash_value = term[3][1]
+        elif range_key and term_path(term) == ('path', [range_key]):
+            range_terms.append(term)
+        else:
+            raise DynamoDBError('ValidationException', 'Query key condition not supported')
+    if hash_value is MISSING:
+        raise DynamoDBError('ValidationException', 'Query condition missed key schema element')
+    return hash_value, range_terms
+
+
+def sort_key_slice(sort_keys, range_terms):
+    """Index range [low, high) of sort_keys that can satisfy the sort key conditions."""
+    low, high = 0, len(sort_keys)
+    try:
+        for term in range_terms:
+            if term[0] == 'between':
+                low = max(low, bisect.bisect_left(sort_keys, term[2][1]))
+                high = min(high, bisect.bisect_right(sort_keys, term[3][1]))
+            elif term[0] == 'call':
+                # begins_with: everything from the prefix on; the term itself trims the end
+                low = max(low, bisect.bisect_left(sort_keys, term[2][1][1]))
+            else:
+                operator, value = term[1], term[3][1]
+                if operator in ('=', '>='):
+                    low = max(low, bisect.bisect_left(sort_keys, value))
+                if operator == '>':
+                    low = max(low, bisect.bisect_right(sort_keys, value))
+                if operator in ('=', '<='):
+                    high = min(high, bisect.bisect_right(sort_keys, value))
+                if operator == '<':
+                    high = min(high, bisect.bisect_left(sort_keys, value))
+    except TypeError:
+        raise DynamoDBError('ValidationException', 'One or more parameter values were invalid: Condition parameter type does not match schema type')
+    return low, high
+
+
+def term_path(term):
+    if term[0] in ('compare', 'between'):
+        return term[2] if term[0] == 'compare' else term[1]
+    if term[0] == 'call' and term[1] == 'begins_with':
+        return term[2][0]
+    return None
+
+
+def consumed(table_name, units, requested):
+    return {'TableName': table_name, 'CapacityUnits': units} if requested not in (None, 'NONE') else None
+
+
+class LocalDynamoDB:
+    """All tables of the local backend. Callers serialize access with the backend lock."""
+
+    def __init__(self):
+        self.tables = {}
+        # Running totals across all calls, for benchmarks
+        self.stats = {'read_units': 0.0, 'write_units': 0.0, 'items_read': 0, 'items_written': 0}
+
+    def table(self, name):
+        if name not in self.tables:
+            raise DynamoDBError('ResourceNotFoundException', f'Requested resource not found: Table: {name} not found')
+        return self.tables[name]
+
+    def charge_read(self, size, consistent=False):
+        units = math.ceil(size / READ_UNIT_BYTES) * (1 if consistent else 0.5)
+        self.stats['read_units'] += units
+        return units
+
+    def charge_write(self, size):
+        units = max(1, math.ceil(size / WRITE_UNIT_BYTES))
+        self.stats['write_units'] += units
+        self.stats['items_written'] += 1
+        return units
+
+    def with_capacity(self, response, table_name, units, params):
+        capacity = consumed(table_name, units, params.get('ReturnConsumedCapacity'))
+        if capacity:
+            response['ConsumedCapacity'] = capacity
+        return response
+
+    def condition_holds(self, params, item):
+        expression = params.get('ConditionExpression')
+        if not expression:
+            return True
+        parser = ExpressionParser(expression, params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues'))
+        return evaluate(item or {}, parser.parse_condition())
+
+    # Control plane
+    def CreateTable(self, params):
+        if params['TableName'] in self.tables:
+            raise DynamoDBError('ResourceInUseException', f"Table already exists: {params['TableName']}")
+        table = self.tables[params['TableName']] = LocalTable(params)
+        return {'TableDescription': table.describe()}
+
+    def DescribeTable(self, params):
+        return {'Table': self.table(params['TableName']).describe()}
+
+    def DeleteTable(self, params):
+        table = self.table(params['TableName'])
+        del self.tables[table.name]
+        return {'TableDescription': table.describe()}
+
+    def ListTables(self, params):
+        return {'TableNames': sorted(self.tables)}
+
+    def UpdateTimeToLive(self, params):
+        specification = params['TimeToLiveSpecification']
+        self.table(params['TableName']).ttl = specification['AttributeName'] if specification['Enabled'] else None
+        return {'TimeToLiveSpecification': specification}
+
+    def DescribeTimeToLive(self, params):
+        attribute = self.table(params['TableName']).ttl
+        description = {'TimeToLiveStatus': 'ENABLED' if attribute else 'DISABLED'}
+        if attribute:
+            description['AttributeName'] = attribute
+        return {'TimeToLiveDescription': description}
+
+    # Items
+    def GetItem(self, params):
+        table = self.table(params['TableName'])
+        item = table.get(deserialize_item(params['Key']))
+        response = {}
+        size = item_size(item) if item else 1
+        units = self.charge_read(size, params.get('ConsistentRead', False))
+        if item is not None:
+            self.stats['items_read'] += 1
+            paths = projection_paths(params)
+            response['Item'] = serialize_item(project(item, paths))
+        return self.with_capacity(response, table.name, units, params)
+
+    def PutItem(self, params):
+        table = self.table(params['TableName'])
+        item = deserialize_item(params['Item'])
+        old = table.get(table.primary_key(item))
+        if not self.condition_holds(params, old):
+            raise DynamoDBError('ConditionalCheckFailedException', 'The conditional request failed')
+        table.put(item)
+        response = {}
+        if params.get('ReturnValues') == 'ALL_OLD' and old is not None:
+            response['Attributes'] = serialize_item(old)
+        return self.with_capacity(response, table.name, self.charge_write(max(item_size(item), item_size(old or {}))), params)
+
+    def DeleteItem(self, params):
+        table = self.table(params['TableName'])
+        key = deserialize_item(params['Key'])
+        old = table.get(key)
+        if not self.condition_holds(params, old):
+            raise DynamoDBError('ConditionalCheckFailedException', 'The conditional request failed')
+        table.delete(key)
+        response = {}
+        if params.get('ReturnValues') == 'ALL_OLD' and old is not None:
+            response['Attributes'] = serialize_item(old)
+        return self.with_capacity(response, table.name, self.charge_write(item_size(old or {})), params)
+
+    def UpdateItem(self, params):
+        table = self.table(params['TableName'])
+        key = deserialize_item(params['Key'])
+        old = table.get(key)
+        if not self.condition_holds(params, old):
+            raise DynamoDBError('ConditionalCheckFailedException', 'The conditional request failed')
+        parser = ExpressionParser(params.get('UpdateExpression', ''), params.get('ExpressionAttributeNames'),
+                                  params.get('ExpressionAttributeValues'))
+        new = apply_update(old if old is not None else dict(key), parser.parse_update())
+        if table.primary_key(new) != key:
+            raise DynamoDBError('ValidationException', 'Cannot update attribute of the primary key')
+        table.put(new)
+
+        response = {}
+        return_values = params.get('ReturnValues', 'NONE')
+        if return_values in ('ALL_NEW', 'UPDATED_NEW'):
+            response['Attributes'] = serialize_item(new)
+        elif return_values in ('ALL_OLD', 'UPDATED_OLD') and old is not None:
+            response['Attributes'] = serialize_item(old)
+        return self.with_capacity(response, table.name, self.charge_write(max(item_size(new), item_size(old or {}))), params)
+
+    def BatchWriteItem(self, params):
+        requests = [(name, request) for name, table_requests in params['RequestItems'].items() for request in table_requests]
+        if len(requests) > MAX_BATCH_WRITE_ITEMS:
+            raise DynamoDBError('ValidationException', 'Too many items requested for the BatchWriteItem call')
+        seen = set()
+        for name, request in requests:
+            table = self.table(name)
+            body = request.get('PutRequest', {}).get('Item') or request.get('DeleteRequest', {}).get('Key')
+            key = (name, table.key_of(deserialize_item(body)))
+            if key in seen:
+                raise DynamoDBError('ValidationException', 'Provided list of item keys contains duplicates')
+            seen.add(key)
+
+        units = {}
+        for name, request in requests:
+            table = self.table(name)
+            if 'PutRequest' in request:
+                item = deserialize_item(request['PutRequest']['Item'])
+                table.put(item)
+                size = item_size(item)
+            else:
+                key = deserialize_item(request['DeleteRequest']['Key'])
+                size = item_size(table.get(key) or {})
+                table.delete(key)
+            units[name] = units.get(name, 0) + self.charge_write(size)
+        response = {'UnprocessedItems': {}}
+        if params.get('ReturnConsumedCapacity') not in (None, 'NONE'):
+            response['ConsumedCapacity'] = [{'TableName': name, 'CapacityUnits': value} for name, value in units.items()]
+        return response
+
+    def BatchGetItem(self, params):
+        responses = {}
+        for name, request in params['RequestItems'].items():
+            table = self.table(name)
+            paths = projection_paths(request)
+            items = []
+            for key in request['Keys']:
+                item = table.get(deserialize_item(key))
+                self.charge_read(item_size(item) if item else 1, request.get('ConsistentRead', False))
+                if item is not None:
+                    self.stats['items_read'] += 1
+                    items.append(serialize_item(project(item, paths)))
+            responses[name] = items
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+    # Reads
+    def Query(self, params):
+        table = self.table(params['TableName'])
+        names, values = params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues')
+        index_name = params.get('IndexName')
+        if index_name:
+            if index_name not in table.indexes:
+                raise DynamoDBError('ValidationException', f'The table does not have the specified index: {index_name}')
+            (hash_key, range_key), _ = table.indexes[index_name]
+        else:
+            hash_key, range_key = table.hash_key, table.range_key
+
+        parser = ExpressionParser(params['KeyConditionExpression'], names, values)
+        hash_value, range_terms = split_key_condition(parser.parse_condition(), hash_key, range_key)
+
+        forward = params.get('ScanIndexForward', True)
+        if index_name:
+            candidates = [
+                item for partition in table.partitions.values() for item in partition.items.values()
+                if item.get(hash_key, MISSING) == hash_value and (range_key is None or range_key in item)
+                and all(evaluate(item, term) for term in range_terms)
+            ]
+            candidates.sort(key=lambda item: ((item[range_key],) if range_key else ()) + table.key_of(item),
+                            reverse=not forward)
+            start_applied = False
+        else:
+            # Bisect the sorted sort keys to the key condition's range, and past the
+            # ExclusiveStartKey, so a page costs what it reads rather than the partition size
+            partition = table.partitions.get(hash_value)
+            sort_keys = partition.sort_keys if partition else []
+            low, high = sort_key_slice(sort_keys, range_terms)
+            start = params.get('ExclusiveStartKey')
+            if start and range_key:
+                start_value = deserialize_item(start)[range_key]
+                if forward:
+                    low = max(low, bisect.bisect_right(sort_keys, start_value))
+                else:
+                    high = min(high, bisect.bisect_left(sort_keys, start_value))
+            positions = range(low, high) if forward else range(high - 1, low - 1, -1)
+            candidates = (
+                item for item in (partition.items[sort_keys[i]] for i in positions)
+                if all(evaluate(item, term) for term in range_terms)
+            )
+            start_applied = True
+
+        def position_key(item):
+            return table.primary_key(item) if not index_name else {
+                **table.primary_key(item), hash_key: item[hash_key], **({range_key: item[range_key]} if range_key else {})
+            }
+
+        return self.read_page(table, candidates, params, position_key, start_applied)
+
+    def Scan(self, params):
+        table = self.table(params['TableName'])
+        candidates = (
+            partition.items[sort_key]
+            for _, partition in sorted(table.partitions.items(), key=lambda entry: str(entry[0]))
+            for sort_key in partition.sort_keys
+        )
+        return self.read_page(table, candidates, params, table.primary_key)
+
+    def read_page(self, table, candidates, params, position_key, start_applied=False):
+        """Apply ExclusiveStartKey, Limit, the 1 MB page size, the filter and the projection to an iterable of items."""
+        candidates = iter(candidates)
+        start = params.get('ExclusiveStartKey')
+        if start and not start_applied:
+            start = deserialize_item(start)
+            for item in candidates:
+                if position_key(item) == start:
+                    break
+
+        names, values = params.get('ExpressionAttributeNames'), params.get('ExpressionAttributeValues')
+        item_filter = ExpressionParser(params['FilterExpression'], names, values).parse_condition() \
+            if params.get('FilterExpression') else None
+        paths = projection_paths(params)
+        limit = params.get('Limit')
+
+        items, scanned, size = [], 0, 0
+        last_key = None
+        previous = None
+        for item in candidates:
+            if scanned and ((limit is not None and scanned >= limit) or size >= PAGE_SIZE_BYTES):
+                # Resume after the last item evaluated, matched by the filter or not
+                last_key = position_key(previous)
+                break
+            scanned += 1
+            size += item_size(item)
+            previous = item
+            if item_filter is None or evaluate(item, item_filter):
+                items.append(item)
+
+        units = self.charge_read(max(size, 1), params.get('ConsistentRead', False))
+        self.stats['items_read'] += scanned
+        response = {'Count': len(items), 'ScannedCount': scanned}
+        if params.get('Select') != 'COUNT':
+            response['Items'] = [serialize_item(project(item, paths)) for item in items]
+        if last_key is not None:
+            response['LastEvaluatedKey'] = serialize_item(last_key)
+        return self.with_capacity(response, table.name, units, params)
+
+
+def projection_paths(params):
+    expression = params.get('ProjectionExpression')
+    if not expression:
+        return None
+    return ExpressionParser(expression, params.get('ExpressionAttributeNames')).parse_projection()
@@ -1,109 +1,55 @@
-import boto3
+import argparse
 from botocore.exceptions import ClientError
+import glob
+import io
 import json
-import time
-
-# Initialize clients for IAM, Lambda, S3, and DynamoDB
-iam_client = boto3.client('iam')
-lambda_client = boto3.client('lambda', region_name='us-east-2')
-s3_client = boto3.client('s3', region_name='us-east-2')
-dynamodb_resource = boto3.resource('dynamodb', region_name='us-east-2')
+import os
+import zipfile
+import aws_clients
+from create_bucket_and_table import (PLOT_EXPIRATION_DAYS, PLOT_PREFIX, create_s3_bucket, create_dynamodb_table,
+                                     create_ledger_table, create_summary_table, expire_plots)
+from rollups import TTL_ATTRIBUTE
+from provisioning import GATHER_MAX_WORKERS, RETRYABLE_ERROR_CODES, gather, poll, run_steps, skip_unchanged, with_retries
+
+# Initialize clients for IAM, Lambda, S3, DynamoDB and EventBridge; the plan reads use them from GATHER_MAX_WORKERS threads
+iam_client = aws_clients.client('iam', max_pool_connections=GATHER_MAX_WORKERS)
+lambda_client = aws_clients.client('lambda', max_pool_connections=GATHER_MAX_WORKERS)
+s3_client = aws_clients.client('s3', max_pool_connections=GATHER_MAX_WORKERS)
+dynamodb_client = aws_clients.client('dynamodb', max_pool_connections=GATHER_MAX_WORKERS)
+events_client = aws_clients.client('events', max_pool_connections=GATHER_MAX_WORKERS)
 
 # Role and Lambda details
 ROLE_ARNS = {
     'driver': 'arn:aws:iam::783764596465:role/driver-role',
     'size_tracking': 'arn:aws:iam::783764596465:role/size-tracking-role',
-    'plotting': 'arn:aws:iam::783764596465:role/plotting-role'
+    'plotting': 'arn:aws:iam::783764596465:role/plotting-role',
+    'reconcile': 'arn:aws:iam::783764596465:role/reconcile-role',
+    'compaction': 'arn:aws:iam::783764596465:role/compaction-role'
 }
 LAMBDA_NAMES = {
     'driver': 'arn:aws:lambda:us-east-2:783764596465:function:driver',
     'size_tracking': 'arn:aws:lambda:us-east-2:783764596465:function:size-tracking',
-    'plotting': 'arn:aws:lambda:us-east-2:783764596465:function:plotting'
+    'plotting': 'arn:aws:lambda:us-east-2:783764596465:function:plotting',
+    'reconcile': 'arn:aws:lambda:us-east-2:783764596465:function:reconcile',
+    'compaction': 'arn:aws:lambda:us-east-2:783764596465:function:compaction'
 }
 
-# Step 1: Create S3 Bucket and DynamoDB Table
-# Create an S3 bucket
-def create_s3_bucket(bucket_name):
-    try:
-        s3_client.create_bucket(Bucket=bucket_name, CreateBucketConfiguration={'LocationConstraint': 'us-east-2'})
-        print(f"✅ Bucket '{bucket_name}' created successfully.")
-    except ClientError as e:
-        print(f"❌ Error creating bucket: {e}")
-
-# Create a DynamoDB table named 'S3-object-size-history'
-def create_dynamodb_table(table_name):
-    try:
-        table = dynamodb_resource.create_table(
-            TableName=table_name,
-            KeySchema=[
-                {
-                    'AttributeName': 'bucket_name',
-                    'KeyType': 'HASH'  # Partition key
-                },
-                {
-                    'AttributeName': 'timestamp',
-                    'KeyType': 'RANGE'  # Sort key
-                }
-            ],
-            AttributeDefinitions=[
-                {
-                    'AttributeName': 'bucket_name',
-                    'AttributeType': 'S'
-                },
-                {
-                    'AttributeName': 'timestamp',
-                    'AttributeType': 'N'
-                },
-                {
-                    'AttributeName': 'size',
-                    'AttributeType': 'N'
-                }
-            ],
-            ProvisionedThroughput={
-                'ReadCapacityUnits': 5,
-                'WriteCapacityUnits': 5
-            },
-            GlobalSecondaryIndexes=[
-                {
-                    'IndexName': 'BucketSizeIndex',
-                    'KeySchema': [
-                        {
-                            'AttributeName': 'bucket_name',
-                            'KeyType': 'HASH'
-                        },
-                        {
-                            'AttributeName': 'size',
-                            'KeyType': 'RANGE'
-                        }
-                    ],
-                    'Projection': {
-                        'ProjectionType': 'ALL'
-                    },
-                    'ProvisionedThroughput': {
-                        'ReadCapacityUnits': 5,
-                        'WriteCapacityUnits': 5
-                    }
-                }
-            ]
-        )
-        print(f"✅ Table '{table_name}' is being created...")
-        table.wait_until_exists()
-        print(f"✅ Table '{table_name}' created successfully.")
-    except ClientError as e:
-        print(f"❌ Error creating table: {e}")
-
+# Step 1: Create S3 Bucket and DynamoDB Tables (see create_bucket_and_table.py)
 s3_bucket_name = 'testbucket-cs6620-lef'
+# Plots go to their own bucket, so storing one does not change the size being tracked
+plot_bucket_name = 'testbucket-cs6620-lef-plots'
 dynamodb_table_name = 'S3-object-size-history'
-
-
-# Create S3 bucket
-#create_s3_bucket(s3_bucket_name)
-
-# Create DynamoDB table
-#create_dynamodb_table(dynamodb_table_name)
+ledger_table_name = 'S3-object-size-ledger'
+summary_table_name = 'S3-bucket-size-summary'
+# Key attributes, GSIs and TTL attribute each table is expected to have, used by the plan
+TABLE_SCHEMAS = {
+    dynamodb_table_name: {'keys': ['bucket_name', 'timestamp'], 'indexes': ['BucketSizeIndex'], 'ttl': TTL_ATTRIBUTE},
+    ledger_table_name: {'keys': ['bucket_name', 'object_key'], 'indexes': [], 'ttl': TTL_ATTRIBUTE},
+    summary_table_name: {'keys': ['bucket_name'], 'indexes': [], 'ttl': None}
+}
 
 # Step 2: Attach Permissions to Roles
-# Adding S3, DynamoDB permissions to driver, size-tracking, and plotting roles
+# Adding S3, DynamoDB permissions to driver, size-tracking, plotting, reconcile and compaction roles
 policies = {
     'driver': {
         "Version": "2012-10-17",
@@ -119,6 +65,20 @@ policies = {
                     "arn:aws:s3:::testbucket-cs6620-lef",
                     "arn:aws:s3:::testbucket-cs6620-lef/*"
                 ]
+            },
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:Query"
+                ],
+                "Resource": "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-history"
+            },
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "lambda:InvokeFunction"
+                ],
+                "Resource": "arn:aws:lambda:us-east-2:783764596465:function:plotting"
             }
         ]
     },
@@ -140,10 +100,29 @@ policies = {
                 "Effect": "Allow",
                 "Action": [
                     "dynamodb:PutItem",
+                    "dynamodb:BatchWriteItem",
                     "dynamodb:UpdateItem",
                     "dynamodb:Query"
                 ],
-                "Resource": "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-history"
+                "Resource": [
+                    "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-history",
+                    "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-history/index/BucketSizeIndex"
+                ]
+            },
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:GetItem",
+                    "dynamodb:PutItem",
+                    "dynamodb:UpdateItem",
+                    "dynamodb:DeleteItem",
+                    "dynamodb:BatchWriteItem",
+                    "dynamodb:Query"
+                ],
+                "Resource": [
+                    "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-ledger",
+                    "arn:aws:dynamodb:us-east-2:783764596465:table/S3-bucket-size-summary"
+                ]
             }
         ]
     },
@@ -162,252 +141,539 @@ policies = {
             },
             {
                 "Effect": "Allow",
-                "Action": "s3:PutObject",
-                "Resource": "arn:aws:s3:::testbucket-cs6620-lef/plot.png"
+                "Action": [
+                    "dynamodb:GetItem"
+                ],
+                "Resource": "arn:aws:dynamodb:us-east-2:783764596465:table/S3-bucket-size-summary"
+            },
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "s3:PutObject",
+                    "s3:GetObject"
+                ],
+                "Resource": [
+                    "arn:aws:s3:::testbucket-cs6620-lef-plots/plots/*"
+                ]
+            },
+            {
+                # Without ListBucket, S3 answers 403 instead of 404 when HeadObject finds no cached plot
+                "Effect": "Allow",
+                "Action": [
+                    "s3:ListBucket"
+                ],
+                "Resource": "arn:aws:s3:::testbucket-cs6620-lef-plots"
+            }
+        ]
+    },
+    'reconcile': {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "s3:ListBucket"
+                ],
+                "Resource": "arn:aws:s3:::testbucket-cs6620-lef"
+            },
+            {
+                # The correction sample, its extremes and its rollups
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:PutItem",
+                    "dynamodb:BatchWriteItem",
+                    "dynamodb:UpdateItem",
+                    "dynamodb:Query"
+                ],
+                "Resource": [
+                    "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-history",
+                    "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-history/index/BucketSizeIndex"
+                ]
+            },
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:Query",
+                    "dynamodb:UpdateItem",
+                    "dynamodb:DeleteItem"
+                ],
+                "Resource": "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-ledger"
+            },
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:GetItem",
+                    "dynamodb:UpdateItem"
+                ],
+                "Resource": "arn:aws:dynamodb:us-east-2:783764596465:table/S3-bucket-size-summary"
+            }
+        ]
+    },
+    'compaction': {
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:Query",
+                    "dynamodb:PutItem",
+                    "dynamodb:DeleteItem"
+                ],
+                "Resource": "arn:aws:dynamodb:us-east-2:783764596465:table/S3-object-size-history"
+            },
+            {
+                "Effect": "Allow",
+                "Action": [
+                    "dynamodb:GetItem",
+                    "dynamodb:UpdateItem"
+                ],
+                "Resource": "arn:aws:dynamodb:us-east-2:783764596465:table/S3-bucket-size-summary"
             }
         ]
     }
 }
 
-for role, policy in policies.items():
-    try:
-        iam_client.put_role_policy(
-            RoleName=ROLE_ARNS[role].split('/')[-1],
-            PolicyName=f'{role.capitalize()}AccessPolicy',
-            PolicyDocument=json.dumps(policy)
-        )
-        print(f"✅ Permissions added to {role} role successfully.")
-    except ClientError as e:
-        print(f"❌ Error attaching policy to {role} role: {e}")
+def attach_role_policy(role, policy):
+    iam_client.put_role_policy(
+        RoleName=ROLE_ARNS[role].split('/')[-1],
+        PolicyName=f'{role.capitalize()}AccessPolicy',
+        PolicyDocument=json.dumps(policy)
+    )
+    print(f"✅ Permissions added to {role} role successfully.")
+
 
 # Step 3: Enable S3 Bucket Event Notifications to Trigger Size Tracking Lambda
-# def enable_s3_event_notification(bucket_name, lambda_arn):
-#     notification_configuration = {
-#         'LambdaFunctionConfigurations': [
-#             {
-#                 'LambdaFunctionArn': lambda_arn,
-#                 'Events': ['s3:ObjectCreated:*', 's3:ObjectRemoved:*', 's3:ObjectRestore:Post']
-#             }
-#         ]
-#     }
-#     try:
-#         s3_client.put_bucket_notification_configuration(
-#             Bucket=bucket_name,
-#             NotificationConfiguration=notification_configuration
-#         )
-#         print(f"Event notifications configured for bucket '{bucket_name}' to trigger Lambda '{lambda_arn}'.")
-#     except ClientError as e:
-#         print(f"Error setting bucket notifications: {e}")
-#
-# # Enable event notifications
-# enable_s3_event_notification('testbucket-cs6620-lef', LAMBDA_NAMES['size_tracking'])
+# Buckets whose events are sent to the size-tracking Lambda
+TRACKED_BUCKETS = [s3_bucket_name]
+SIZE_TRACKING_EVENTS = ['s3:ObjectCreated:*', 's3:ObjectRemoved:*', 's3:ObjectRestore:Post']
+size_tracking_name = 'size_tracking'
+size_tracking_arn = 'arn:aws:lambda:us-east-2:783764596465:function:size_tracking'
+
+def add_invoke_permission(lambda_name, statement_id, principal, source_arn):
+    def add_permission():
+        # ResourceConflictException also means the function is being updated, which is worth
+        # retrying, but an existing statement is final and must not be retried with backoff
+        try:
+            lambda_client.add_permission(
+                FunctionName=lambda_name,
+                StatementId=statement_id,
+                Action='lambda:InvokeFunction',
+                Principal=principal,
+                SourceArn=source_arn
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ResourceConflictException' or 'already exists' not in str(e):
+                raise
+
+    with_retries(add_permission)
+
 def add_lambda_permission(lambda_name, bucket_name):
     try:
-        lambda_client.add_permission(
-            FunctionName=lambda_name,
-            StatementId=f'AllowS3Invoke-{bucket_name}',
-            Action='lambda:InvokeFunction',
-            Principal='s3.amazonaws.com',
-            SourceArn=f'arn:aws:s3:::{bucket_name}'
-        )
+        add_invoke_permission(lambda_name, f'AllowS3Invoke-{bucket_name}', 's3.amazonaws.com', f'arn:aws:s3:::{bucket_name}')
         print(f"✅ Permission is added，allow S3'{bucket_name}'use Lambda'{lambda_name}'")
     except ClientError as e:
-        if 'already exists' in str(e):
-            print(f"✅ Permission is added, allow S3'{bucket_name}'use Lambda'{lambda_name}'")
-        else:
-            print(f"❌ Something went wrong when adding permission: {e}")
+        print(f"❌ Something went wrong when adding permission: {e}")
+        raise
 
-def enable_s3_event_notification(bucket_name, lambda_arn, lambda_name):
-    # 首先添加权限，允许S3调用Lambda
-    add_lambda_permission(lambda_name, bucket_name)
 
-    # 然后设置通知
+def enable_s3_event_notification(bucket_name, lambda_arn):
+    # S3 validates the destination, so the invoke permission must already exist
     notification_configuration = {
         'LambdaFunctionConfigurations': [
             {
                 'LambdaFunctionArn': lambda_arn,
-                'Events': ['s3:ObjectCreated:*', 's3:ObjectRemoved:*', 's3:ObjectRestore:Post']
+                'Events': SIZE_TRACKING_EVENTS
             }
         ]
     }
-    try:
-        s3_client.put_bucket_notification_configuration(
-            Bucket=bucket_name,
-            NotificationConfiguration=notification_configuration
-        )
-        print(f"✅ Successfully configured event notification for bucket '{bucket_name}' to trigger Lambda '{lambda_arn}'.")
-    except ClientError as e:
-        print(f"❌ Error occurred while setting up bucket notification: {e}")
-
-# 启用事件通知
-lambda_name = 'size_tracking'
-lambda_arn = 'arn:aws:lambda:us-east-2:783764596465:function:size_tracking'
-
-
-enable_s3_event_notification('testbucket-cs6620-lef', lambda_arn, lambda_name)
-
-# Step 4: Update Lambda Timeout and Memory Settings
-# def update_lambda_settings(lambda_arn, timeout=30, memory_size=512):
-#     try:
-#         lambda_client.update_function_configuration(
-#             FunctionName=lambda_arn,
-#             Timeout=timeout,
-#             MemorySize=memory_size
-#         )
-#         print(f"Updated Lambda '{lambda_arn}' with timeout={timeout}s and memory size={memory_size}MB.")
-#     except ClientError as e:
-#         print(f"Error updating Lambda configuration: {e}")
-#
-# # Update settings for plotting Lambda
-# update_lambda_settings(LAMBDA_NAMES['plotting'], timeout=30, memory_size=512)
-# update_lambda_settings(LAMBDA_NAMES['driver'], timeout=15, memory_size=512)
-#
-# # Step 5: Add Lambda Layer for Matplotlib
-#
-# def add_lambda_layer(lambda_arn, layer_arn):
-#     try:
-#         lambda_client.update_function_configuration(
-#             FunctionName=lambda_arn,
-#             Layers=[layer_arn]
-#         )
-#         print(f"Added layer '{layer_arn}' to Lambda '{lambda_arn}'.")
-#     except ClientError as e:
-#         print(f"Error adding layer to Lambda: {e}")
-#
-# # Assume we already created a Lambda Layer for matplotlib and got the ARN
-# MATPLOTLIB_LAYER_ARN = 'arn:aws:lambda:us-east-2:783764596465:layer:matplotlib-layer:1'
-# REQUESTS_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-requests:12'
-#
-# # Add layer to plotting Lambda
-# add_lambda_layer(LAMBDA_NAMES['plotting'], MATPLOTLIB_LAYER_ARN)
-# add_lambda_layer(LAMBDA_NAMES['driver'], REQUESTS_LAYER_ARN)
-import boto3
-import time
-from botocore.exceptions import ClientError
+    with_retries(
+        s3_client.put_bucket_notification_configuration,
+        Bucket=bucket_name,
+        NotificationConfiguration=notification_configuration
+    )
+    print(f"✅ Successfully configured event notification for bucket '{bucket_name}' to trigger Lambda '{lambda_arn}'.")
 
-lambda_client = boto3.client('lambda', region_name='us-east-2')
-
-def wait_for_lambda_update(lambda_name):
-    """等待 Lambda 更新完成"""
-    print(f"⏳ Waiting for Lambda {lambda_name} updating...")
-    waiter = lambda_client.get_waiter('function_updated')
-    try:
-        # 使用AWS内置的waiter来等待函数更新完成
-        waiter.wait(FunctionName=lambda_name)
-        print(f"✅ Lambda {lambda_name} now is activated")
-        return True
-    except Exception as e:
-        print(f"❌ Error occurred while waiting for updating Lambda configuration: {e}")
-        return False
-
-def update_lambda_settings(lambda_name, timeout, memory_size):
-    """更新 Lambda 配置"""
-    # 确保使用函数名而不是ARN
-    function_name = lambda_name.split(":")[-1] if ":" in lambda_name else lambda_name
-
-    try:
-        lambda_client.update_function_configuration(
-            FunctionName=function_name,
-            Timeout=timeout,
-            MemorySize=memory_size
-        )
-        print(f"⏳ Updating Lambda '{function_name}' : timeout={timeout}s, memory={memory_size}MB...")
 
-        # 等待此更新完成
-        if wait_for_lambda_update(function_name):
-            print(f"✅ Successfully updated Lambda '{function_name}' configuration.")
-        else:
-            print(f"❌ Unable to confirm the update status of Lambda '{function_name}'")
-    except ClientError as e:
-        print(f"❌ Error occurred while updating Lambda configuration: {e}")
+# Step 4 & 5: Lambda timeout, memory and layers
+REQUESTS_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-requests:15'
+MATPLOTLIB_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-matplotlib:16'
+NUMPY_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-numpy:14'
+# Desired configuration per function; layers are added to whatever the function already has
+LAMBDA_SETTINGS = {
+    'plotting': {'timeout': 30, 'memory_size': 512, 'layers': [MATPLOTLIB_LAYER_ARN, NUMPY_LAYER_ARN]},
+    'driver': {'timeout': 59, 'memory_size': 512, 'layers': [REQUESTS_LAYER_ARN]}
+}
 
-def wait_for_lambda_update(lambda_name, max_retries=10, delay=5):
+def wait_for_lambda_update(lambda_name, timeout=300):
     """
-    Wait for Lambda function update to complete before making changes.
+    Poll LastUpdateStatus until the function can take another configuration change.
+    Returns the function configuration.
     """
-    for attempt in range(max_retries):
-        try:
-            response = lambda_client.get_function_configuration(FunctionName=lambda_name)
-            status = response.get("LastUpdateStatus")
-
-            if status == "Successful":
-                print(f"✅ Lambda '{lambda_name}' update completed. Proceeding with changes.")
-                return True
-            elif status == "Failed":
-                print(f"❌ Lambda '{lambda_name}' last update failed. Check CloudWatch logs for details.")
-                return False
+    def ready():
+        configuration = lambda_client.get_function_configuration(FunctionName=lambda_name)
+        status = configuration.get('LastUpdateStatus', 'Successful')
+        if status == 'Failed':
+            raise RuntimeError(f"Lambda '{lambda_name}' last update failed: {configuration.get('LastUpdateStatusReason')}")
+        return configuration if status == 'Successful' else None
 
-            print(f"⏳ Lambda '{lambda_name}' is still updating... Waiting {delay} seconds ({attempt + 1}/{max_retries})")
-            time.sleep(delay)
-
-        except ClientError as e:
-            print(f"❌ Error fetching Lambda configuration: {e}")
-            return False
+    return poll(ready, f"Lambda '{lambda_name}' to finish updating", timeout=timeout)
 
-    print(f"❌ Lambda '{lambda_name}' did not complete updating within the expected time. Skipping changes.")
-    return False
+def configure_lambda(lambda_name, timeout, memory_size, layers, environment=None):
+    """
+    Apply timeout, memory, layers and (if given) environment variables in a single
+    update, so the function goes through one update cycle instead of one per setting.
+    """
+    function_name = lambda_name.split(":")[-1] if ":" in lambda_name else lambda_name
+    configuration = wait_for_lambda_update(function_name)
+    existing_layers = [layer['Arn'] for layer in configuration.get('Layers', [])]
+
+    print(f"⏳ Updating Lambda '{function_name}' : timeout={timeout}s, memory={memory_size}MB, layers={layers}...")
+    settings = {} if environment is None else {'Environment': {'Variables': environment}}
+    with_retries(
+        lambda_client.update_function_configuration,
+        FunctionName=function_name,
+        Timeout=timeout,
+        MemorySize=memory_size,
+        Layers=existing_layers + [layer for layer in layers if layer not in existing_layers],
+        **settings
+    )
+    wait_for_lambda_update(function_name)
+    print(f"✅ Successfully updated Lambda '{function_name}' configuration.")
+
+
+# Step 6: Scheduled functions
+# reconcile and compaction run on EventBridge rules instead of bucket events. Unlike the functions
+# above, they are created here from this directory's modules, each with a role of its own.
+SCHEDULED_FUNCTIONS = {
+    'reconcile': {'handler': 'reconcile.lambda_handler', 'schedule': 'rate(1 hour)', 'timeout': 900, 'memory_size': 512,
+                  'environment': {'RECONCILE_BUCKETS': ','.join(TRACKED_BUCKETS)}},
+    # More often than half the shortest retention, so rows are folded before their TTL removes them
+    'compaction': {'handler': 'compaction.lambda_handler', 'schedule': 'rate(1 hour)', 'timeout': 900, 'memory_size': 256,
+                   'environment': {'COMPACTION_BUCKETS': ','.join(TRACKED_BUCKETS)}}
+}
+LAMBDA_RUNTIME = 'python3.11'
+LAMBDA_TRUST_POLICY = {
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Effect": "Allow",
+            "Principal": {"Service": "lambda.amazonaws.com"},
+            "Action": "sts:AssumeRole"
+        }
+    ]
+}
+# CloudWatch Logs access, so the handlers' output and metrics lines are kept
+BASIC_EXECUTION_POLICY_ARN = 'arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole'
 
+def schedule_rule_name(name):
+    return f'{name}-schedule'
 
-def add_lambda_layer(lambda_name, layer_arn):
+def create_role(role):
+    role_name = ROLE_ARNS[role].split('/')[-1]
+    try:
+        iam_client.create_role(RoleName=role_name, AssumeRolePolicyDocument=json.dumps(LAMBDA_TRUST_POLICY))
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'EntityAlreadyExists':
+            raise
+    iam_client.attach_role_policy(RoleName=role_name, PolicyArn=BASIC_EXECUTION_POLICY_ARN)
+    print(f"✅ Role '{role_name}' is ready.")
+
+def deployment_package():
+    """The .py modules of this directory as a zip; the handlers import size_track and its helpers."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+            archive.write(path, os.path.basename(path))
+    return buffer.getvalue()
+
+def deploy_scheduled_function(name, handler, timeout, memory_size, environment):
+    """Create the function if it does not exist, otherwise bring its settings up to date."""
+    if fetch_function(name) is not None:
+        configure_lambda(name, timeout, memory_size, [], environment)
+        return
+    print(f"⏳ Creating Lambda '{name}' with handler '{handler}'...")
+    # A role created moments ago is not yet assumable by Lambda, which answers InvalidParameterValueException
+    with_retries(
+        lambda_client.create_function,
+        FunctionName=name,
+        Runtime=LAMBDA_RUNTIME,
+        Role=ROLE_ARNS[name],
+        Handler=handler,
+        Code={'ZipFile': deployment_package()},
+        Timeout=timeout,
+        MemorySize=memory_size,
+        Environment={'Variables': environment},
+        retryable=RETRYABLE_ERROR_CODES + ('InvalidParameterValueException',)
+    )
+    wait_for_lambda_update(name)
+    print(f"✅ Successfully created Lambda '{name}'.")
+
+def schedule_function(name, schedule):
+    rule_name = schedule_rule_name(name)
+    rule_arn = with_retries(events_client.put_rule, Name=rule_name, ScheduleExpression=schedule, State='ENABLED')['RuleArn']
+    add_invoke_permission(name, f'AllowEventsInvoke-{rule_name}', 'events.amazonaws.com', rule_arn)
+    response = with_retries(events_client.put_targets, Rule=rule_name, Targets=[{'Id': name, 'Arn': LAMBDA_NAMES[name]}])
+    if response.get('FailedEntryCount'):
+        raise RuntimeError(f"Could not target '{name}' from rule '{rule_name}': {response['FailedEntries']}")
+    print(f"✅ Rule '{rule_name}' invokes Lambda '{name}' on {schedule}.")
+
+
+def build_steps():
     """
-    Add a new layer to the Lambda function if it does not already exist.
-    Wait for updates to complete before modifying configuration.
+    The environment as a DAG: {step name: (action, [dependencies])}.
+    Tables, bucket and role policies do not depend on each other; the bucket
+    notification needs the bucket and the invoke permission, and a scheduled
+    function needs its role and policy before its rule can target it.
     """
-    try:
-        # Fetch current Lambda configuration
-        response = lambda_client.get_function_configuration(FunctionName=lambda_name)
-
-        # Get existing layers
-        existing_layers = response.get("Layers", [])
-        existing_layer_arns = [layer["Arn"] for layer in existing_layers]
-
-        # Check if the layer is already present
-        if layer_arn in existing_layer_arns:
-            print(f"⚠️ Layer '{layer_arn}' already exists in Lambda '{lambda_name}'. Skipping...")
-            return
-
-        # Wait for Lambda to be in a modifiable state
-        if not wait_for_lambda_update(lambda_name):
-            print(f"❌ Lambda '{lambda_name}' is not in a modifiable state. Skipping layer addition.")
-            return
-
-        # Add the new layer
-        updated_layers = existing_layer_arns + [layer_arn]
-
-        # Update Lambda function configuration
-        lambda_client.update_function_configuration(
-            FunctionName=lambda_name,
-            Layers=updated_layers
+    steps = {
+        'bucket': (lambda: create_s3_bucket(s3_bucket_name), []),
+        'bucket:plots': (lambda: create_s3_bucket(plot_bucket_name), []),
+        'lifecycle:plots': (lambda: expire_plots(plot_bucket_name, PLOT_PREFIX, PLOT_EXPIRATION_DAYS), ['bucket:plots']),
+        'table:history': (lambda: create_dynamodb_table(dynamodb_table_name), []),
+        'table:ledger': (lambda: create_ledger_table(ledger_table_name), []),
+        'table:summary': (lambda: create_summary_table(summary_table_name), [])
+    }
+    for role, policy in policies.items():
+        dependencies = [f'role:{role}'] if role in SCHEDULED_FUNCTIONS else []
+        steps[f'policy:{role}'] = (lambda role=role, policy=policy: attach_role_policy(role, policy), dependencies)
+    for bucket_name in TRACKED_BUCKETS:
+        steps[f'permission:{bucket_name}'] = (
+            lambda bucket_name=bucket_name: add_lambda_permission(size_tracking_name, bucket_name), []
         )
-        print(f"✅ Successfully added layer '{layer_arn}' to Lambda '{lambda_name}'.")
-
-    except ClientError as e:
-        if "ResourceConflictException" in str(e):
-            print(f"⚠️ Lambda '{lambda_name}' is currently updating. Retrying in 5 seconds...")
-            time.sleep(5)  # Wait and retry
-            add_lambda_layer(lambda_name, layer_arn)  # Recursive retry
-        else:
-            print(f"❌ Error adding layer to Lambda '{lambda_name}': {e}")
+        # Only the bucket created here is a step; other tracked buckets already exist
+        dependencies = [f'permission:{bucket_name}'] + (['bucket'] if bucket_name == s3_bucket_name else [])
+        steps[f'notification:{bucket_name}'] = (
+            lambda bucket_name=bucket_name: enable_s3_event_notification(bucket_name, size_tracking_arn),
+            dependencies
+        )
+    for name, settings in LAMBDA_SETTINGS.items():
+        steps[f'lambda:{name}'] = (lambda name=name, settings=settings: configure_lambda(name, **settings), [])
+    for name, settings in SCHEDULED_FUNCTIONS.items():
+        steps[f'role:{name}'] = (lambda name=name: create_role(name), [])
+        # The policy comes first so the first scheduled run already has its permissions
+        steps[f'function:{name}'] = (
+            lambda name=name, settings=settings: deploy_scheduled_function(
+                name, settings['handler'], settings['timeout'], settings['memory_size'], settings['environment']
+            ),
+            [f'role:{name}', f'policy:{name}']
+        )
+        steps[f'schedule:{name}'] = (
+            lambda name=name, settings=settings: schedule_function(name, settings['schedule']), [f'function:{name}']
+        )
+    return steps
 
 
+# Plan: read the current state of every resource in one concurrent pass and
+# compare it with the desired state above, so unchanged resources are not touched.
+def not_found_as_none(fetch, *not_found_codes):
+    try:
+        return fetch()
+    except ClientError as e:
+        if e.response['Error']['Code'] in not_found_codes:
+            return None
+        raise
+
+def fetch_bucket(bucket_name):
+    return not_found_as_none(lambda: bool(s3_client.head_bucket(Bucket=bucket_name)), '404', 'NoSuchBucket', 'NotFound')
+
+def fetch_lifecycle_rules(bucket_name):
+    response = not_found_as_none(
+        lambda: s3_client.get_bucket_lifecycle_configuration(Bucket=bucket_name),
+        'NoSuchLifecycleConfiguration', 'NoSuchBucket'
+    )
+    return [] if response is None else response.get('Rules', [])
+
+def fetch_table(table_name):
+    description = not_found_as_none(
+        lambda: dynamodb_client.describe_table(TableName=table_name)['Table'],
+        'ResourceNotFoundException'
+    )
+    if description is None:
+        return None
+    ttl = dynamodb_client.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+    return {
+        'keys': [key['AttributeName'] for key in description['KeySchema']],
+        'indexes': sorted(index['IndexName'] for index in description.get('GlobalSecondaryIndexes', [])),
+        'ttl': ttl.get('AttributeName') if ttl.get('TimeToLiveStatus') in ('ENABLED', 'ENABLING') else None
+    }
 
-# Assume we already created a Lambda Layer for matplotlib and got the ARN
-# MATPLOTLIB_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-matplotlib:14'
-REQUESTS_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-requests:15'
-MATPLOTLIB_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-matplotlib:16'
-NUMPY_LAYER_ARN = 'arn:aws:lambda:us-east-2:770693421928:layer:Klayers-p311-numpy:14'
+def fetch_role_policy(role):
+    response = not_found_as_none(
+        lambda: iam_client.get_role_policy(RoleName=ROLE_ARNS[role].split('/')[-1],
+                                           PolicyName=f'{role.capitalize()}AccessPolicy'),
+        'NoSuchEntity'
+    )
+    if response is None:
+        return None
+    document = response['PolicyDocument']
+    # boto3 decodes the URL-encoded document into a dict; be tolerant of a raw string
+    return json.loads(document) if isinstance(document, str) else document
+
+def fetch_invoke_statements(lambda_name):
+    response = not_found_as_none(lambda: lambda_client.get_policy(FunctionName=lambda_name), 'ResourceNotFoundException')
+    if response is None:
+        return {}
+    return {statement['Sid']: statement for statement in json.loads(response['Policy'])['Statement']}
+
+def fetch_notification(bucket_name):
+    response = not_found_as_none(
+        lambda: s3_client.get_bucket_notification_configuration(Bucket=bucket_name),
+        'NoSuchBucket'
+    )
+    return None if response is None else response.get('LambdaFunctionConfigurations', [])
+
+def fetch_function(lambda_name):
+    configuration = not_found_as_none(
+        lambda: lambda_client.get_function_configuration(FunctionName=lambda_name),
+        'ResourceNotFoundException'
+    )
+    if configuration is None:
+        return None
+    return {
+        'timeout': configuration['Timeout'],
+        'memory_size': configuration['MemorySize'],
+        'layers': [layer['Arn'] for layer in configuration.get('Layers', [])],
+        'environment': configuration.get('Environment', {}).get('Variables', {})
+    }
 
-# 更新 Lambda 超时 & 内存
-update_lambda_settings("plotting", timeout=30, memory_size=512)
-# 等待一下确保上一个操作完成
-time.sleep(5)
-update_lambda_settings("driver", timeout=59, memory_size=512)
-# 等待一下确保上一个操作完成
-time.sleep(5)
+def fetch_role(role):
+    return not_found_as_none(lambda: bool(iam_client.get_role(RoleName=ROLE_ARNS[role].split('/')[-1])), 'NoSuchEntity')
+
+def fetch_schedule(name):
+    rule_name = schedule_rule_name(name)
+    rule = not_found_as_none(lambda: events_client.describe_rule(Name=rule_name), 'ResourceNotFoundException')
+    if rule is None:
+        return None
+    statement = fetch_invoke_statements(name).get(f'AllowEventsInvoke-{rule_name}')
+    return {
+        'expression': rule.get('ScheduleExpression'),
+        'state': rule.get('State'),
+        'targets': [target['Arn'] for target in events_client.list_targets_by_rule(Rule=rule_name)['Targets']],
+        'source_arn': (statement or {}).get('Condition', {}).get('ArnLike', {}).get('AWS:SourceArn'),
+        'rule_arn': rule['Arn']
+    }
 
-# 添加 Layer，确保 Lambda 处于 "Active" 状态
-add_lambda_layer(LAMBDA_NAMES['plotting'], MATPLOTLIB_LAYER_ARN)
-add_lambda_layer(LAMBDA_NAMES['driver'], REQUESTS_LAYER_ARN)
-add_lambda_layer(LAMBDA_NAMES['plotting'], NUMPY_LAYER_ARN)
+def fetch_current_state():
+    """Everything the plan compares, keyed like the steps, fetched concurrently."""
+    fetchers = {
+        'bucket': lambda: fetch_bucket(s3_bucket_name),
+        'bucket:plots': lambda: fetch_bucket(plot_bucket_name),
+        'lifecycle:plots': lambda: fetch_lifecycle_rules(plot_bucket_name),
+        'invoke_statements': lambda: fetch_invoke_statements(size_tracking_name)
+    }
+    for table_name in TABLE_SCHEMAS:
+        fetchers[f'table:{table_name}'] = lambda table_name=table_name: fetch_table(table_name)
+    for role in policies:
+        fetchers[f'policy:{role}'] = lambda role=role: fetch_role_policy(role)
+    for bucket_name in TRACKED_BUCKETS:
+        fetchers[f'notification:{bucket_name}'] = lambda bucket_name=bucket_name: fetch_notification(bucket_name)
+    for name in LAMBDA_SETTINGS:
+        fetchers[f'lambda:{name}'] = lambda name=name: fetch_function(name)
+    for name in SCHEDULED_FUNCTIONS:
+        fetchers[f'role:{name}'] = lambda name=name: fetch_role(name)
+        fetchers[f'function:{name}'] = lambda name=name: fetch_function(name)
+        fetchers[f'schedule:{name}'] = lambda name=name: fetch_schedule(name)
+    return gather(fetchers)
+
+def plan_changes(current):
+    """{step name: [description of each difference]}; an empty list means the step is a no-op."""
+    changes = {
+        'bucket': [] if current['bucket'] else [f"create bucket '{s3_bucket_name}'"],
+        'bucket:plots': [] if current['bucket:plots'] else [f"create bucket '{plot_bucket_name}'"]
+    }
+    expiring = any(
+        rule.get('Status') == 'Enabled' and rule.get('Filter', {}).get('Prefix') == PLOT_PREFIX
+        and rule.get('Expiration', {}).get('Days') == PLOT_EXPIRATION_DAYS
+        for rule in current['lifecycle:plots']
+    )
+    changes['lifecycle:plots'] = [] if expiring else [f"expire '{PLOT_PREFIX}' in '{plot_bucket_name}' after {PLOT_EXPIRATION_DAYS} days"]
+
+    step_names = {dynamodb_table_name: 'table:history', ledger_table_name: 'table:ledger', summary_table_name: 'table:summary'}
+    for table_name, schema in TABLE_SCHEMAS.items():
+        existing = current[f'table:{table_name}']
+        if existing is None:
+            changes[step_names[table_name]] = [f"create table '{table_name}'"]
+            continue
+        changes[step_names[table_name]] = [f"enable TTL on '{schema['ttl']}'"] if existing['ttl'] != schema['ttl'] and schema['ttl'] else []
+        structure = lambda description: {name: description[name] for name in ('keys', 'indexes')}
+        if structure(existing) != structure(schema):
+            # Keys and GSIs of an existing table are not changed by provisioning; report the drift
+            print(f"⚠️ Table '{table_name}' has {structure(existing)}, expected {structure(schema)}")
+
+    for role, policy in policies.items():
+        existing = current[f'policy:{role}']
+        changes[f'policy:{role}'] = [] if existing == policy else [
+            f"{'create' if existing is None else 'update'} {role.capitalize()}AccessPolicy"
+        ]
 
-#Step 6: add API Gateway to the plotting Lambda
\ No newline at end of file
+    for bucket_name in TRACKED_BUCKETS:
+        statement = current['invoke_statements'].get(f'AllowS3Invoke-{bucket_name}')
+        source_arn = (statement or {}).get('Condition', {}).get('ArnLike', {}).get('AWS:SourceArn')
+        changes[f'permission:{bucket_name}'] = [] if source_arn == f'arn:aws:s3:::{bucket_name}' else [
+            f"allow s3 bucket '{bucket_name}' to invoke '{size_tracking_name}'"
+        ]
+        configurations = current[f'notification:{bucket_name}'] or []
+        configured = any(
+            configuration['LambdaFunctionArn'] == size_tracking_arn and sorted(configuration['Events']) == sorted(SIZE_TRACKING_EVENTS)
+            for configuration in configurations
+        )
+        changes[f'notification:{bucket_name}'] = [] if configured else [f"send '{bucket_name}' events to '{size_tracking_arn}'"]
+
+    for name, settings in LAMBDA_SETTINGS.items():
+        existing = current[f'lambda:{name}']
+        if existing is None:
+            changes[f'lambda:{name}'] = [f"function '{name}' does not exist"]
+            continue
+        differences = [
+            f"{setting}: {existing[setting]} -> {settings[setting]}"
+            for setting in ('timeout', 'memory_size') if existing[setting] != settings[setting]
+        ]
+        differences += [f"add layer {layer}" for layer in settings['layers'] if layer not in existing['layers']]
+        changes[f'lambda:{name}'] = differences
+
+    for name, settings in SCHEDULED_FUNCTIONS.items():
+        changes[f'role:{name}'] = [] if current[f'role:{name}'] else [f"create role '{ROLE_ARNS[name].split('/')[-1]}'"]
+        existing = current[f'function:{name}']
+        if existing is None:
+            changes[f'function:{name}'] = [f"create function '{name}' with handler '{settings['handler']}'"]
+        else:
+            changes[f'function:{name}'] = [
+                f"{setting}: {existing[setting]} -> {settings[setting]}"
+                for setting in ('timeout', 'memory_size', 'environment') if existing[setting] != settings[setting]
+            ]
+        rule_name = schedule_rule_name(name)
+        schedule = current[f'schedule:{name}']
+        if schedule is None:
+            changes[f'schedule:{name}'] = [f"create rule '{rule_name}' invoking '{name}' on {settings['schedule']}"]
+            continue
+        differences = [f"schedule: {schedule['expression']} -> {settings['schedule']}"] if schedule['expression'] != settings['schedule'] else []
+        differences += [] if schedule['state'] == 'ENABLED' else [f"enable rule '{rule_name}'"]
+        differences += [] if LAMBDA_NAMES[name] in schedule['targets'] else [f"target '{name}' from rule '{rule_name}'"]
+        differences += [] if schedule['source_arn'] == schedule['rule_arn'] else [f"allow rule '{rule_name}' to invoke '{name}'"]
+        changes[f'schedule:{name}'] = differences
+    return changes
+
+def print_plan(changes):
+    pending = {name: differences for name, differences in changes.items() if differences}
+    for name, differences in pending.items():
+        for difference in differences:
+            print(f"  ~ {name}: {difference}")
+    print(f"Plan: {len(pending)} of {len(changes)} steps to apply.")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Provision the bucket, tables, role policies, notifications, Lambda settings and scheduled functions.')
+    parser.add_argument('--plan', action='store_true', help='show what would change and exit')
+    parser.add_argument('--force', action='store_true', help='apply every step without comparing against current state')
+    args = parser.parse_args()
+
+    steps = build_steps()
+    if not args.force:
+        changes = plan_changes(fetch_current_state())
+        print_plan(changes)
+        if args.plan:
+            raise SystemExit(0)
+        steps = skip_unchanged(steps, changes)
+    run_steps(steps)
+
+#Step 7: add API Gateway to the plotting Lambda
@@ -0,0 +1,183 @@
+"""
+Per-invocation instrumentation for the Lambda handlers.
+
+A handler decorated with @instrumented('name') opens an invocation record. While it is
+open, every AWS call made through aws_clients is counted, DynamoDB calls are made with
+ReturnConsumedCapacity=TOTAL and their consumed capacity and scanned/returned item
+counts are summed, and code can time phases with `with metrics.phase('query'):`.
+When the handler returns, one JSON line is printed:
+
+    {"metrics": "size_track", "request_id": "...", "cold_start": false, "duration_ms": 41.2,
+     "phases_ms": {"aggregate": 30.1, "write": 6.0}, "aws_calls": {"dynamodb.UpdateItem": 3},
+     "aws_errors": {}, "consumed_capacity": {"S3-bucket-size-summary": 3.0},
+     "items": {"scanned": 0, "returned": 0}, "records": 1}
+
+Phase times are summed over threads, so concurrent phases can add up to more than the
+duration. Outside an invocation (scripts, benchmarks) everything here is a no-op.
+Verbose logging goes through debug(), which only prints with LOG_LEVEL=DEBUG.
+"""
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+DEBUG = LOG_LEVEL == 'DEBUG'
+
+_current = contextvars.ContextVar('metrics_invocation', default=None)
+# Handlers that already ran in this process; the first invocation of each is a cold start
+_warm_handlers = set()
+_warm_lock = threading.Lock()
+
+
+class Invocation:
+    """Counters of one handler invocation; updated from any thread running in its context."""
+
+    def __init__(self, handler, context):
+        self.handler = handler
+        self.request_id = getattr(context, 'aws_request_id', None)
+        with _warm_lock:
+            self.cold_start = handler not in _warm_handlers
+            _warm_handlers.add(handler)
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.calls = {}
+        self.errors = {}
+        self.capacity = {}
+        self.items = {'scanned': 0, 'returned': 0}
+        self.fields = {}
+
+    def add_phase(self, name, elapsed_ms):
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed_ms
+
+    def record_call(self, service, operation, parsed):
+        name = f'{service}.{operation}'
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            error = parsed.get('Error', {}).get('Code')
+            if error:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            capacity = parsed.get('ConsumedCapacity')
+            for entry in capacity if isinstance(capacity, list) else [capacity] if capacity else []:
+                table = entry.get('TableName', 'unknown')
+                self.capacity[table] = self.capacity.get(table, 0.0) + float(entry.get('CapacityUnits', 0))
+            if 'ScannedCount' in parsed:
+                self.items['scanned'] += parsed['ScannedCount']
+                self.items['returned'] += parsed.get('Count', 0)
+            elif operation == 'GetItem':
+                self.items['scanned'] += 1
+                self.items['returned'] += 1 if 'Item' in parsed else 0
+
+    def record(self):
+        with self.lock:
+            return {
+                'metrics': self.handler,
+                'request_id': self.request_id,
+                'cold_start': self.cold_start,
+                'duration_ms': round((time.perf_counter() - self.started) * 1000, 2),
+                'phases_ms': {name: round(value, 2) for name, value in self.phases.items()},
+                'aws_calls': dict(self.calls),
+                'aws_errors': dict(self.errors),
+                'consumed_capacity': {table: round(units, 2) for table, units in self.capacity.items()},
+                'items': dict(self.items),
+                **self.fields
+            }
+
+
+def instrumented(handler_name):
+    """Decorator for a Lambda handler: one invocation record per call, emitted even if it raises."""
+    def decorate(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            invocation = Invocation(handler_name, context)
+            token = _current.set(invocation)
+            try:
+                if DEBUG:
+                    print(f"Event: {json.dumps(event, default=str)}")
+                response = handler(event, context)
+                if isinstance(response, dict) and 'statusCode' in response:
+                    invocation.fields['status'] = response['statusCode']
+                return response
+            finally:
+                _current.reset(token)
+                # One write per record, so records of concurrent invocations never share a line
+                sys.stdout.write(json.dumps(invocation.record(), default=str) + '\n')
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def phase(name):
+    """Time a block under the given phase name."""
+    invocation = _current.get()
+    if invocation is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        invocation.add_phase(name, (time.perf_counter() - started) * 1000)
+
+
+def annotate(**fields):
+    """Add handler-specific fields (record counts, cache hits, ...) to the invocation record."""
+    invocation = _current.get()
+    if invocation is not None:
+        with invocation.lock:
+            invocation.fields.update(fields)
+
+
+def add(**counts):
+    """Add to counters in the invocation record, for counts that several calls contribute to."""
+    invocation = _current.get()
+    if invocation is not None:
+        with invocation.lock:
+            for name, value in counts.items():
+                invocation.fields[name] = invocation.fields.get(name, 0) + value
+
+
+def in_context(function):
+    """
+    Wrap function so it runs in the caller's invocation when called from a worker thread.
+    Each call gets its own copy of the context, so the wrapper can be mapped over a pool.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+    return wrapper
+
+
+def debug(message):
+    if DEBUG:
+        print(message)
+
+
+# botocore hooks, installed on every session by aws_clients
+
+def request_consumed_capacity(params, model, **kwargs):
+    if _current.get() is None or model.input_shape is None:
+        return
+    if 'ReturnConsumedCapacity' in model.input_shape.members and 'ReturnConsumedCapacity' not in params:
+        params['ReturnConsumedCapacity'] = 'TOTAL'
+
+
+def count_call(parsed, model, **kwargs):
+    invocation = _current.get()
+    if invocation is not None:
+        invocation.record_call(model.service_model.endpoint_prefix, model.name, parsed)
+
+
+def install(session):
+    events = session._session.get_component('event_emitter')
+    events.register('before-parameter-build.dynamodb', request_consumed_capacity, unique_id='metrics-capacity')
+    events.register('after-call', count_call, unique_id='metrics-calls')
+    return session
@@ -1,94 +1,552 @@
 #plotting
 
 import json
-import boto3
+import hashlib
 import os
 import io
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
+import shutil
+import threading
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from botocore.exceptions import ClientError
-from decimal import Decimal
-from boto3.dynamodb.conditions import Key, Attr
+from boto3.dynamodb.conditions import Key
+import aws_clients
+import metrics
+from downsample import METHODS, downsample, target_points
+from fast_plot import render_png, render_svg
+from rollups import (DEFAULT_RETENTION, RESOLUTIONS, RAW_RESOLUTION, choose_resolution, level_partitions, merge_shard_slots,
+                     parse_retention, query_rollups)
+from sharding import history_partitions, parse_shard_counts
 
-# Initialize DynamoDB and S3 clients
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-s3_client = boto3.client('s3', region_name='us-east-2')
+# Initialize the S3 client; handlers read tables through aws_clients.table, cached per thread
+s3_client = aws_clients.client('s3')
 
 # Environment variables for Lambda
 DYNAMODB_TABLE_NAME = 'S3-object-size-history'
+# Running totals and all-time extremes maintained by size_track
+SUMMARY_TABLE_NAME = 'S3-bucket-size-summary'
+# Bucket plotted when ?buckets= is not given
 BUCKET_NAME = 'testbucket-cs6620-lef'
+# Plots are stored apart from the tracked buckets: an upload there would fire an S3 event,
+# write a new sample and so invalidate the plot it just stored
+PLOT_BUCKET_NAME = os.environ.get('PLOT_BUCKET_NAME', 'testbucket-cs6620-lef-plots')
+# GSI on (bucket_name, size) used to read the historical maximum
+SIZE_INDEX_NAME = 'BucketSizeIndex'
+# Must match size_track's HISTORY_SHARDS: raw rows and rollup slots of these buckets are read from every shard
+HISTORY_SHARDS = parse_shard_counts(os.environ.get('HISTORY_SHARDS', ''))
+# Must match size_track's HISTORY_RETENTION: rows older than their level's retention are not read
+HISTORY_RETENTION = parse_retention(os.environ.get('HISTORY_RETENTION', DEFAULT_RETENTION))
+# Asynchronous invocations carrying {'wait_for': {'bucket', 'after'}} wait at most this long for that sample;
+# well under the function's 30s timeout, so the plot is still rendered when the sample never comes
+PLOT_READY_TIMEOUT_SECONDS = float(os.environ.get('PLOT_READY_TIMEOUT_SECONDS', '15'))
+# Time kept back from the wait for querying, rendering and storing the plot
+PLOT_RENDER_RESERVE_SECONDS = float(os.environ.get('PLOT_RENDER_RESERVE_SECONDS', '10'))
+# Default plotting window, overridable with ?window=<seconds>
+DEFAULT_WINDOW_SECONDS = 10
+# ?resolution=auto picks the coarsest rollup that still gives this many points
+MIN_PLOT_POINTS = 60
+# Samples hold their value until the next one ('step') or are joined by straight lines ('linear')
+INTERPOLATIONS = ('step', 'linear')
+# Rollup attribute drawn as the series value
+ROLLUP_SIZE_ATTRIBUTE = 'size_last'
+# Rendered figure geometry; also bounds the number of points handed to the renderer.
+# Small multiples (?layout=grid) get PANEL_HEIGHT_INCHES per bucket instead of FIGSIZE's height.
+FIGSIZE = (10, 6)
+DPI = 100
+PANEL_HEIGHT_INCHES = 3
+# Upper bound on ?buckets= and on the number of buckets fetched concurrently
+MAX_BUCKETS_PER_REQUEST = 20
+MAX_FETCH_WORKERS = 8
+# Plots are content-addressed: 'plots/<render cache key>.<format>'
+# The time axis ends at the newest measurement of the plotted buckets, not at 'now', so an
+# image only changes (and gets a new key) when one of the buckets does
+PLOT_KEY_PREFIX = 'plots/'
+RENDER_KEY_METADATA = 'render-key'
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+LAYOUTS = ('overlay', 'grid')
+# 'matplotlib' or 'fast' (NumPy/zlib, no matplotlib layer needed); overridable with ?renderer=
+DEFAULT_RENDERER = os.environ.get('DEFAULT_RENDERER', 'matplotlib')
+RENDERERS = ('matplotlib', 'fast')
+# One color per bucket (matplotlib's default cycle); historical highs use the same color dashed
+SERIES_COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+                 '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')
+# Font cache built by build_font_cache.py and shipped with the deployment package.
+# It is copied to /tmp because matplotlib ignores a config dir it cannot write to.
+BUNDLED_MPLCONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mplconfig')
+RUNTIME_MPLCONFIG_DIR = '/tmp/mplconfig'
 
+# matplotlib is imported on the first render only; the figure is reused by warm invocations
+_figure = None
+# Fetch workers outlive the invocation, so their sessions and tables are reused by warm invocations
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+
+def fetch_executor():
+    global _fetch_executor
+    with _fetch_executor_lock:
+        if _fetch_executor is None:
+            _fetch_executor = ThreadPoolExecutor(max_workers=MAX_FETCH_WORKERS, thread_name_prefix='plot-fetch')
+        return _fetch_executor
+
+
+def query_window(table, bucket_name, start_timestamp, end_timestamp):
+    """
+    Read the samples of a bucket between two timestamps (ms) from the primary key.
+    Sharded buckets are read from every shard and merged back into timestamp order.
+    """
+    partitions = history_partitions(bucket_name, HISTORY_SHARDS)
+    items = []
+    for partition in partitions:
+        items.extend(aws_clients.query_items(
+            table,
+            KeyConditionExpression=Key('bucket_name').eq(partition) & Key('timestamp').between(start_timestamp, end_timestamp)
+        ))
+    if len(partitions) > 1:
+        items.sort(key=lambda item: item['timestamp'])
+    return items
+
+
+def read_summary(bucket_name):
+    return aws_clients.table(SUMMARY_TABLE_NAME).get_item(Key={'bucket_name': bucket_name}).get('Item', {})
+
+
+def query_historical_max(table, bucket_name, summary=None):
+    """
+    Read the largest recorded size with a single GetItem on the summary item.
+    Buckets tracked before the summary existed fall back to the size-sorted index.
+    """
+    if summary is None:
+        summary = read_summary(bucket_name)
+    if 'max_size' in summary:
+        return float(summary['max_size'])
+
+    sizes = []
+    for partition in history_partitions(bucket_name, HISTORY_SHARDS):
+        response = table.query(
+            IndexName=SIZE_INDEX_NAME,
+            KeyConditionExpression=Key('bucket_name').eq(partition),
+            ScanIndexForward=False,
+            Limit=1
+        )
+        sizes.extend(float(item['size']) for item in response.get('Items', []))
+    return max(sizes, default=0)
+
+
+def sample_before(table, bucket_name, resolution, before_timestamp=None):
+    """
+    The newest raw sample or rollup slot of the bucket, optionally only those before
+    before_timestamp, or None if there is none. One Limit=1 query per partition; the
+    shards' partial copies of the newest rollup slot are merged.
+    """
+    items = []
+    for partition in level_partitions(bucket_name, resolution, HISTORY_SHARDS):
+        condition = Key('bucket_name').eq(partition)
+        if before_timestamp is not None:
+            condition &= Key('timestamp').lt(before_timestamp)
+        response = table.query(KeyConditionExpression=condition, ScanIndexForward=False, Limit=1)
+        items.extend(response.get('Items', []))
+    if not items:
+        return None
+    if resolution == RAW_RESOLUTION:
+        return max(items, key=lambda item: item['timestamp'])
+    return merge_shard_slots(items)[-1]
+
+
+def latest_sample_timestamp(table, bucket_name, resolution):
+    """Timestamp of the newest sample behind the given resolution, or None if there is none."""
+    item = sample_before(table, bucket_name, resolution)
+    if item is None:
+        return None
+    # A rollup slot keeps its start timestamp while samples keep landing in it
+    return int(item['timestamp'] if resolution == RAW_RESOLUTION else item['last_at'])
+
+
+def query_series(table, bucket_name, resolution, start_timestamp, end_timestamp):
+    """
+    Return (timestamps, sizes) for the window, from raw samples or from one rollup resolution.
+    Rows past their retention may linger until DynamoDB's TTL deletes them; they are not read.
+    """
+    if resolution in HISTORY_RETENTION:
+        start_timestamp = max(start_timestamp, end_timestamp - HISTORY_RETENTION[resolution])
+    if resolution == RAW_RESOLUTION:
+        items = query_window(table, bucket_name, start_timestamp, end_timestamp)
+        return [int(item['timestamp']) for item in items], [float(item['size']) for item in items]
+
+    items = query_rollups(table, bucket_name, resolution, start_timestamp, end_timestamp, HISTORY_SHARDS)
+    return [int(item['timestamp']) for item in items], [float(item[ROLLUP_SIZE_ATTRIBUTE]) for item in items]
+
+
+def carry_in(table, bucket_name, resolution, start_timestamp, timestamps, sizes):
+    """
+    Prepend the value the bucket had at the start of the window: the last sample before it.
+    With SAMPLE_MODE=changes an unchanged bucket may have no sample inside the window at all.
+    """
+    if timestamps and timestamps[0] <= start_timestamp:
+        return timestamps, sizes
+    item = sample_before(table, bucket_name, resolution, start_timestamp)
+    if item is None:
+        return timestamps, sizes
+    size = item['size'] if resolution == RAW_RESOLUTION else item[ROLLUP_SIZE_ATTRIBUTE]
+    return [start_timestamp] + timestamps, [float(size)] + sizes
+
+
+def step_points(relative_times, sizes, end):
+    """Turn samples into a step line: each value holds until the next sample, the last one until end."""
+    relative_times = np.asarray(relative_times, dtype=float)
+    sizes = np.asarray(sizes, dtype=float)
+    if len(relative_times) == 0:
+        return relative_times, sizes
+    step_times = np.empty(2 * len(relative_times))
+    step_sizes = np.empty(2 * len(sizes))
+    step_times[0::2] = relative_times
+    step_times[1::2] = np.append(relative_times[1:], max(end, relative_times[-1]))
+    step_sizes[0::2] = sizes
+    step_sizes[1::2] = sizes
+    return step_times, step_sizes
+
+
+def ready_timeout(context):
+    """PLOT_READY_TIMEOUT_SECONDS, shortened so the render reserve is left before the invocation times out."""
+    if context is None:
+        return PLOT_READY_TIMEOUT_SECONDS
+    remaining_seconds = context.get_remaining_time_in_millis() / 1000 - PLOT_RENDER_RESERVE_SECONDS
+    return max(0.0, min(PLOT_READY_TIMEOUT_SECONDS, remaining_seconds))
+
+
+def wait_for_sample(bucket_name, after_timestamp, timeout_seconds):
+    """
+    Readiness signal for triggered plots: poll the newest raw sample of the bucket,
+    starting fast and backing off, until one written at or after after_timestamp exists.
+    With SAMPLE_MODE=changes the tracker may measure the bucket and write no sample;
+    that also counts once the newest sample holds the measured totals.
+    Returns False if the tracker has not caught up within timeout_seconds.
+    """
+    table = aws_clients.table(DYNAMODB_TABLE_NAME)
+    deadline = time.monotonic() + timeout_seconds
+    delay = 0.1
+    while True:
+        latest = sample_before(table, bucket_name, RAW_RESOLUTION)
+        if latest is not None and int(latest['timestamp']) >= after_timestamp:
+            return True
+        summary = read_summary(bucket_name)
+        if latest is not None and int(summary.get('measured_at', 0)) >= after_timestamp and \
+                (latest['size'], latest.get('object_count')) == (summary['total_size'], summary['object_count']):
+            return True
+        if time.monotonic() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(2.0, delay * 2)
+
+
+def fetch_bucket_state(bucket_name, resolution):
+    """
+    The cheap reads that decide whether a render is needed: when the bucket was last
+    measured (its newest sample, or a later measurement whose sample was suppressed
+    as unchanged) and its historical max.
+    """
+    table = aws_clients.table(DYNAMODB_TABLE_NAME)
+    summary = read_summary(bucket_name)
+    latest = latest_sample_timestamp(table, bucket_name, resolution)
+    if latest is not None and 'measured_at' in summary:
+        latest = max(latest, int(summary['measured_at']))
+    return {
+        'bucket_name': bucket_name,
+        'latest_timestamp': latest,
+        'max_size': query_historical_max(table, bucket_name, summary)
+    }
+
+
+def fetch_bucket_series(bucket_name, params, start_timestamp, end_timestamp):
+    """Query and downsample one bucket's series; times are relative to end_timestamp, in seconds."""
+    table = aws_clients.table(DYNAMODB_TABLE_NAME)
+    with metrics.phase('query'):
+        timestamps, sizes = query_series(table, bucket_name, params['resolution'], start_timestamp, end_timestamp)
+        points = len(timestamps)
+        if params['interpolation'] == 'step':
+            timestamps, sizes = carry_in(table, bucket_name, params['resolution'], start_timestamp, timestamps, sizes)
+    with metrics.phase('aggregate'):
+        relative_times = (np.asarray(timestamps, dtype=float) - end_timestamp) / 1000
+        if params['interpolation'] == 'step':
+            # Step lines double the points, so they are built from a series downsampled to half
+            relative_times, sizes = downsample(relative_times, sizes, target_points(FIGSIZE, DPI) // 2, params['downsample'])
+            relative_times, sizes = step_points(relative_times, sizes, 0.0)
+        else:
+            relative_times, sizes = downsample(relative_times, sizes, target_points(FIGSIZE, DPI), params['downsample'])
+    return points, relative_times, sizes
+
+
+def fetch_concurrently(function, arguments):
+    """Map function over argument tuples on a bounded thread pool, preserving order."""
+    if len(arguments) == 1:
+        return [function(*arguments[0])]
+    return list(fetch_executor().map(metrics.in_context(lambda args: function(*args)), arguments))
+
+
+def plot_end_timestamp(states):
+    """The end of the plotted window (ms): the newest measurement among the plotted buckets."""
+    return max(s['latest_timestamp'] for s in states)
+
+
+def render_cache_key(params, states):
+    """Hash of everything the rendered image depends on; the end of its time axis follows from the states."""
+    parts = [params, [[s['bucket_name'], s['latest_timestamp'], s['max_size']] for s in states], FIGSIZE, DPI]
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def plot_exists(s3_key):
+    """Content-addressed plots never change, so an existing object is a cache hit."""
+    try:
+        s3_client.head_object(Bucket=PLOT_BUCKET_NAME, Key=s3_key)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def prepare_matplotlib_config():
+    """Point matplotlib at the pre-built font cache so the first import does not rebuild it."""
+    if 'MPLCONFIGDIR' in os.environ:
+        return
+    if os.path.isdir(BUNDLED_MPLCONFIG_DIR) and not os.path.isdir(RUNTIME_MPLCONFIG_DIR):
+        shutil.copytree(BUNDLED_MPLCONFIG_DIR, RUNTIME_MPLCONFIG_DIR)
+    os.environ['MPLCONFIGDIR'] = RUNTIME_MPLCONFIG_DIR
+
+
+def get_figure():
+    """
+    Return a cleared Agg figure, importing matplotlib on first use.
+    The object-oriented Figure/FigureCanvasAgg API avoids pyplot's global state,
+    so no figures pile up across warm invocations.
+    """
+    global _figure
+    if _figure is None:
+        prepare_matplotlib_config()
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        _figure = Figure(figsize=FIGSIZE, dpi=DPI)
+        FigureCanvasAgg(_figure)
+    else:
+        _figure.clear()
+    return _figure
+
+
+def build_chart(relative_times, sizes, max_size, window_seconds):
+    """Describe the chart independently of the renderer (see fast_plot for the format)."""
+    return {
+        'title': f'S3 Bucket Size Change in Last {window_seconds} Seconds',
+        'xlabel': 'Relative Time (seconds before latest sample)',
+        'ylabel': 'Size (Bytes)',
+        'xlim': (-window_seconds, 0),
+        'series': [{'label': f'Bucket Size (Last {window_seconds} seconds)', 'x': relative_times, 'y': sizes,
+                    'color': '#0000ff'}],
+        'hlines': [{'label': 'Historical High', 'y': max_size, 'color': '#ff0000'}]
+    }
+
+
+def build_charts(buckets, window_seconds, layout):
+    """
+    Charts for the fetched buckets: a single bucket keeps the original chart, several
+    buckets are overlaid in one chart or drawn as one small multiple each.
+    buckets is a list of (bucket_name, relative_times, sizes, max_size).
+    """
+    if len(buckets) == 1:
+        _, relative_times, sizes, max_size = buckets[0]
+        chart = build_chart(relative_times, sizes, max_size, window_seconds)
+        if layout == 'grid':
+            chart['title'] = f'{buckets[0][0]}: last {window_seconds} seconds'
+        return [chart]
+
+    charts = []
+    for i, (bucket_name, relative_times, sizes, max_size) in enumerate(buckets):
+        color = SERIES_COLORS[i % len(SERIES_COLORS)]
+        charts.append({
+            'title': f'{bucket_name}: last {window_seconds} seconds',
+            'xlabel': 'Relative Time (seconds before latest sample)',
+            'ylabel': 'Size (Bytes)',
+            'xlim': (-window_seconds, 0),
+            'series': [{'label': bucket_name, 'x': relative_times, 'y': sizes, 'color': color}],
+            'hlines': [{'label': f'{bucket_name} high', 'y': max_size, 'color': color}]
+        })
+    if layout == 'grid':
+        return charts
+
+    overlay = dict(charts[0], title=f'S3 Bucket Size Change in Last {window_seconds} Seconds', series=[], hlines=[])
+    for chart in charts:
+        overlay['series'].extend(chart['series'])
+        overlay['hlines'].extend(chart['hlines'])
+    return [overlay]
+
+
+def render_matplotlib(charts, width, height, image_format='png'):
+    """Draw the charts with matplotlib, one axes per chart stacked vertically, returning the encoded image."""
+    figure = get_figure()
+    figure.set_size_inches(width / DPI, height / DPI)
+    axes = figure.subplots(len(charts), 1, squeeze=False)[:, 0]
+    for ax, chart in zip(axes, charts):
+        for series in chart['series']:
+            ax.plot(series['x'], series['y'], label=series['label'], color=series['color'])
+        for line in chart['hlines']:
+            ax.axhline(y=line['y'], color=line['color'], linestyle='--', label=line['label'])
+        ax.set_xlim(*chart['xlim'])
+        ax.set_xlabel(chart['xlabel'])
+        ax.set_ylabel(chart['ylabel'])
+        ax.set_title(chart['title'])
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.legend(loc='upper left', bbox_to_anchor=(1, 1))
+    figure.tight_layout()
+
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=image_format)
+    return buffer.getvalue()
+
+
+def render_chart(charts, renderer, image_format):
+    width = int(FIGSIZE[0] * DPI)
+    height = int(FIGSIZE[1] * DPI) if len(charts) == 1 else int(PANEL_HEIGHT_INCHES * DPI) * len(charts)
+    if renderer == 'fast':
+        return render_svg(charts, width, height) if image_format == 'svg' else render_png(charts, width, height)
+    return render_matplotlib(charts, width, height, image_format)
+
+
+def parse_plot_parameters(event):
+    """
+    Read ?buckets=<a,b,...>&window=<seconds>&resolution=<auto|raw|1s|1m|1h|1d>
+    &downsample=<lttb|minmax|none>&renderer=<matplotlib|fast>&format=<png|svg>
+    &layout=<overlay|grid>&interpolation=<step|linear> from the API Gateway event.
+    """
+    params = (event or {}).get('queryStringParameters') or {}
+    buckets = [name.strip() for name in params.get('buckets', BUCKET_NAME).split(',') if name.strip()]
+    if not buckets:
+        raise ValueError('buckets must name at least one bucket')
+    if len(buckets) > MAX_BUCKETS_PER_REQUEST:
+        raise ValueError(f'at most {MAX_BUCKETS_PER_REQUEST} buckets can be plotted at once')
+
+    window_seconds = int(params.get('window', DEFAULT_WINDOW_SECONDS))
+    if window_seconds <= 0:
+        raise ValueError('window must be a positive number of seconds')
+
+    resolution = params.get('resolution', 'auto')
+    if resolution == 'auto':
+        resolution = choose_resolution(window_seconds * 1000, MIN_PLOT_POINTS, retention=HISTORY_RETENTION)
+    elif resolution != RAW_RESOLUTION and resolution not in RESOLUTIONS:
+        raise ValueError(f"Unknown resolution '{resolution}'")
+
+    method = params.get('downsample', 'lttb')
+    if method not in METHODS:
+        raise ValueError(f"Unknown downsampling method '{method}'")
+
+    renderer = params.get('renderer', DEFAULT_RENDERER)
+    if renderer not in RENDERERS:
+        raise ValueError(f"Unknown renderer '{renderer}'")
+    image_format = params.get('format', 'png')
+    if image_format not in CONTENT_TYPES:
+        raise ValueError(f"Unknown format '{image_format}'")
+    layout = params.get('layout', 'overlay')
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}'")
+    interpolation = params.get('interpolation', 'step')
+    if interpolation not in INTERPOLATIONS:
+        raise ValueError(f"Unknown interpolation '{interpolation}'")
+
+    return {
+        'buckets': buckets,
+        'window_seconds': window_seconds,
+        'resolution': resolution,
+        'downsample': method,
+        'renderer': renderer,
+        'format': image_format,
+        'layout': layout,
+        'interpolation': interpolation
+    }
+
+
+@metrics.instrumented('plotting')
 def lambda_handler(event, context):
     try:
-        # 获取当前时间戳（毫秒级）
-        current_timestamp = int(datetime.now().timestamp() * 1000)
-        start_timestamp = current_timestamp - (10 * 1000)  # 10 秒前
+        try:
+            params = parse_plot_parameters(event)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps(f"Invalid parameters: {e}")
+            }
 
-        print(f"Current timestamp (ms): {current_timestamp}")
-        print(f"Start timestamp (ms): {start_timestamp}")
+        window_seconds = params['window_seconds']
+        resolution = params['resolution']
 
-        # 查询 DynamoDB 过去 10 秒的数据
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
-        response = table.scan(
-            FilterExpression=Attr('bucket_name').eq(BUCKET_NAME) & Attr('timestamp').between(start_timestamp, current_timestamp)
-        )
+        # 由 driver 异步触发时, 先等 size tracker 写入最后一次修改之后的数据
+        wait_for = (event or {}).get('wait_for')
+        timeout_seconds = ready_timeout(context)
+        with metrics.phase('wait'):
+            ready = not wait_for or wait_for_sample(wait_for['bucket'], int(wait_for['after']), timeout_seconds)
+        if not ready:
+            print(f"No sample at or after {wait_for['after']} for {wait_for['bucket']} "
+                  f"within {timeout_seconds:.1f}s; plotting what is recorded.")
 
-        items = response.get('Items', [])
-        print(f"Queried {len(items)} items from DynamoDB.")
+        # 获取当前时间戳（毫秒级）, 只用来判断窗口内是否有数据
+        now_timestamp = int(datetime.now().timestamp() * 1000)
+        metrics.debug(f"Current timestamp (ms): {now_timestamp}")
+        metrics.debug(f"Buckets: {params['buckets']}, window: {window_seconds}s, resolution: {resolution}")
+        metrics.annotate(buckets=len(params['buckets']), window_seconds=window_seconds, resolution=resolution)
 
-        if not items:
-            print("No data available in the last 10 seconds.")
+        # 没有新数据的桶不再查询窗口; 全部没有数据时直接返回
+        with metrics.phase('state'):
+            states = fetch_concurrently(fetch_bucket_state, [(name, resolution) for name in params['buckets']])
+        states = [s for s in states if s['latest_timestamp'] is not None and s['latest_timestamp'] >= now_timestamp - window_seconds * 1000]
+        if not states:
+            print(f"No data available in the last {window_seconds} seconds.")
             return {
                 'statusCode': 404,
-                'body': json.dumps('No data available in the last 10 seconds.')
+                'body': json.dumps(f'No data available in the last {window_seconds} seconds.')
             }
 
-        # 提取时间戳和 S3 Bucket 大小
-        timestamps = [int(item['timestamp']) for item in items]
-        sizes = [float(item['size']) for item in items]
+        # 图表以最新的测量时间结束, 与请求时间无关, 同样的数据总是得到同样的图
+        current_timestamp = plot_end_timestamp(states)
+        start_timestamp = current_timestamp - (window_seconds * 1000)
+        metrics.debug(f"Plot window (ms): {start_timestamp} - {current_timestamp}")
 
-        # 计算相对时间（转换为秒）
-        relative_times = [-(current_timestamp - ts) / 1000 for ts in timestamps]
-
-        # **打印数据，检查是否为空**
-        print("Timestamps:", timestamps)
-        print("Relative times:", relative_times)
-        print("Sizes:", sizes)
+        render_key = render_cache_key(params, states)
+        s3_key = f"{PLOT_KEY_PREFIX}{render_key}.{params['format']}"
+        with metrics.phase('cache'):
+            cached = plot_exists(s3_key)
+        metrics.annotate(cache_hit=cached)
+        if cached:
+            metrics.debug(f"Plot in s3://{PLOT_BUCKET_NAME}/{s3_key} is up to date.")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'Plot is up to date', 'bucket': PLOT_BUCKET_NAME, 'key': s3_key})
+            }
 
-        # 查询历史最大值
-        response_max = table.scan(
-            FilterExpression=Key('bucket_name').eq(BUCKET_NAME)
+        # 并发查询每个桶窗口内的数据
+        series = fetch_concurrently(
+            fetch_bucket_series,
+            [(s['bucket_name'], params, start_timestamp, current_timestamp) for s in states]
         )
-        max_size = max(float(item['size']) for item in response_max.get('Items', [])) if response_max.get('Items') else 0
-
-        print(f"Historical max size: {max_size}")
+        metrics.annotate(points=sum(count for count, _, _ in series))
 
         # 创建图表
-        plt.figure(figsize=(10, 6))
-        plt.plot(relative_times, sizes, label='Bucket Size (Last 10 seconds)', color='b')
-        plt.axhline(y=max_size, color='r', linestyle='--', label='Historical High')
-        plt.xlim(-10, 0)
-        plt.xlabel('Relative Time (seconds)')
-        plt.ylabel('Size (Bytes)')
-        plt.title('S3 Bucket Size Change in Last 10 Seconds')
-        plt.xticks(rotation=45)
-        plt.legend(loc='upper left', bbox_to_anchor=(1, 1))
-        plt.tight_layout()
-
-        # 保存图表到 buffer
-        buffer = io.BytesIO()
-        plt.savefig(buffer, format='png')
-        buffer.seek(0)
+        buckets = [
+            (state['bucket_name'], relative_times, sizes, state['max_size'])
+            for state, (_, relative_times, sizes) in zip(states, series)
+        ]
+        with metrics.phase('render'):
+            charts = build_charts(buckets, window_seconds, params['layout'])
+            image = render_chart(charts, params['renderer'], params['format'])
 
         # 上传图表到 S3
-        s3_key = 'plot.png'
-        s3_client.put_object(Bucket=BUCKET_NAME, Key=s3_key, Body=buffer, ContentType='image/png')
+        with metrics.phase('upload'):
+            s3_client.put_object(Bucket=PLOT_BUCKET_NAME, Key=s3_key, Body=image, ContentType=CONTENT_TYPES[params['format']],
+                                 Metadata={RENDER_KEY_METADATA: render_key})
 
-        print(f"Plot successfully generated and stored in s3://{BUCKET_NAME}/{s3_key}")
+        metrics.debug(f"Plot successfully generated and stored in s3://{PLOT_BUCKET_NAME}/{s3_key}")
 
         return {
             'statusCode': 200,
-            'body': json.dumps(f'Plot successfully generated and stored in s3://{BUCKET_NAME}/{s3_key}')
+            'body': json.dumps({'message': 'Plot successfully generated', 'bucket': PLOT_BUCKET_NAME, 'key': s3_key})
         }
 
     except ClientError as e:
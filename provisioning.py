@@ -0,0 +1,142 @@
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from botocore.exceptions import ClientError
+
+# Error codes that mean "busy or throttled, try again" rather than a real failure
+RETRYABLE_ERROR_CODES = (
+    'ResourceConflictException',
+    'TooManyRequestsException',
+    'ThrottlingException',
+    'Throttling',
+    'ConcurrentModificationException',
+    'OperationAborted',
+    'LimitExceededException'
+)
+# Steps run concurrently by run_steps, and reads made concurrently by gather
+STEP_MAX_WORKERS = 8
+GATHER_MAX_WORKERS = 16
+
+
+def with_retries(function, *args, max_attempts=8, base_delay=0.5, max_delay=10.0,
+                 retryable=RETRYABLE_ERROR_CODES, **kwargs):
+    """
+    Call function(*args, **kwargs), retrying retryable ClientErrors with full-jitter
+    exponential backoff. The last error is raised after max_attempts calls.
+    """
+    for attempt in range(max_attempts):
+        try:
+            return function(*args, **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] not in retryable or attempt == max_attempts - 1:
+                raise
+            time.sleep(random.uniform(0, min(max_delay, base_delay * 2 ** attempt)))
+
+
+def poll(check, description, timeout=300, base_delay=0.5, max_delay=5.0):
+    """
+    Call check() until it returns a truthy value, which is returned.
+    The delay starts short and doubles, so fast transitions are noticed quickly
+    without hammering the API during slow ones.
+    """
+    deadline = time.monotonic() + timeout
+    delay = base_delay
+    while True:
+        result = check()
+        if result:
+            return result
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError(f'Timed out after {timeout}s waiting for {description}')
+        time.sleep(delay)
+        delay = min(max_delay, delay * 2)
+
+
+def check_steps(steps):
+    """Reject unknown dependencies and dependency cycles before anything runs."""
+    for name, (_, dependencies) in steps.items():
+        unknown = [dependency for dependency in dependencies if dependency not in steps]
+        if unknown:
+            raise ValueError(f"Step '{name}' depends on unknown steps {unknown}")
+
+    visiting, visited = set(), set()
+
+    def visit(name, path):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle: {' -> '.join(path + [name])}")
+        visiting.add(name)
+        for dependency in steps[name][1]:
+            visit(dependency, path + [name])
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in steps:
+        visit(name, [])
+
+
+def run_steps(steps, max_workers=STEP_MAX_WORKERS):
+    """
+    Run steps ({name: (action, [dependency names])}) as a DAG on a thread pool.
+    A step starts as soon as all of its dependencies have succeeded, so the whole
+    run takes about as long as its critical path. When a step raises, every step
+    that depends on it is skipped and the rest keep going.
+    Returns {name: 'done' | 'failed' | 'skipped'}.
+    """
+    check_steps(steps)
+    status = {}
+    started = time.perf_counter()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while len(status) < len(steps):
+            for name, (action, dependencies) in steps.items():
+                if name in status or name in running.values():
+                    continue
+                if any(status.get(dependency) in ('failed', 'skipped') for dependency in dependencies):
+                    status[name] = 'skipped'
+                    print(f"⚠️ Skipping '{name}': a dependency did not complete")
+                elif all(status.get(dependency) == 'done' for dependency in dependencies):
+                    running[executor.submit(timed, action)] = name
+
+            if not running:
+                continue
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    elapsed = future.result()
+                    status[name] = 'done'
+                    print(f"✅ Step '{name}' finished in {elapsed:.1f}s")
+                except Exception as e:
+                    status[name] = 'failed'
+                    print(f"❌ Step '{name}' failed: {e}")
+
+    failed = [name for name, state in status.items() if state != 'done']
+    print(f"Provisioning finished in {time.perf_counter() - started:.1f}s"
+          + (f"; not completed: {failed}" if failed else ''))
+    return status
+
+
+def gather(fetchers, max_workers=GATHER_MAX_WORKERS):
+    """Call every function of {name: function} concurrently and return {name: result}."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(fetch) for name, fetch in fetchers.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+
+def skip_unchanged(steps, changes):
+    """
+    Replace the action of every step without planned changes by a no-op.
+    The steps stay in the graph, so their dependents still run in order.
+    """
+    return {
+        name: ((action if changes.get(name, True) else (lambda: None)), dependencies)
+        for name, (action, dependencies) in steps.items()
+    }
+
+
+def timed(action):
+    started = time.perf_counter()
+    action()
+    return time.perf_counter() - started
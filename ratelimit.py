@@ -0,0 +1,33 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Token bucket shared by any number of threads.
+    acquire() blocks until a token is available; tokens refill at `rate` per second
+    up to `burst`, so short stalls can be caught up without exceeding the rate for long.
+    A rate of 0 or less disables limiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        # Start nearly empty so a run does not open with a full burst above the rate
+        self.tokens = min(1.0, self.burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,306 @@
+"""
+Background reconciliation of the tracked totals with what is actually in the bucket.
+
+Incremental tracking drifts when S3 events are lost. The tracker already drops
+duplicate and out-of-order events by their sequencer, but lost events still leave it off.
+This job walks the bucket and the per-key ledger side by side, in key order, one key
+range per top-level prefix. S3 LIST calls and ledger Query pages are rate limited, so
+a run can be left going against a busy bucket. Both sides are streamed, so memory
+does not grow with the size of the bucket.
+
+Every key whose ledger entry disagrees with the listing is corrected. The correction is
+conditional on the entry being unchanged since it was read, so events that arrive during
+the run always win. The corrections are added to the running totals. If no event changed
+the totals during the run, they are set to the listed totals instead, which also fixes
+drift between the totals and the ledger. A correction history sample is written only
+when the totals actually change.
+
+main.py deploys lambda_handler as the 'reconcile' function, with its own role, and
+schedules it with an EventBridge rule (rate(1 hour)). The event may name the buckets to check:
+{"buckets": ["bucket-a", "bucket-b"]}. It can also be run by hand:
+
+    python reconcile.py --bucket my-bucket
+"""
+import argparse
+import bisect
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Key, Attr
+import aws_clients
+import metrics
+import size_track
+from ratelimit import RateLimiter
+from rollups import TTL_ATTRIBUTE
+
+# Buckets checked when the event does not name any
+RECONCILE_BUCKETS = [b for b in os.environ.get('RECONCILE_BUCKETS', size_track.BUCKET_NAME).split(',') if b]
+# S3 LIST pages (up to 1000 keys each) per second, shared by all workers
+RECONCILE_LIST_RATE = float(os.environ.get('RECONCILE_LIST_RATE', '10'))
+# Ledger Query pages per second, shared by all workers
+RECONCILE_READ_RATE = float(os.environ.get('RECONCILE_READ_RATE', '10'))
+# Key ranges walked concurrently
+RECONCILE_MAX_WORKERS = int(os.environ.get('RECONCILE_MAX_WORKERS', '4'))
+
+s3_client = aws_clients.client('s3', max_pool_connections=RECONCILE_MAX_WORKERS)
+
+
+def key_ranges(root_objects, prefixes):
+    """
+    Split the key space at the top-level prefixes: [('', p1), (p1, p2), ..., (pn, None)].
+    Every key in a range is either under the prefix it starts with or stored at the root.
+    Returns (low, high, prefix, root objects in the range) per range.
+    """
+    prefixes = sorted(prefixes)
+    bounds = [''] + prefixes + [None]
+    roots = [[] for _ in bounds[:-1]]
+    for obj in root_objects:
+        roots[bisect.bisect_right(prefixes, obj['Key'])].append(obj)
+    return [(bounds[i], bounds[i + 1], bounds[i] or None, sorted(roots[i], key=lambda obj: obj['Key']))
+            for i in range(len(bounds) - 1)]
+
+
+def list_range(bucket_name, prefix, root_objects, limiter):
+    """(key, size) of the objects in one range, in key order, one rate-limited LIST page at a time."""
+    def listing():
+        if prefix is None:
+            return
+        kwargs = {'Bucket': bucket_name, 'Prefix': prefix}
+        while True:
+            limiter.acquire()
+            page = s3_client.list_objects_v2(**kwargs)
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['Size']
+            if not page.get('IsTruncated'):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+    return heapq.merge(listing(), ((obj['Key'], obj['Size']) for obj in root_objects))
+
+
+def read_ledger_range(ledger_table, bucket_name, low, high, limiter):
+    """Ledger entries with low <= object_key < high, in key order."""
+    condition = Key('bucket_name').eq(bucket_name)
+    if low and high:
+        condition &= Key('object_key').between(low, high)
+    elif high:
+        condition &= Key('object_key').lt(high)
+    elif low:
+        condition &= Key('object_key').gte(low)
+    items = aws_clients.query_items(
+        ledger_table,
+        before_page=limiter.acquire,
+        KeyConditionExpression=condition,
+        ProjectionExpression='object_key, #size, updated_at, deleted, sequencer',
+        ExpressionAttributeNames={'#size': 'size'}
+    )
+    for item in items:
+        # between is inclusive; the upper bound belongs to the next range
+        if item['object_key'] != high:
+            yield item
+
+
+def merge_by_key(listed, entries):
+    """Walk both sorted streams together, yielding (key, listed size or None, ledger entry or None)."""
+    listed_next = next(listed, None)
+    entry = next(entries, None)
+    while listed_next is not None or entry is not None:
+        if entry is None or (listed_next is not None and listed_next[0] < entry['object_key']):
+            yield listed_next[0], listed_next[1], None
+            listed_next = next(listed, None)
+        elif listed_next is None or entry['object_key'] < listed_next[0]:
+            yield entry['object_key'], None, entry
+            entry = next(entries, None)
+        else:
+            yield listed_next[0], listed_next[1], entry
+            listed_next, entry = next(listed, None), next(entries, None)
+
+
+def repair_entry(ledger_table, bucket_name, key, size, entry, timestamp):
+    """
+    Make the ledger entry of key match the listing (size None: the object is gone).
+    Returns False if an event changed the entry after it was read; the event wins.
+    """
+    ledger_key = {'bucket_name': bucket_name, 'object_key': key}
+    unchanged = Attr('updated_at').eq(entry['updated_at']) if entry else Attr('object_key').not_exists()
+    try:
+        if size is not None:
+            ledger_table.update_item(
+                Key=ledger_key,
+                UpdateExpression=f'SET #size = :size, updated_at = :ts REMOVE deleted, {TTL_ATTRIBUTE}',
+                ConditionExpression=unchanged,
+                ExpressionAttributeNames={'#size': 'size'},
+                ExpressionAttributeValues={':size': size, ':ts': timestamp}
+            )
+        elif entry.get('sequencer'):
+            # Keep the sequencer, so a late create of the deleted object is still ignored
+            ledger_table.update_item(
+                Key=ledger_key,
+                UpdateExpression=f'SET #size = :zero, deleted = :deleted, updated_at = :ts, {TTL_ATTRIBUTE} = :expires',
+                ConditionExpression=unchanged,
+                ExpressionAttributeNames={'#size': 'size'},
+                ExpressionAttributeValues={':zero': 0, ':deleted': True, ':ts': timestamp,
+                                           ':expires': size_track.tombstone_expiry(timestamp)}
+            )
+        else:
+            ledger_table.delete_item(Key=ledger_key, ConditionExpression=unchanged)
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+
+def reconcile_range(bucket_name, key_range, started, list_limiter, read_limiter):
+    """
+    Compare one key range of the bucket with its ledger entries and correct the entries
+    that differ. Runs on a worker thread with its own DynamoDB resource.
+    """
+    low, high, prefix, root_objects = key_range
+    ledger_table = aws_clients.table(size_track.LEDGER_TABLE_NAME)
+    result = {'low': low, 'listed': [0, 0], 'ledger': [0, 0], 'delta': [0, 0], 'corrections': 0, 'skipped': 0}
+
+    listed = list_range(bucket_name, prefix, root_objects, list_limiter)
+    entries = read_ledger_range(ledger_table, bucket_name, low, high, read_limiter)
+    for key, size, entry in merge_by_key(listed, entries):
+        tracked = int(entry['size']) if entry and not entry.get('deleted') else None
+        if size is not None:
+            result['listed'][0] += size
+            result['listed'][1] += 1
+        if tracked is not None:
+            result['ledger'][0] += tracked
+            result['ledger'][1] += 1
+        if size == tracked:
+            continue
+        # Entries written since the run started reflect events newer than the listing
+        if entry and int(entry['updated_at']) >= started:
+            result['skipped'] += 1
+            continue
+        if not repair_entry(ledger_table, bucket_name, key, size, entry, started):
+            result['skipped'] += 1
+            continue
+        result['delta'][0] += (size or 0) - (tracked or 0)
+        result['delta'][1] += (size is not None) - (tracked is not None)
+        result['corrections'] += 1
+    return result
+
+
+def correct_totals(bucket_name, before, listed, delta, exact, timestamp):
+    """
+    Write the reconciled totals and return the summary item.
+    With exact, the listed totals replace the tracked ones, provided no other
+    invocation updated the summary since `before` was read; otherwise the
+    ledger corrections are added to whatever the totals are now.
+    """
+    summary_table = aws_clients.table(size_track.SUMMARY_TABLE_NAME)
+    if exact:
+        revision = before.get('revision') if before else None
+        try:
+            return summary_table.update_item(
+                Key={'bucket_name': bucket_name},
+                UpdateExpression='SET total_size = :size, object_count = :count, last_reconciled_at = :ts ADD revision :one',
+                ConditionExpression=Attr('revision').eq(revision) if revision is not None else Attr('revision').not_exists(),
+                ExpressionAttributeValues={':size': listed[0], ':count': listed[1], ':ts': timestamp, ':one': 1},
+                ReturnValues='ALL_NEW'
+            )['Attributes']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+    return summary_table.update_item(
+        Key={'bucket_name': bucket_name},
+        UpdateExpression='SET last_reconciled_at = :ts ADD total_size :size, object_count :count, revision :one',
+        ExpressionAttributeValues={':size': delta[0], ':count': delta[1], ':ts': timestamp, ':one': 1},
+        ReturnValues='ALL_NEW'
+    )['Attributes']
+
+
+def reconcile(bucket_name, max_workers=RECONCILE_MAX_WORKERS, list_rate=RECONCILE_LIST_RATE, read_rate=RECONCILE_READ_RATE):
+    """Reconcile one bucket and return a report of what was found and corrected."""
+    started = size_track.current_timestamp()
+    summary_table = aws_clients.table(size_track.SUMMARY_TABLE_NAME)
+    before = summary_table.get_item(Key={'bucket_name': bucket_name}, ConsistentRead=True).get('Item')
+    list_limiter, read_limiter = RateLimiter(list_rate), RateLimiter(read_rate)
+
+    with metrics.phase('scan'):
+        root_objects, prefixes = size_track.discover_prefixes(bucket_name)
+        ranges = key_ranges(root_objects, prefixes)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            check = metrics.in_context(lambda key_range: reconcile_range(bucket_name, key_range, started,
+                                                                         list_limiter, read_limiter))
+            results = list(executor.map(check, ranges))
+
+    listed = [sum(r['listed'][i] for r in results) for i in (0, 1)]
+    delta = [sum(r['delta'][i] for r in results) for i in (0, 1)]
+    corrections = sum(r['corrections'] for r in results)
+    skipped = sum(r['skipped'] for r in results)
+    tracked = [int(before['total_size']), int(before['object_count'])] if before else [0, 0]
+    for r in results:
+        if r['listed'] != r['ledger']:
+            print(f"⚠️ {bucket_name} range from '{r['low']}': listed {r['listed'][0]} bytes in {r['listed'][1]} objects, "
+                  f"ledger {r['ledger'][0]} bytes in {r['ledger'][1]} objects, {r['corrections']} entries corrected")
+
+    timestamp = size_track.current_timestamp()
+    with metrics.phase('correct'):
+        if listed == tracked and corrections == 0:
+            summary_table.update_item(
+                Key={'bucket_name': bucket_name},
+                UpdateExpression='SET last_reconciled_at = :ts',
+                ExpressionAttributeValues={':ts': timestamp}
+            )
+            summary = None
+        else:
+            summary = correct_totals(bucket_name, before, listed, delta, skipped == 0, timestamp)
+            # Correction sample, so the history shows the reconciled totals from now on
+            size_track.record_sample(bucket_name, summary, timestamp)
+            size_track.flush_samples()
+            size_track.update_extremes(bucket_name, summary, timestamp)
+            size_track.record_rollups(bucket_name, summary, timestamp)
+
+    report = {
+        'bucket': bucket_name,
+        'listed': {'size': listed[0], 'objects': listed[1]},
+        'tracked': {'size': tracked[0], 'objects': tracked[1]},
+        'corrections': corrections,
+        'skipped': skipped,
+        'corrected_to': {'size': int(summary['total_size']), 'objects': int(summary['object_count'])} if summary else None
+    }
+    metrics.add(corrections=corrections, skipped=skipped)
+    if summary:
+        print(f"⚠️ Corrected {bucket_name}: tracked {tracked[0]} bytes in {tracked[1]} objects, "
+              f"listed {listed[0]} bytes in {listed[1]} objects, {corrections} ledger entries fixed")
+    else:
+        print(f"✅ {bucket_name} is consistent: {listed[0]} bytes in {listed[1]} objects")
+    return report
+
+
+@metrics.instrumented('reconcile')
+def lambda_handler(event, context):
+    buckets = (event or {}).get('buckets') or RECONCILE_BUCKETS
+    metrics.annotate(buckets=len(buckets))
+    try:
+        reports = [reconcile(bucket_name) for bucket_name in buckets]
+        return {
+            'statusCode': 200,
+            'body': json.dumps(reports)
+        }
+
+    except ClientError as e:
+        print(f"Error occurred: {e}")
+        return {
+            'statusCode': 500,
+            'body': json.dumps(f"Error: {e}")
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bucket', action='append', help='bucket to reconcile (repeatable)')
+    parser.add_argument('--workers', type=int, default=RECONCILE_MAX_WORKERS)
+    parser.add_argument('--list-rate', type=float, default=RECONCILE_LIST_RATE, help='S3 LIST pages per second')
+    parser.add_argument('--read-rate', type=float, default=RECONCILE_READ_RATE, help='ledger Query pages per second')
+    args = parser.parse_args()
+
+    for bucket_name in args.bucket or RECONCILE_BUCKETS:
+        print(json.dumps(reconcile(bucket_name, args.workers, args.list_rate, args.read_rate), indent=2))
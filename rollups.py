@@ -0,0 +1,194 @@
+from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+import aws_clients
+from sharding import history_partitions, shard_suffix, shard_suffixes
+
+# Rollup resolutions and the width of one rollup slot in ms, finest first
+RESOLUTIONS = {
+    '1s': 1000,
+    '1m': 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000
+}
+# Rollup rows live in the history table under '<bucket>@<resolution>' partitions, with the same
+# '#<shard>' suffix as raw rows for sharded buckets.
+# '@' cannot appear in a bucket name, so they never collide with raw samples.
+ROLLUP_SEPARATOR = '@'
+# Attributes of a rollup slot; slots of the same bucket, resolution and timestamp merge with combine_slots
+SLOT_ATTRIBUTES = ('sample_count', 'size_sum', 'size_min', 'size_max', 'size_last',
+                   'object_count_sum', 'object_count_min', 'object_count_max', 'object_count_last', 'last_at')
+# Raw samples are read instead of rollups when the window is short enough
+RAW_RESOLUTION = 'raw'
+# DynamoDB TTL attribute (epoch seconds) of history rows; the table's TTL must be enabled on it
+TTL_ATTRIBUTE = 'expires_at'
+# How long rows of each level are kept, e.g. 'raw=7d,1s=1d,1m=30d,1h=400d'; unlisted levels are kept forever
+DEFAULT_RETENTION = 'raw=7d,1s=1d,1m=30d,1h=400d'
+DURATION_UNITS = {'s': 1000, 'm': 60 * 1000, 'h': 60 * 60 * 1000, 'd': 24 * 60 * 60 * 1000}
+
+
+def rollup_partition(bucket_name, resolution):
+    return f'{bucket_name}{ROLLUP_SEPARATOR}{resolution}'
+
+
+def level_partitions(bucket_name, level, shard_counts):
+    """Every partition holding rows of one history level (raw or a rollup resolution) of the bucket."""
+    if level == RAW_RESOLUTION:
+        return history_partitions(bucket_name, shard_counts)
+    return [rollup_partition(bucket_name, level) + suffix for suffix in shard_suffixes(bucket_name, shard_counts)]
+
+
+def combine_slots(slot, other):
+    """The slot covering the samples of both slots; last values come from the later one."""
+    later = other if other['last_at'] >= slot['last_at'] else slot
+    combined = {'sample_count': slot['sample_count'] + other['sample_count'], 'last_at': later['last_at']}
+    for attribute in ('size', 'object_count'):
+        combined[f'{attribute}_sum'] = slot[f'{attribute}_sum'] + other[f'{attribute}_sum']
+        combined[f'{attribute}_min'] = min(slot[f'{attribute}_min'], other[f'{attribute}_min'])
+        combined[f'{attribute}_max'] = max(slot[f'{attribute}_max'], other[f'{attribute}_max'])
+        combined[f'{attribute}_last'] = later[f'{attribute}_last']
+    return combined
+
+
+def parse_resolutions(value):
+    """Parse a comma separated list such as '1s,1m,1h,1d'."""
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in RESOLUTIONS]
+    if unknown:
+        raise ValueError(f"Unknown rollup resolutions: {unknown}")
+    return names
+
+
+def parse_duration(value):
+    """Parse '90s', '30m', '12h' or '7d' into ms."""
+    value = value.strip()
+    if len(value) < 2 or value[-1] not in DURATION_UNITS or not value[:-1].isdigit():
+        raise ValueError(f"Invalid duration '{value}', expected a number followed by one of {list(DURATION_UNITS)}")
+    return int(value[:-1]) * DURATION_UNITS[value[-1]]
+
+
+def parse_retention(value):
+    """Parse 'raw=7d,1m=30d' into {level: retention in ms}."""
+    retention = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        level, _, duration = entry.partition('=')
+        level = level.strip()
+        if level != RAW_RESOLUTION and level not in RESOLUTIONS:
+            raise ValueError(f"Unknown history level '{level}' in retention")
+        retention[level] = parse_duration(duration)
+    return retention
+
+
+def expires_at(retention, level, timestamp):
+    """TTL of a row of the given level written for timestamp (ms), or None if the level is kept forever."""
+    if level not in retention:
+        return None
+    return (timestamp + retention[level]) // 1000
+
+
+def widen_range(table, key, rollup, attribute, value):
+    """Conditionally move '<attribute>_max' up or '<attribute>_min' down to include value."""
+    bounds = (
+        (f'{attribute}_max', Attr(f'{attribute}_max').lt(value), value > rollup[f'{attribute}_max']),
+        (f'{attribute}_min', Attr(f'{attribute}_min').gt(value), value < rollup[f'{attribute}_min'])
+    )
+    for bound, condition, extends in bounds:
+        if not extends:
+            continue
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression=f'SET {bound} = :value',
+                ConditionExpression=condition,
+                ExpressionAttributeValues={':value': value}
+            )
+        except ClientError as e:
+            # A concurrent writer already stored a wider bound
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def update_rollups(table, bucket_name, timestamp, size, object_count, resolutions, retention=None, shard_counts=None):
+    """
+    Fold one sample into the rollup slot that contains it at every resolution.
+    Sums, counts and last values are maintained with one UpdateItem per slot;
+    min and max only need a second, conditional write when the sample extends them.
+    Slots of resolutions with a retention expire that long after they start.
+    Sharded buckets write to the shard picked from the sample's timestamp, so each shard
+    holds a partial slot; readers merge them with combine_slots.
+    """
+    suffix = shard_suffix(bucket_name, timestamp, shard_counts or {})
+    for resolution in resolutions:
+        width = RESOLUTIONS[resolution]
+        key = {'bucket_name': rollup_partition(bucket_name, resolution) + suffix, 'timestamp': timestamp - timestamp % width}
+        values = {':size': size, ':count': object_count, ':ts': timestamp, ':one': 1}
+        update = ('SET size_last = :size, object_count_last = :count, last_at = :ts, '
+                  'size_max = if_not_exists(size_max, :size), size_min = if_not_exists(size_min, :size), '
+                  'object_count_max = if_not_exists(object_count_max, :count), '
+                  'object_count_min = if_not_exists(object_count_min, :count)')
+        expiry = expires_at(retention or {}, resolution, key['timestamp'])
+        if expiry is not None:
+            update += f', {TTL_ATTRIBUTE} = :expires'
+            values[':expires'] = expiry
+        response = table.update_item(
+            Key=key,
+            UpdateExpression=update + ' ADD sample_count :one, size_sum :size, object_count_sum :count',
+            ExpressionAttributeValues=values,
+            ReturnValues='ALL_NEW'
+        )
+        rollup = response['Attributes']
+        widen_range(table, key, rollup, 'size', size)
+        widen_range(table, key, rollup, 'object_count', object_count)
+
+
+def choose_resolution(window_ms, min_points, resolutions=RESOLUTIONS, retention=None):
+    """
+    Pick the coarsest resolution that still yields at least min_points slots
+    over the window; windows too short for any rollup read raw samples.
+    With a retention, only levels kept for at least the window are considered,
+    falling back to the finest one that is.
+    """
+    retention = retention or {}
+    kept = lambda level: retention.get(level, window_ms) >= window_ms
+    chosen = RAW_RESOLUTION if kept(RAW_RESOLUTION) else None
+    for resolution in resolutions:
+        if not kept(resolution):
+            continue
+        if chosen is None or window_ms // RESOLUTIONS[resolution] >= min_points:
+            chosen = resolution
+    return chosen or RAW_RESOLUTION
+
+
+def merge_shard_slots(items):
+    """Merge the partial slots that shards hold for the same timestamp; returns slots in timestamp order."""
+    merged = {}
+    for item in items:
+        timestamp = item['timestamp']
+        if timestamp in merged:
+            merged[timestamp] = {'bucket_name': merged[timestamp]['bucket_name'], 'timestamp': timestamp,
+                                 **combine_slots(merged[timestamp], item)}
+        else:
+            merged[timestamp] = item
+    return [merged[timestamp] for timestamp in sorted(merged)]
+
+
+def query_rollups(table, bucket_name, resolution, start_timestamp, end_timestamp, shard_counts=None):
+    """
+    Read the rollup slots of one resolution that overlap [start, end], following pagination.
+    The slots of a sharded bucket are read from every shard and merged.
+    """
+    width = RESOLUTIONS[resolution]
+    items = []
+    for partition in level_partitions(bucket_name, resolution, shard_counts or {}):
+        items.extend(aws_clients.query_items(
+            table,
+            KeyConditionExpression=Key('bucket_name').eq(partition) &
+                                   Key('timestamp').between(start_timestamp - start_timestamp % width, end_timestamp)
+        ))
+    items = merge_shard_slots(items)
+
+    for item in items:
+        item['size_avg'] = item['size_sum'] / item['sample_count']
+        item['object_count_avg'] = item['object_count_sum'] / item['sample_count']
+    return items
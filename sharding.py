@@ -0,0 +1,52 @@
+import zlib
+
+# History of very hot buckets is spread over several partitions, '<bucket>#0' .. '<bucket>#N-1' for raw
+# rows and '<bucket>@<resolution>#0' .. for rollup slots.
+# '#' cannot appear in a bucket name, so shard partitions never collide with other buckets.
+SHARD_SEPARATOR = '#'
+
+
+def parse_shard_counts(value):
+    """Parse 'bucket-a=8,bucket-b=4' into {'bucket-a': 8, 'bucket-b': 4}; unlisted buckets use one partition."""
+    counts = {}
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        bucket_name, _, count = entry.partition('=')
+        if not count.strip().isdigit() or int(count) < 1:
+            raise ValueError(f"Invalid shard count in '{entry.strip()}'")
+        counts[bucket_name.strip()] = int(count)
+    return counts
+
+
+def shard_suffix(bucket_name, timestamp, shard_counts):
+    """
+    Suffix of the partition a row of the bucket written at timestamp goes to, '' if it is not sharded.
+    Rows are spread by a hash of the timestamp, so the same timestamp (for example
+    a coalesced window start) always maps to the same shard.
+    """
+    shards = shard_counts.get(bucket_name, 1)
+    if shards <= 1:
+        return ''
+    return f'{SHARD_SEPARATOR}{zlib.crc32(str(timestamp).encode()) % shards}'
+
+
+def shard_suffixes(bucket_name, shard_counts):
+    """
+    Suffixes of every partition that may hold rows of the bucket, for reads that fan in across shards.
+    The unsharded partition ('') is always included so history written before sharding stays visible.
+    """
+    shards = shard_counts.get(bucket_name, 1)
+    if shards <= 1:
+        return ['']
+    return [''] + [f'{SHARD_SEPARATOR}{shard}' for shard in range(shards)]
+
+
+def history_partition(bucket_name, timestamp, shard_counts):
+    """Partition key of the raw history row written at timestamp."""
+    return bucket_name + shard_suffix(bucket_name, timestamp, shard_counts)
+
+
+def history_partitions(bucket_name, shard_counts):
+    """Every partition holding raw history of the bucket."""
+    return [bucket_name + suffix for suffix in shard_suffixes(bucket_name, shard_counts)]
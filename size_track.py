@@ -1,56 +1,773 @@
 #size_tracking
 
 import json
-import boto3
 import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from urllib.parse import unquote_plus
 from botocore.exceptions import ClientError
+from boto3.dynamodb.conditions import Key, Attr
+import aws_clients
+import metrics
+from history_writer import HistoryWriter
+from rollups import DEFAULT_RETENTION, TTL_ATTRIBUTE, RAW_RESOLUTION, expires_at, parse_duration, parse_resolutions, parse_retention, update_rollups
+from sharding import history_partition, history_partitions, parse_shard_counts
 
 
-s3_client = boto3.client('s3')
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-
 # DynamoDB Table name
 DYNAMODB_TABLE_NAME = 'S3-object-size-history'
-# Bucket name
+# Per-key size ledger (bucket_name, object_key) -> size
+LEDGER_TABLE_NAME = 'S3-object-size-ledger'
+# Running totals per bucket
+SUMMARY_TABLE_NAME = 'S3-bucket-size-summary'
+# GSI on (bucket_name, size) of the history table, used to seed the all-time extremes
+SIZE_INDEX_NAME = 'BucketSizeIndex'
+# Bucket assumed for records that do not name one; events normally carry s3.bucket.name
 BUCKET_NAME = 'testbucket-cs6620-lef'
 
-def lambda_handler(event, context):
+# 'incremental' applies the size delta carried by each S3 event,
+# 'full' re-lists the whole bucket on every event and stores the listed totals without touching the ledger
+# (the original behaviour)
+TRACKING_MODE = os.environ.get('TRACKING_MODE', 'incremental')
+# Force a full recount when the last one is older than this (0 disables the schedule)
+FULL_RECOUNT_INTERVAL_SECONDS = int(os.environ.get('FULL_RECOUNT_INTERVAL_SECONDS', '86400'))
+# A recount claimed this long ago that has not finished is assumed to have failed and may be claimed again
+RECOUNT_CLAIM_TIMEOUT_SECONDS = int(os.environ.get('RECOUNT_CLAIM_TIMEOUT_SECONDS', '900'))
+# Number of prefixes listed concurrently during a full recount
+RECOUNT_MAX_WORKERS = int(os.environ.get('RECOUNT_MAX_WORKERS', '8'))
+# Collapse all measurements within this many ms into one history row per bucket (0 disables)
+COALESCE_WINDOW_MS = int(os.environ.get('COALESCE_WINDOW_MS', '0'))
+# Rollup resolutions maintained as samples are written (empty disables rollups)
+ROLLUP_RESOLUTIONS = parse_resolutions(os.environ.get('ROLLUP_RESOLUTIONS', '1s,1m,1h,1d'))
+# 'every' records a history sample for every measurement; 'changes' only when the totals
+# differ from the last recorded sample, plus a heartbeat sample every SAMPLE_HEARTBEAT_SECONDS
+SAMPLE_MODE = os.environ.get('SAMPLE_MODE', 'every')
+SAMPLE_HEARTBEAT_SECONDS = int(os.environ.get('SAMPLE_HEARTBEAT_SECONDS', '60'))
+# How long raw samples and each rollup resolution are kept, via the history table's TTL
+HISTORY_RETENTION = parse_retention(os.environ.get('HISTORY_RETENTION', DEFAULT_RETENTION))
+# Raw history of hot buckets is spread over several partitions, e.g. 'hot-bucket=8,other-bucket=4'.
+# plotting_lambda must be deployed with the same value to read the shards back.
+# Raw rows and rollup slots are sharded; the summary item stays a single item written on every measurement.
+HISTORY_SHARDS = parse_shard_counts(os.environ.get('HISTORY_SHARDS', ''))
+
+# Recount workers share the S3 client, so its pool holds a connection per worker
+s3_client = aws_clients.client('s3', max_pool_connections=RECOUNT_MAX_WORKERS)
+
+# Unconditional history samples are buffered and written with BatchWriteItem
+history_writer = HistoryWriter(DYNAMODB_TABLE_NAME)
+# (bucket, summary, timestamp) of buffered samples, marked by flush_samples() once they are written
+pending_marks = []
+# Delimiter used to discover the top-level prefixes a recount is sharded on
+PREFIX_DELIMITER = '/'
+# S3 sequencers are hex strings of varying length; stored left-padded to this width so they compare as strings
+SEQUENCER_WIDTH = 32
+# Tombstones of deleted keys only need to outlive late deliveries of the key's earlier events;
+# the ledger table's TTL then removes them, so the ledger does not grow with every deleted key
+LEDGER_TOMBSTONE_RETENTION = parse_duration(os.environ.get('LEDGER_TOMBSTONE_RETENTION', '1d'))
+
+
+def current_timestamp():
+    return int(datetime.now().timestamp() * 1000)
+
+
+def sequencer_order(sequencer):
+    """
+    The sequencer of an S3 event as a string that sorts in event order. Sequencers only
+    order events of the same key, and are compared after left-padding with zeros.
+    """
+    return sequencer.upper().zfill(SEQUENCER_WIDTH) if sequencer else None
+
+
+def tombstone_expiry(timestamp):
+    """TTL (epoch seconds) of a tombstone written at timestamp (ms)."""
+    return (timestamp + LEDGER_TOMBSTONE_RETENTION) // 1000
+
+
+def parse_event_time(event_time):
+    # S3 reports eventTime as ISO 8601 in UTC, e.g. '2025-02-11T20:30:05.123Z'
+    return int(datetime.fromisoformat(event_time.replace('Z', '+00:00')).timestamp() * 1000)
+
+
+def parse_s3_records(event):
+    """
+    Extract the object changes carried by an S3 notification event.
+    Keys arrive URL-encoded; removal events carry no size.
+    """
+    changes = []
+    for record in event.get('Records', []):
+        s3_object = record.get('s3', {}).get('object', {})
+        if 'key' not in s3_object:
+            continue
+        changes.append({
+            'bucket_name': record['s3'].get('bucket', {}).get('name', BUCKET_NAME),
+            'event_name': record.get('eventName', ''),
+            'key': unquote_plus(s3_object['key']),
+            'size': int(s3_object.get('size', 0)),
+            'sequencer': sequencer_order(s3_object.get('sequencer')),
+            'event_time': parse_event_time(record['eventTime']) if 'eventTime' in record else None
+        })
+    return changes
+
+
+def apply_object_change(ledger_table, change, timestamp):
+    """
+    Record one object change in the ledger and return its (size delta, count delta).
+    The previous ledger entry makes overwrites exact: an update of an existing
+    key adds (new size - old size) and leaves the object count alone.
+
+    S3 delivers events at least once and in no particular order. The ledger keeps the
+    sequencer of the last event applied to each key, and an event is only applied if
+    its sequencer is newer, so replays and late deliveries return None and change nothing.
+    Removals leave a tombstone carrying the sequencer, so that a create delivered after
+    the delete of the same object is not counted either.
+    """
+    key = {'bucket_name': change['bucket_name'], 'object_key': change['key']}
+    sequencer = change.get('sequencer')
+    ordering = {}
+    if sequencer:
+        ordering = {'ConditionExpression': Attr('sequencer').not_exists() | Attr('sequencer').lt(sequencer)}
+
+    try:
+        if change['event_name'].startswith('ObjectCreated'):
+            item = {**key, 'size': change['size'], 'updated_at': timestamp}
+            response = ledger_table.put_item(Item={**item, 'sequencer': sequencer} if sequencer else item,
+                                             ReturnValues='ALL_OLD', **ordering)
+            new_size, new_count = change['size'], 1
+        elif change['event_name'].startswith('ObjectRemoved'):
+            if sequencer:
+                response = ledger_table.put_item(
+                    Item={**key, 'size': 0, 'deleted': True, 'sequencer': sequencer, 'updated_at': timestamp,
+                          TTL_ATTRIBUTE: tombstone_expiry(timestamp)},
+                    ReturnValues='ALL_OLD', **ordering
+                )
+            else:
+                response = ledger_table.delete_item(Key=key, ReturnValues='ALL_OLD')
+            new_size, new_count = 0, 0
+        else:
+            # ObjectRestore and other events do not change the stored bytes
+            return 0, 0
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        metrics.debug(f"Ignoring {change['event_name']} of {change['key']}: a newer event was already applied")
+        return None
+
+    previous = response.get('Attributes')
+    # S3 also reports deletes of keys that never existed
+    if previous and not previous.get('deleted'):
+        return new_size - int(previous['size']), new_count - 1
+    return new_size, new_count
+
+
+def write_ledger_entries(ledger_table, bucket_name, objects, timestamp, preserve=True):
+    """
+    Record the listed size of every object, for a listing that started at timestamp.
+    Entries are updated in place, so they keep the sequencer of the last event applied
+    to the key, and a listed object's tombstone is cleared. Entries an event changed
+    since the listing started are left alone: the event is newer than the listing.
+    With preserve=False the entries are written in batches instead, for a ledger that
+    has nothing to preserve.
+    """
+    if not preserve:
+        with ledger_table.batch_writer(overwrite_by_pkeys=['bucket_name', 'object_key']) as batch:
+            for obj in objects:
+                batch.put_item(Item={
+                    'bucket_name': bucket_name,
+                    'object_key': obj['Key'],
+                    'size': obj['Size'],
+                    'updated_at': timestamp
+                })
+        return
+
+    for obj in objects:
+        update_ledger_entry(ledger_table, bucket_name, obj, timestamp)
+
+
+def update_ledger_entry(ledger_table, bucket_name, obj, timestamp):
+    """Set the entry of a listed object to its listed size; see write_ledger_entries."""
+    try:
+        ledger_table.update_item(
+            Key={'bucket_name': bucket_name, 'object_key': obj['Key']},
+            UpdateExpression=f'SET #size = :size, updated_at = :ts REMOVE deleted, {TTL_ATTRIBUTE}',
+            ConditionExpression=Attr('updated_at').not_exists() | Attr('updated_at').lt(timestamp),
+            ExpressionAttributeNames={'#size': 'size'},
+            ExpressionAttributeValues={':size': obj['Size'], ':ts': timestamp}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def bury_ledger_entry(ledger_table, entry, timestamp):
+    """
+    Turn the entry of an object that no longer exists into a tombstone, keeping its sequencer
+    so that late events of the key are still recognised. Entries without a sequencer are
+    deleted. Skipped if an event changed the entry since it was read.
+    """
+    key = {'bucket_name': entry['bucket_name'], 'object_key': entry['object_key']}
+    try:
+        if not entry.get('sequencer'):
+            ledger_table.delete_item(Key=key, ConditionExpression=Attr('updated_at').eq(entry['updated_at']))
+            return
+        ledger_table.update_item(
+            Key=key,
+            UpdateExpression=f'SET #size = :zero, deleted = :deleted, updated_at = :ts, {TTL_ATTRIBUTE} = :expires',
+            ConditionExpression=Attr('updated_at').eq(entry['updated_at']),
+            ExpressionAttributeNames={'#size': 'size'},
+            ExpressionAttributeValues={':zero': 0, ':deleted': True, ':ts': timestamp,
+                                       ':expires': tombstone_expiry(timestamp)}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def ledger_entries(ledger_table, bucket_name, prefix):
+    """The ledger entries of the keys under prefix, in key order."""
+    return aws_clients.query_items(
+        ledger_table,
+        KeyConditionExpression=Key('bucket_name').eq(bucket_name) & Key('object_key').begins_with(prefix),
+        ProjectionExpression='bucket_name, object_key, #size, deleted, sequencer, updated_at',
+        ExpressionAttributeNames={'#size': 'size'}
+    )
+
+
+def merge_listing(objects, entries):
+    """
+    Pair listed objects with ledger entries of the same key. Both come in key order (S3 and
+    DynamoDB both sort keys by their UTF-8 bytes); yields (object or None, entry or None).
+    """
+    obj, entry = next(objects, None), next(entries, None)
+    while obj is not None or entry is not None:
+        if entry is None or (obj is not None and obj['Key'] < entry['object_key']):
+            yield obj, None
+            obj = next(objects, None)
+        elif obj is None or entry['object_key'] < obj['Key']:
+            yield None, entry
+            entry = next(entries, None)
+        else:
+            yield obj, entry
+            obj, entry = next(objects, None), next(entries, None)
+
+
+def top_level_prefix(key):
+    """The top-level prefix a key is counted under in prefix_totals, '' for keys at the root."""
+    position = key.find(PREFIX_DELIMITER)
+    return key[:position + len(PREFIX_DELIMITER)] if position >= 0 else ''
+
+
+def discover_prefixes(bucket_name):
+    """
+    List the top level of the bucket with a delimiter.
+    Returns the objects stored directly at the root and the top-level prefixes.
+    """
+    root_objects = []
+    prefixes = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Delimiter=PREFIX_DELIMITER):
+        root_objects.extend(page.get('Contents', []))
+        prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+    return root_objects, prefixes
+
+
+def scan_prefix(bucket_name, prefix, timestamp):
+    """
+    Walk every page under one prefix and bring its ledger entries in line with the listing.
+    The entries are read alongside the listing, so only the entries that differ are written:
+    keys that are missing or have another size, tombstones of keys that exist again, and
+    entries of objects that are gone (see bury_ledger_entry). Every write is conditional,
+    so entries changed by events during the recount are left to the events.
+    Runs on a worker thread, so it uses that thread's DynamoDB resource.
+    """
+    ledger_table = aws_clients.table(LEDGER_TABLE_NAME)
+    totals = [0, 0]
+
+    def listed():
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                totals[0] += obj['Size']
+                totals[1] += 1
+                yield obj
+
+    for obj, entry in merge_listing(listed(), ledger_entries(ledger_table, bucket_name, prefix)):
+        if obj is None:
+            if not entry.get('deleted'):
+                bury_ledger_entry(ledger_table, entry, timestamp)
+        elif entry is None or entry.get('deleted') or int(entry['size']) != obj['Size']:
+            update_ledger_entry(ledger_table, bucket_name, obj, timestamp)
+    return tuple(totals)
+
+
+def count_prefix(bucket_name, prefix):
+    """Size and object count under one prefix, from the listing alone."""
+    total_size = 0
+    total_objects = 0
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        objects = page.get('Contents', [])
+        total_size += sum(obj['Size'] for obj in objects)
+        total_objects += len(objects)
+    return total_size, total_objects
+
+
+def scan_bucket(bucket_name, timestamp, sync_ledger=True):
+    """
+    Count the bucket by fanning the listing out across its top-level prefixes,
+    syncing the ledger with the listing unless sync_ledger is False.
+    Returns {prefix: (size, count)}, with '' holding the objects at the root.
+    """
+    root_objects, prefixes = discover_prefixes(bucket_name)
+    if sync_ledger:
+        write_ledger_entries(aws_clients.table(LEDGER_TABLE_NAME), bucket_name, root_objects, timestamp)
+    prefix_totals = {'': (sum(obj['Size'] for obj in root_objects), len(root_objects))}
+
+    with ThreadPoolExecutor(max_workers=RECOUNT_MAX_WORKERS) as executor:
+        if sync_ledger:
+            scan = metrics.in_context(lambda p: scan_prefix(bucket_name, p, timestamp))
+        else:
+            scan = metrics.in_context(lambda p: count_prefix(bucket_name, p))
+        for prefix, totals in zip(prefixes, executor.map(scan, prefixes)):
+            prefix_totals[prefix] = totals
+
+    return prefix_totals
+
+
+def remove_stale_ledger_entries(ledger_table, bucket_name, timestamp, skipped_prefixes):
+    """
+    Remove the live ledger entries the recount did not see, outside the skipped prefixes (those
+    scan_prefix already synced, or did not re-list). Entries carrying a sequencer become
+    tombstones instead of being deleted, and existing tombstones are left to their TTL.
+    """
+    items = aws_clients.query_items(
+        ledger_table,
+        KeyConditionExpression=Key('bucket_name').eq(bucket_name),
+        FilterExpression=Attr('updated_at').lt(timestamp) & Attr('deleted').not_exists(),
+        ProjectionExpression='bucket_name, object_key, sequencer, updated_at'
+    )
+    with ledger_table.batch_writer() as batch:
+        for item in items:
+            if any(item['object_key'].startswith(prefix) for prefix in skipped_prefixes):
+                continue
+            if item.get('sequencer'):
+                bury_ledger_entry(ledger_table, item, timestamp)
+            else:
+                batch.delete_item(Key={'bucket_name': item['bucket_name'], 'object_key': item['object_key']})
+
+
+def full_recount(bucket_name):
+    """
+    Re-list the bucket, sync the per-key ledger with the listing and reset the running totals.
+    Each prefix is synced by scan_prefix; the sweep afterwards covers root keys and prefixes
+    that no longer exist.
+    The per-prefix subtotals are stored with the totals as a breakdown of the bucket.
+    """
+    recount_started = current_timestamp()
+    ledger_table = aws_clients.table(LEDGER_TABLE_NAME)
+
+    with metrics.phase('list'):
+        prefix_totals = scan_bucket(bucket_name, recount_started)
+        remove_stale_ledger_entries(ledger_table, bucket_name, recount_started, [p for p in prefix_totals if p])
+
+    summary = store_totals(bucket_name, prefix_totals, recount_started)
+    metrics.annotate(recounted_objects=int(summary['object_count']))
+    metrics.debug(f"Full recount of {bucket_name}: {summary['object_count']} objects, {summary['total_size']} bytes "
+                  f"across {len(prefix_totals)} prefixes")
+    return summary
+
+
+def list_totals(bucket_name):
+    """
+    Count the bucket from its listing alone and store the totals (TRACKING_MODE=full).
+    The ledger is neither read nor written, so the totals do not count as a recount.
+    """
+    timestamp = current_timestamp()
+    with metrics.phase('list'):
+        prefix_totals = scan_bucket(bucket_name, timestamp, sync_ledger=False)
+    summary = store_totals(bucket_name, prefix_totals, timestamp, ledger_synced=False)
+    metrics.annotate(recounted_objects=int(summary['object_count']))
+    return summary
+
+
+def store_totals(bucket_name, prefix_totals, timestamp, extra_attributes=None, ledger_synced=True):
+    """
+    Replace the bucket's running totals with a new baseline ({prefix: (size, count)})
+    counted at timestamp, and return the summary item. Used by recounts and inventory bootstraps.
+    Totals counted without syncing the ledger drop last_recount_at, so incremental tracking
+    recounts before it trusts the ledger again.
+    """
+    summary_table = aws_clients.table(SUMMARY_TABLE_NAME)
+    values = {
+        ':one': 1,
+        ':size': sum(size for size, _ in prefix_totals.values()),
+        ':count': sum(count for _, count in prefix_totals.values()),
+        ':ts': timestamp,
+        ':prefixes': [
+            {'prefix': prefix, 'size': size, 'object_count': count}
+            for prefix, (size, count) in sorted(prefix_totals.items())
+        ]
+    }
+    update = 'SET total_size = :size, object_count = :count, measured_at = :ts, prefix_totals = :prefixes'
+    if ledger_synced:
+        update += ', last_recount_at = :ts'
+    for i, (name, value) in enumerate(sorted((extra_attributes or {}).items())):
+        update += f', {name} = :extra{i}'
+        values[f':extra{i}'] = value
+    if not ledger_synced:
+        update += ' REMOVE last_recount_at'
+    response = summary_table.update_item(
+        Key={'bucket_name': bucket_name},
+        UpdateExpression=update + ' ADD revision :one',
+        ExpressionAttributeValues=values,
+        ReturnValues='ALL_NEW'
+    )
+    return response['Attributes']
+
+
+def recount_due(bucket_name, summary, timestamp):
+    """A recount is needed when there is no baseline, the totals drifted, or the schedule says so."""
+    if 'last_recount_at' not in summary:
+        return True
+    if int(summary['total_size']) < 0 or int(summary['object_count']) < 0:
+        print(f"Drift detected for {bucket_name}: {summary['total_size']} bytes, {summary['object_count']} objects")
+        return True
+    if FULL_RECOUNT_INTERVAL_SECONDS > 0:
+        return timestamp - int(summary['last_recount_at']) >= FULL_RECOUNT_INTERVAL_SECONDS * 1000
+    return False
+
+
+def track_incremental(bucket_name, changes):
+    """Apply the deltas of one bucket's changes to its running totals and return the summary item."""
+    timestamp = current_timestamp()
+    ledger_table = aws_clients.table(LEDGER_TABLE_NAME)
+    summary_table = aws_clients.table(SUMMARY_TABLE_NAME)
+
+    size_delta = 0
+    count_delta = 0
+    stale = 0
+    with metrics.phase('aggregate'):
+        for change in changes:
+            delta = apply_object_change(ledger_table, change, timestamp)
+            if delta is None:
+                stale += 1
+                continue
+            size_delta += delta[0]
+            count_delta += delta[1]
+        metrics.add(stale_records=stale)
+
+        response = summary_table.update_item(
+            Key={'bucket_name': bucket_name},
+            UpdateExpression='SET measured_at = :ts ADD total_size :size, object_count :count, revision :one',
+            ExpressionAttributeValues={':size': size_delta, ':count': count_delta, ':one': 1, ':ts': timestamp},
+            ReturnValues='ALL_NEW'
+        )
+    summary = response['Attributes']
+
+    if recount_due(bucket_name, summary, timestamp) and claim_due_recount(bucket_name, summary, timestamp):
+        return full_recount(bucket_name)
+    return summary
+
+
+def recorded_extreme(bucket_name, largest):
+    """
+    The largest (or smallest) size in the bucket's raw history as (size, timestamp), or None.
+    One Limit=1 query of the size index per history partition.
+    """
+    table = aws_clients.table(DYNAMODB_TABLE_NAME)
+    extreme = None
+    for partition in history_partitions(bucket_name, HISTORY_SHARDS):
+        response = table.query(
+            IndexName=SIZE_INDEX_NAME,
+            KeyConditionExpression=Key('bucket_name').eq(partition),
+            ScanIndexForward=not largest,
+            Limit=1
+        )
+        for item in response.get('Items', []):
+            candidate = (int(item['size']), int(item['timestamp']))
+            if extreme is None or (candidate[0] > extreme[0] if largest else candidate[0] < extreme[0]):
+                extreme = candidate
+    return extreme
+
+
+def update_extremes(bucket_name, summary, timestamp):
+    """
+    Keep the all-time max and min size (and when they happened) on the summary item.
+    Each write is conditional on still extending the range, so concurrent invocations
+    can only ever move the max up and the min down. Writes that cannot change
+    anything according to the summary we already hold are skipped.
+    Extremes missing from the summary, e.g. on a history table that predates them, are
+    seeded from the history's size index, so they start at the recorded all-time values.
+    """
+    summary_table = aws_clients.table(SUMMARY_TABLE_NAME)
+    extremes = (
+        ('max_size', True, lambda size, current: size > current),
+        ('min_size', False, lambda size, current: size < current)
+    )
+    for attribute, largest, extends in extremes:
+        size, at = int(summary['total_size']), timestamp
+        if attribute in summary:
+            if not extends(size, int(summary[attribute])):
+                continue
+        else:
+            recorded = recorded_extreme(bucket_name, largest)
+            if recorded is not None and extends(recorded[0], size):
+                size, at = recorded
+        condition = Attr(attribute).lt(size) if largest else Attr(attribute).gt(size)
+        try:
+            summary_table.update_item(
+                Key={'bucket_name': bucket_name},
+                UpdateExpression=f'SET {attribute} = :size, {attribute}_at = :ts',
+                ConditionExpression=Attr(attribute).not_exists() | condition,
+                ExpressionAttributeValues={':size': size, ':ts': at}
+            )
+        except ClientError as e:
+            # Another invocation already recorded a more extreme value
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def claim_due_recount(bucket_name, summary, timestamp):
+    """
+    Per-bucket guard for the recounts incremental tracking starts: of the invocations that
+    found a recount due in the same summary, only the one whose claim lands first recounts;
+    the others have applied their deltas and are done. A claim newer than the last recount
+    means a recount is running, unless it is older than RECOUNT_CLAIM_TIMEOUT_SECONDS.
+    """
+    claimed_at = summary.get('recount_claimed_at')
+    last_recount_at = summary.get('last_recount_at')
+    if claimed_at is not None and int(claimed_at) > int(last_recount_at or 0) and \
+            timestamp - int(claimed_at) < RECOUNT_CLAIM_TIMEOUT_SECONDS * 1000:
+        return False
+    condition = Attr('recount_claimed_at').not_exists() if claimed_at is None else Attr('recount_claimed_at').eq(claimed_at)
+    condition &= Attr('last_recount_at').not_exists() if last_recount_at is None else Attr('last_recount_at').eq(last_recount_at)
+    summary_table = aws_clients.table(SUMMARY_TABLE_NAME)
     try:
-        # Calculate the total size of all objects in the bucket
-        total_size = 0
-        total_objects = 0
+        summary_table.update_item(
+            Key={'bucket_name': bucket_name},
+            UpdateExpression='SET recount_claimed_at = :ts',
+            ConditionExpression=condition,
+            ExpressionAttributeValues={':ts': timestamp}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
 
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                total_size += obj['Size']
-                total_objects += 1
+def claim_recount(bucket_name, newest_event_time, timestamp):
+    """
+    Per-bucket "last computed at" guard for full recounts.
+    Succeeds only if no recount has started since the newest event in the batch;
+    otherwise that recount already sees these changes and will record the result.
+    """
+    summary_table = aws_clients.table(SUMMARY_TABLE_NAME)
+    try:
+        summary_table.update_item(
+            Key={'bucket_name': bucket_name},
+            UpdateExpression='SET recount_claimed_at = :ts',
+            ConditionExpression=Attr('recount_claimed_at').not_exists() | Attr('recount_claimed_at').lt(newest_event_time),
+            ExpressionAttributeValues={':ts': timestamp}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
 
-        # Get the current timestamp
-        timestamp = int(datetime.now().timestamp() * 1000)
 
-        # Get the DynamoDB table
-        table = dynamodb.Table(DYNAMODB_TABLE_NAME)
+def record_sample(bucket_name, summary, timestamp):
+    """
+    Write one history row for the summary's totals.
+    With coalescing on, the row is keyed by the start of its window, so every
+    measurement in the window lands on the same row. The revision condition keeps
+    the newest totals when concurrent invocations race on that row; conditional
+    writes cannot go through BatchWriteItem, so only plain samples are buffered.
+    Hot buckets listed in HISTORY_SHARDS write to a shard picked from the row's timestamp.
+    A buffered sample is only marked as recorded by flush_samples(), after it is written.
+    """
+    if COALESCE_WINDOW_MS > 0:
+        timestamp -= timestamp % COALESCE_WINDOW_MS
+    item = {
+        'bucket_name': history_partition(bucket_name, timestamp, HISTORY_SHARDS),
+        'timestamp': timestamp,
+        'size': int(summary['total_size']),
+        'object_count': int(summary['object_count'])
+    }
+    expiry = expires_at(HISTORY_RETENTION, RAW_RESOLUTION, timestamp)
+    if expiry is not None:
+        item[TTL_ATTRIBUTE] = expiry
+    if COALESCE_WINDOW_MS <= 0:
+        pending_marks.append((bucket_name, summary, timestamp))
+        history_writer.add(item)
+        return
 
-        # Insert the record into the DynamoDB table
+    table = aws_clients.table(DYNAMODB_TABLE_NAME)
+    revision = int(summary['revision'])
+    item['revision'] = revision
+    try:
         table.put_item(
-            Item={
-                'bucket_name': BUCKET_NAME,
-                'timestamp': timestamp,
-                'size': total_size,
-                'object_count': total_objects
-            }
+            Item=item,
+            ConditionExpression=Attr('revision').not_exists() | Attr('revision').lt(revision)
         )
+    except ClientError as e:
+        # Newer totals were already recorded for this window
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return
+    mark_sampled(bucket_name, summary, timestamp)
+
+
+def flush_samples():
+    """
+    Write the buffered history samples, then mark their buckets as sampled. If the
+    write fails, the samples stay buffered and unmarked, so sample_due() does not
+    suppress the retried measurement against totals that were never recorded.
+    """
+    history_writer.flush()
+    marks = list(pending_marks)
+    del pending_marks[:len(marks)]
+    for bucket_name, summary, timestamp in marks:
+        mark_sampled(bucket_name, summary, timestamp)
 
-        return {
-            'statusCode': 200,
-            'body': json.dumps('Bucket size data updated successfully.')
-        }
 
+def sample_due(summary, timestamp):
+    """
+    Whether a measurement needs a history sample. In 'changes' mode, totals equal to the
+    last recorded sample are suppressed until the heartbeat is due; plots carry the last
+    sample forward as a step, so suppressed measurements lose nothing.
+    """
+    if SAMPLE_MODE != 'changes' or 'sampled_at' not in summary:
+        return True
+    if int(summary['sampled_size']) != int(summary['total_size']) or int(summary['sampled_count']) != int(summary['object_count']):
+        return True
+    return timestamp - int(summary['sampled_at']) >= SAMPLE_HEARTBEAT_SECONDS * 1000
+
+
+def mark_sampled(bucket_name, summary, timestamp):
+    """
+    Remember the last recorded totals on the summary item for sample_due(). The summary is
+    shared by every warm container, unlike an in-memory cache, so one container never
+    suppresses a change against a value that another container has since replaced.
+    The revision condition keeps the newest totals when samples race.
+    """
+    if SAMPLE_MODE != 'changes':
+        return
+    revision = int(summary.get('revision', 0))
+    try:
+        aws_clients.table(SUMMARY_TABLE_NAME).update_item(
+            Key={'bucket_name': bucket_name},
+            UpdateExpression='SET sampled_size = :size, sampled_count = :count, sampled_at = :ts, sampled_revision = :revision',
+            ConditionExpression=Attr('sampled_revision').not_exists() | Attr('sampled_revision').lte(revision),
+            ExpressionAttributeValues={':size': int(summary['total_size']), ':count': int(summary['object_count']),
+                                       ':ts': timestamp, ':revision': revision}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def record_rollups(bucket_name, summary, timestamp):
+    """
+    Fold the summary's totals into the bucket's rollup slots.
+    Hot buckets listed in HISTORY_SHARDS spread the current slot of each resolution over their shards.
+    """
+    update_rollups(aws_clients.table(DYNAMODB_TABLE_NAME), bucket_name, timestamp, int(summary['total_size']),
+                   int(summary['object_count']), ROLLUP_RESOLUTIONS, HISTORY_RETENTION, HISTORY_SHARDS)
+
+
+def group_by_bucket(changes):
+    """Split the changes by the bucket that emitted them, keeping event order within each bucket."""
+    buckets = {}
+    for change in changes:
+        buckets.setdefault(change['bucket_name'], []).append(change)
+    return buckets
+
+
+def track_bucket(bucket_name, changes):
+    """
+    Fold one bucket's changes into a single measurement of that bucket.
+    Returns (summary, timestamp) of the measurement, or None if the bucket was skipped
+    or its sample suppressed as unchanged.
+    """
+    timestamp = current_timestamp()
+    if TRACKING_MODE == 'full':
+        event_times = [change['event_time'] for change in changes if change['event_time']]
+        if COALESCE_WINDOW_MS > 0 and event_times and not claim_recount(bucket_name, max(event_times), timestamp):
+            print(f"Skipping recount of {bucket_name}: a newer recount already covers this batch")
+            return None
+        summary = list_totals(bucket_name)
+    else:
+        summary = track_incremental(bucket_name, changes)
+
+    timestamp = current_timestamp()
+    if not sample_due(summary, timestamp):
+        metrics.add(suppressed_samples=1)
+        return None
+    with metrics.phase('write'):
+        record_sample(bucket_name, summary, timestamp)
+    return summary, timestamp
+
+
+def process_event(event):
+    """
+    Fold the records of the event into one measurement per bucket that emitted them.
+    Each bucket keeps its own ledger entries, running totals and history partition;
+    the history samples of all buckets are flushed together.
+    """
+    changes = parse_s3_records(event)
+    buckets = group_by_bucket(changes)
+    metrics.annotate(records=len(changes), buckets=len(buckets))
+    measurements = {}
+    for bucket_name, bucket_changes in buckets.items():
+        measurement = track_bucket(bucket_name, bucket_changes)
+        if measurement:
+            measurements[bucket_name] = measurement
+
+    with metrics.phase('write'):
+        flush_samples()
+    with metrics.phase('rollup'):
+        for bucket_name, (summary, timestamp) in measurements.items():
+            update_extremes(bucket_name, summary, timestamp)
+            record_rollups(bucket_name, summary, timestamp)
+
+
+@metrics.instrumented('size_track')
+def lambda_handler(event, context):
+    """
+    Entry point for S3 notifications delivered directly. Errors are raised, not returned:
+    S3 invokes asynchronously, so only a failed invocation is retried, and incremental
+    tracking must see every event. Sequencer checks make the retry safe.
+    """
+    try:
+        process_event(event)
     except ClientError as e:
         print(f"Error occurred: {e}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f"Error: {e}")
-        }
+        raise
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps('Bucket size data updated successfully.')
+    }
+
+
+@metrics.instrumented('size_track_sqs')
+def sqs_handler(event, context):
+    """
+    Entry point for S3 notifications delivered through an SQS queue.
+    All S3 records of the batch are collapsed into a single measurement per bucket.
+    Errors are raised so that SQS redelivers the batch.
+    """
+    records = []
+    for message in event.get('Records', []):
+        body = json.loads(message['body'])
+        # s3:TestEvent messages carry no Records
+        records.extend(body.get('Records', []))
+
+    metrics.annotate(messages=len(event.get('Records', [])))
+    process_event({'Records': records})
+    metrics.debug(f"Coalesced {len(records)} S3 records from {len(event.get('Records', []))} messages")
+    return {
+        'statusCode': 200,
+        'body': json.dumps('Bucket size data updated successfully.')
+    }
@@ -1,27 +1,75 @@
-import boto3
+import argparse
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+import aws_clients
+from history_writer import HistoryWriter
 
 # 连接 DynamoDB
-dynamodb = boto3.resource('dynamodb', region_name='us-east-2')
-table = dynamodb.Table('S3-object-size-history')
-
-# 插入 5 条数据
-for i in range(5):
-    timestamp = int(datetime.now().timestamp() * 1000)  # 毫秒级时间戳
-    size = 100000 + (i * 50000)  # 递增大小
-    table.put_item(
-        Item={
-            'bucket_name': 'testbucket-cs6620-lef',
-            'timestamp': timestamp,
-            'size': size
+DYNAMODB_TABLE_NAME = 'S3-object-size-history'
+BUCKET_NAME = 'testbucket-cs6620-lef'
+
+
+def synthetic_samples(bucket_name, count, end_timestamp, interval_ms, seed):
+    """Yield a random walk of bucket sizes, one sample every interval_ms, ending at end_timestamp."""
+    rng = random.Random(seed)
+    size = 100000
+    objects = 10
+    start_timestamp = end_timestamp - (count - 1) * interval_ms
+    for i in range(count):
+        objects = max(0, objects + rng.choice((-1, 0, 1)))
+        size = max(0, size + rng.randint(-50000, 50000))  # 随机增减大小
+        yield {
+            'bucket_name': bucket_name,
+            'timestamp': start_timestamp + i * interval_ms,
+            'size': size,
+            'object_count': objects
         }
-    )
-    print(f"Inserted: {timestamp}, size: {size}")
-    time.sleep(2)  # 间隔 2 秒
+
+
+def seed_range(bucket_name, count, end_timestamp, interval_ms, seed):
+    client = aws_clients.client('dynamodb')
+    with HistoryWriter(DYNAMODB_TABLE_NAME, client=client, max_items=500) as writer:
+        for item in synthetic_samples(bucket_name, count, end_timestamp, interval_ms, seed):
+            writer.add(item)
+    return writer.items_written
+
+
+def bulk_seed(bucket_name, samples, interval_ms, workers):
+    """
+    Load `samples` synthetic samples ending now, split into contiguous time ranges
+    that are written concurrently by `workers` threads.
+    """
+    end_timestamp = int(datetime.now().timestamp() * 1000)  # 毫秒级时间戳
+    per_worker = -(-samples // workers)
+    jobs = []
+    for worker in range(workers):
+        count = min(per_worker, samples - worker * per_worker)
+        if count <= 0:
+            break
+        worker_end = end_timestamp - worker * per_worker * interval_ms
+        jobs.append((bucket_name, count, worker_end, interval_ms, worker))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        written = sum(executor.map(lambda job: seed_range(*job), jobs))
+    elapsed = time.perf_counter() - started
+    print(f"Inserted {written} samples for '{bucket_name}' in {elapsed:.1f}s ({written / max(elapsed, 1e-9):.0f} items/s)")
+    return written
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk-load synthetic bucket size samples for load testing the plotting path.')
+    parser.add_argument('--samples', type=int, default=5)
+    parser.add_argument('--bucket', default=BUCKET_NAME)
+    parser.add_argument('--interval-ms', type=int, default=2000)  # 间隔 2 秒
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+    bulk_seed(args.bucket, args.samples, args.interval_ms, args.workers)
 
 # driver-role plotting-role size-tracking-role
 #AmazonAPIGatewayInvokeFullAccess
 #AmazonDynamoDBFullAccess
 #AmazonS3FullAccess
-#AWSLambdaBasicExecutionRole
\ No newline at end of file
+#AWSLambdaBasicExecutionRole
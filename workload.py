@@ -0,0 +1,256 @@
+"""
+Workload generator for load testing the size-tracking pipeline.
+
+Replays a declarative scenario against an S3 bucket: a key space spread over a
+number of prefixes, an object size distribution and a put/overwrite/delete mix,
+issued by a pool of worker threads at a target rate for a fixed duration.
+Every operation's latency is recorded. Afterwards the history table is read to
+measure the lag until the tracker wrote a sample covering each operation.
+
+    python workload.py --ops-per-second 50 --duration 60 --workers 16 --mix put=0.6,overwrite=0.3,delete=0.1
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+import aws_clients
+from ratelimit import RateLimiter
+from sharding import history_partitions, parse_shard_counts
+
+s3_client = aws_clients.client('s3')
+
+DYNAMODB_TABLE_NAME = 'S3-object-size-history'
+BUCKET_NAME = 'testbucket-cs6620-lef'
+# Must match size_track's HISTORY_SHARDS so lag is measured across every shard
+HISTORY_SHARDS = parse_shard_counts(os.environ.get('HISTORY_SHARDS', ''))
+OPERATIONS = ('put', 'overwrite', 'delete')
+
+DEFAULT_SCENARIO = {
+    'bucket': BUCKET_NAME,
+    'key_prefix': 'workload/',
+    'objects': 1000,             # distinct keys the workload may create
+    'prefixes': 10,              # keys are spread evenly over this many prefixes
+    'size': {'distribution': 'lognormal', 'median': 4096, 'sigma': 1.0},
+    'mix': {'put': 0.6, 'overwrite': 0.3, 'delete': 0.1},
+    'ops_per_second': 20,
+    'duration_seconds': 30,
+    'workers': 8,
+    'drain_seconds': 60,         # how long to wait for the tracker to catch up afterwards
+    'seed': None
+}
+
+
+def current_timestamp():
+    return int(time.time() * 1000)
+
+
+def object_size(spec, rng):
+    """Draw one object size in bytes from the scenario's size distribution."""
+    distribution = spec['distribution']
+    if distribution == 'fixed':
+        return int(spec['bytes'])
+    if distribution == 'uniform':
+        return rng.randint(int(spec['min']), int(spec['max']))
+    if distribution == 'lognormal':
+        return max(0, int(rng.lognormvariate(0, float(spec['sigma'])) * float(spec['median'])))
+    raise ValueError(f"Unknown size distribution '{distribution}'")
+
+
+def percentiles(values):
+    """p50/p90/p99/max of a list of numbers, or None when it is empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    return {'count': len(ordered), 'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': ordered[-1]}
+
+
+class Workload:
+    """
+    Shared state of one scenario run: the live key set, a shared rate limiter and
+    the record of completed operations. Worker threads call run_worker() until the deadline.
+    """
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        # Every worker thread shares the client, so it gets a connection per worker
+        self.s3_client = aws_clients.client('s3', max_pool_connections=scenario['workers'])
+        self.limiter = RateLimiter(scenario['ops_per_second'])
+        self.lock = threading.Lock()
+        self.live_keys = []
+        self.next_key = 0
+        self.completed = []   # (operation, latency ms, completed at ms)
+        self.errors = 0
+        weights = scenario['mix']
+        unknown = [operation for operation in weights if operation not in OPERATIONS]
+        if unknown:
+            raise ValueError(f"Unknown operations in mix: {unknown}")
+        self.operations = [operation for operation in OPERATIONS if weights.get(operation, 0) > 0]
+        self.weights = [weights[operation] for operation in self.operations]
+
+    def key_name(self, n):
+        prefix = n % max(1, self.scenario['prefixes'])
+        return f"{self.scenario['key_prefix']}p{prefix:04d}/obj{n:08d}"
+
+    def choose(self, rng):
+        """Pick an operation and its key; overwrites and deletes fall back to puts while no key is live."""
+        operation = rng.choices(self.operations, self.weights)[0]
+        with self.lock:
+            if operation != 'put' and self.live_keys:
+                index = rng.randrange(len(self.live_keys))
+                key = self.live_keys[index]
+                if operation == 'delete':
+                    # Swap-remove so deletes stay O(1)
+                    self.live_keys[index] = self.live_keys[-1]
+                    self.live_keys.pop()
+                return operation, key
+            if self.next_key >= self.scenario['objects'] and self.live_keys:
+                # The key space is used up; keep writing by overwriting
+                return 'overwrite', self.live_keys[rng.randrange(len(self.live_keys))]
+            key = self.key_name(self.next_key)
+            self.next_key += 1
+            self.live_keys.append(key)
+            return 'put', key
+
+    def run_worker(self, seed, deadline):
+        rng = random.Random(seed)
+        bucket = self.scenario['bucket']
+        while time.monotonic() < deadline:
+            self.limiter.acquire()
+            if time.monotonic() >= deadline:
+                return
+            operation, key = self.choose(rng)
+            started = time.perf_counter()
+            try:
+                if operation == 'delete':
+                    self.s3_client.delete_object(Bucket=bucket, Key=key)
+                else:
+                    self.s3_client.put_object(Bucket=bucket, Key=key, Body=b'x' * object_size(self.scenario['size'], rng))
+            except ClientError as e:
+                print(f"{operation} {key} failed: {e}")
+                with self.lock:
+                    self.errors += 1
+                continue
+            latency_ms = round((time.perf_counter() - started) * 1000, 2)
+            with self.lock:
+                self.completed.append((operation, latency_ms, current_timestamp()))
+
+
+def sample_timestamps(bucket_name, start_timestamp, end_timestamp):
+    """Sorted timestamps of the history samples written for the bucket in [start, end]."""
+    table = aws_clients.table(DYNAMODB_TABLE_NAME)
+    timestamps = []
+    for partition in history_partitions(bucket_name, HISTORY_SHARDS):
+        items = aws_clients.query_items(
+            table,
+            KeyConditionExpression=Key('bucket_name').eq(partition) & Key('timestamp').between(start_timestamp, end_timestamp),
+            ProjectionExpression='#ts',
+            ExpressionAttributeNames={'#ts': 'timestamp'}
+        )
+        timestamps.extend(int(item['timestamp']) for item in items)
+    return sorted(timestamps)
+
+
+def measure_lag(bucket_name, completed, drain_seconds):
+    """
+    For every operation, the time from its completion until the first history sample
+    written at or after it. Waits up to drain_seconds for a sample after the last operation.
+    """
+    if not completed:
+        return [], 0
+    first = min(done_at for _, _, done_at in completed)
+    last = max(done_at for _, _, done_at in completed)
+    deadline = time.monotonic() + drain_seconds
+    delay = 0.5
+    while True:
+        timestamps = sample_timestamps(bucket_name, first, current_timestamp())
+        if (timestamps and timestamps[-1] >= last) or time.monotonic() + delay > deadline:
+            break
+        time.sleep(delay)
+        delay = min(5.0, delay * 2)
+
+    lags = []
+    for _, _, done_at in completed:
+        index = bisect.bisect_left(timestamps, done_at)
+        if index < len(timestamps):
+            lags.append(timestamps[index] - done_at)
+    return lags, len(completed) - len(lags)
+
+
+def run_scenario(overrides=None, time_limit_seconds=None):
+    """
+    Run a scenario (DEFAULT_SCENARIO updated with overrides) and return its report.
+    With time_limit_seconds, e.g. the caller's remaining Lambda time, the run and the
+    drain are cut short so the report is returned within that limit.
+    """
+    scenario = {**DEFAULT_SCENARIO, **(overrides or {})}
+    workload = Workload(scenario)
+    seed = scenario['seed'] if scenario['seed'] is not None else random.randrange(2 ** 32)
+
+    started = time.monotonic()
+    time_limit = started + time_limit_seconds if time_limit_seconds is not None else None
+    deadline = started + scenario['duration_seconds']
+    if time_limit is not None:
+        deadline = min(deadline, time_limit)
+    with ThreadPoolExecutor(max_workers=scenario['workers']) as executor:
+        futures = [executor.submit(workload.run_worker, seed + worker, deadline)
+                   for worker in range(scenario['workers'])]
+    # A worker that failed outside the S3 calls would otherwise leave the report silently short
+    for future in futures:
+        future.result()
+    elapsed = time.monotonic() - started
+
+    drain_seconds = scenario['drain_seconds']
+    if time_limit is not None:
+        drain_seconds = max(0.0, min(drain_seconds, time_limit - time.monotonic()))
+    lags, unmatched = measure_lag(scenario['bucket'], workload.completed, drain_seconds)
+    report = {
+        'operations': len(workload.completed),
+        'errors': workload.errors,
+        'achieved_ops_per_second': round(len(workload.completed) / max(elapsed, 1e-9), 1),
+        'latency_ms': {
+            operation: percentiles([latency for op, latency, _ in workload.completed if op == operation])
+            for operation in OPERATIONS
+        },
+        'tracker_lag_ms': percentiles(lags),
+        'unmatched_operations': unmatched
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def parse_mix(value):
+    """Parse 'put=0.6,overwrite=0.3,delete=0.1'."""
+    mix = {}
+    for entry in value.split(','):
+        operation, _, weight = entry.partition('=')
+        mix[operation.strip()] = float(weight)
+    return mix
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', help='JSON file with scenario fields; command line flags override it')
+    parser.add_argument('--bucket')
+    parser.add_argument('--objects', type=int)
+    parser.add_argument('--prefixes', type=int)
+    parser.add_argument('--mix', type=parse_mix)
+    parser.add_argument('--ops-per-second', type=float)
+    parser.add_argument('--duration', type=float, dest='duration_seconds')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--drain', type=float, dest='drain_seconds')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.scenario:
+        with open(args.scenario) as f:
+            overrides.update(json.load(f))
+    overrides.update({name: value for name, value in vars(args).items() if name != 'scenario' and value is not None})
+    run_scenario(overrides)